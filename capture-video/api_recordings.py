@@ -2,18 +2,36 @@
 """
 API Flask pour récupérer les enregistrements vidéo depuis SQLite
 Utilise la nouvelle structure surveillance.db
+
+Les médias sont répartis en partitions mensuelles (media_partitions.py):
+l'id d'un enregistrement désigne sa partition, attachée à la demande, et
+la liste parcourt les partitions de la plus récente à la plus ancienne.
 """
 
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, Response, jsonify, send_file, request
 from flask_cors import CORS
+import os
 import sqlite3
 import io
+import base64
+import binascii
+import threading
 from datetime import datetime
 
+from db_cache import ConfigCache
+from media_partitions import ID_SHIFT, MediaPartitions, id_offset, split_media_id
+from media_store import iter_blob_chunks, media_file_path, payload_table, remove_unreferenced_file
+
 app = Flask(__name__)
 CORS(app)
 
-DB_PATH = "/data/surveillance.db"
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+
+partitions = MediaPartitions(DB_PATH)
+
+# Cache de la table configuration, partagé avec les services de capture
+config_cache = None
+config_cache_lock = threading.Lock()
 
 def get_db_connection():
     """Connexion à la base de données SQLite"""
@@ -22,36 +40,118 @@ def get_db_connection():
     return conn
 
 
+def encode_cursor(timestamp, id_media):
+    """Curseur opaque désignant la dernière ligne d'une page (timestamp, id_media)"""
+    raw = f"{timestamp!r}:{id_media}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (timestamp, id_media global)
+
+    Raises:
+        ValueError: curseur illisible
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, id_media = raw.split(':')
+        return float(timestamp), int(id_media)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"curseur invalide: {cursor}") from e
+
+
+def attach_recording(conn, recording_id):
+    """
+    Attache la partition d'un enregistrement
+
+    Returns:
+        tuple: (base, id_media local), base None si la partition n'existe pas
+    """
+    key, local_id = split_media_id(recording_id)
+    return partitions.attach(conn, key), local_id
+
+
+def get_config_cache():
+    """Démarre le cache de configuration au premier usage"""
+    global config_cache
+
+    with config_cache_lock:
+        if config_cache is None:
+            cache = ConfigCache(DB_PATH)
+            cache.start()
+            config_cache = cache
+
+    return config_cache
+
+
+def thumbnail_urls(id_media, has_thumbnail):
+    """URL de l'aperçu et de la bande d'images clés (None tant qu'absentes)"""
+    base = f'/api/recordings/{id_media}/thumbnail'
+    return {
+        'thumbnail_url': base if has_thumbnail else None,
+        'strip_url': f'{base}?strip=1' if has_thumbnail else None,
+    }
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check"""
     return jsonify({'status': 'ok', 'service': 'recordings-api'})
 
 
+@app.route('/api/config', methods=['GET'])
+def get_configuration():
+    """
+    Configuration système courante (servie depuis le cache en mémoire,
+    rafraîchi uniquement quand la table configuration change)
+    """
+    return jsonify(get_config_cache().as_dict())
+
+
 @app.route('/api/recordings', methods=['GET'])
 def list_recordings():
     """
-    Liste tous les enregistrements (médias) sans les blobs
+    Liste tous les enregistrements (médias) sans les blobs, du plus récent
+    au plus ancien (timestamp, puis id_media)
 
     Query params:
         - device_id: Filtrer par device
         - type_media: Filtrer par type (video/photo)
         - numero_camera: Filtrer par caméra (1 ou 2)
         - limit: Nombre max de résultats (default: 50)
-        - offset: Pagination (default: 0)
+        - cursor: Page suivante (next_cursor de la page précédente): la
+                  requête reprend après la dernière ligne via l'index
+                  (timestamp DESC, id_media DESC), même coût à toute profondeur
+        - offset: Pagination historique (default: 0), ignoré avec cursor
     """
     device_id = request.args.get('device_id')
     type_media = request.args.get('type_media')
     numero_camera = request.args.get('numero_camera', type=int)
-    limit = int(request.args.get('limit', 50))
-    offset = int(request.args.get('offset', 0))
+    try:
+        limit = int(request.args.get('limit', 50))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    if offset < 0:
+        return jsonify({'error': 'offset must be a non-negative integer'}), 400
+
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        offset = 0
 
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     query = """
         SELECT
-            m.id_media,
+            m.id_media + ? AS id_media,
             m.type_media,
             m.taille,
             m.duree,
@@ -60,37 +160,84 @@ def list_recordings():
             m.numero_camera,
             m.resolution,
             m.codec,
+            m.conteneur,
+            m.codecs,
             m.id_evenement,
             e.event_id,
             e.date_evenement,
             c.nom_capteur,
             c.type_capteur,
-            c.device_id
-        FROM media m
+            c.device_id,
+            t.apercu IS NOT NULL AS has_thumbnail
+        FROM {schema}.media m
         LEFT JOIN evenement e ON m.id_evenement = e.id_evenement
         LEFT JOIN capteur c ON m.id_capteur = c.id_capteur
+        LEFT JOIN {schema}.miniature t ON t.id_media = m.id_media
         WHERE 1=1
     """
 
+    # Lignes sautées par offset dans un mois qui n'alimente pas la page
+    count_query = """
+        SELECT COUNT(*)
+        FROM {schema}.media m
+        LEFT JOIN capteur c ON m.id_capteur = c.id_capteur
+        WHERE 1=1
+    """
+
+    filters = ""
     params = []
 
     if device_id:
-        query += " AND c.device_id = ?"
+        filters += " AND c.device_id = ?"
         params.append(device_id)
 
     if type_media:
-        query += " AND m.type_media = ?"
+        filters += " AND m.type_media = ?"
         params.append(type_media)
 
     if numero_camera:
-        query += " AND m.numero_camera = ?"
+        filters += " AND m.numero_camera = ?"
         params.append(numero_camera)
 
-    query += " ORDER BY m.timestamp DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
-
-    cursor.execute(query, params)
-    recordings = cursor.fetchall()
+    if after:
+        filters += " AND (m.timestamp, m.id_media) < (?, ?)"
+        after_key, after_local = split_media_id(after[1])
+
+    query += filters + " ORDER BY m.timestamp DESC, m.id_media DESC LIMIT ? OFFSET ?"
+    count_query += filters
+
+    # Partitions de la plus récente à la plus ancienne: les premières pages
+    # ne lisent que le mois courant, une page suivante reprend dans le mois
+    # de son curseur. Une ligne de plus que la page: y a-t-il une suite ?
+    # L'offset reste en SQL; un mois entièrement sauté n'est que compté.
+    wanted = limit + 1
+    skip = offset
+    recordings = []
+    for key in partitions.keys():
+        bound = []
+        if after:
+            if key > after_key:
+                continue
+            # Même timestamp dans un mois plus ancien: id global plus petit
+            bound = [after[0], after_local if key == after_key else 1 << ID_SHIFT]
+
+        schema = partitions.attach(conn, key)
+        if schema is None:
+            continue
+        rows = conn.execute(
+            query.format(schema=schema), [id_offset(key), *params, *bound, wanted - len(recordings), skip]
+        ).fetchall()
+        if rows:
+            skip = 0
+        elif skip:
+            skip -= conn.execute(count_query.format(schema=schema), [*params, *bound]).fetchone()[0]
+        recordings.extend(rows)
+        partitions.detach(conn, key)
+        if len(recordings) >= wanted:
+            break
+
+    has_more = len(recordings) > limit
+    recordings = recordings[:limit]
 
     result = []
     for row in recordings:
@@ -104,22 +251,33 @@ def list_recordings():
             'camera': row['numero_camera'],
             'resolution': row['resolution'],
             'codec': row['codec'],
+            'container': row['conteneur'],
+            'codecs': row['codecs'],
             'event_id': row['event_id'],
             'sensor': row['nom_capteur'],
             'sensor_type': row['type_capteur'],
             'device_id': row['device_id'],
             'video_url': f'/api/recordings/{row["id_media"]}/video',
+            **thumbnail_urls(row['id_media'], row['has_thumbnail']),
             'created_at': row['date_media']  # Pour compatibilité
         })
 
     conn.close()
 
-    return jsonify({
+    last = recordings[-1] if recordings else None
+
+    response = {
         'recordings': result,
         'count': len(result),
         'limit': limit,
-        'offset': offset
-    })
+        'next_cursor': encode_cursor(last['timestamp'], last['id_media']) if has_more else None
+    }
+    if after:
+        response['cursor'] = request.args['cursor']
+    else:
+        response['offset'] = offset
+
+    return jsonify(response)
 
 
 @app.route('/api/recordings/<int:recording_id>', methods=['GET'])
@@ -128,9 +286,13 @@ def get_recording(recording_id):
     Récupère les détails d'un média spécifique (sans le blob)
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    schema, local_id = attach_recording(conn, recording_id)
+    if schema is None:
+        conn.close()
+        return jsonify({'error': 'Recording not found'}), 404
 
-    cursor.execute("""
+    cursor = conn.cursor()
+    cursor.execute(f"""
         SELECT
             m.id_media,
             m.type_media,
@@ -141,6 +303,9 @@ def get_recording(recording_id):
             m.numero_camera,
             m.resolution,
             m.codec,
+            m.conteneur,
+            m.codecs,
+            m.priorite,
             m.id_evenement,
             e.event_id,
             e.date_evenement,
@@ -148,21 +313,34 @@ def get_recording(recording_id):
             e.metadata as event_metadata,
             c.nom_capteur,
             c.type_capteur,
-            c.device_id
-        FROM media m
+            c.device_id,
+            t.apercu IS NOT NULL AS has_thumbnail
+        FROM {schema}.media m
         LEFT JOIN evenement e ON m.id_evenement = e.id_evenement
         LEFT JOIN capteur c ON m.id_capteur = c.id_capteur
+        LEFT JOIN {schema}.miniature t ON t.id_media = m.id_media
         WHERE m.id_media = ?
-    """, (recording_id,))
+    """, (local_id,))
 
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
+        conn.close()
         return jsonify({'error': 'Recording not found'}), 404
 
+    # Événements couverts par le clip (rafale de détections fusionnées)
+    cursor.execute(f"""
+        SELECT e.event_id
+        FROM {schema}.media_evenement me
+        JOIN evenement e ON me.id_evenement = e.id_evenement
+        WHERE me.id_media = ?
+        ORDER BY e.timestamp
+    """, (local_id,))
+    linked_events = [r['event_id'] for r in cursor.fetchall()]
+    conn.close()
+
     return jsonify({
-        'id': row['id_media'],
+        'id': recording_id,
         'type': row['type_media'],
         'size': row['taille'],
         'duration': row['duree'],
@@ -171,6 +349,9 @@ def get_recording(recording_id):
         'camera': row['numero_camera'],
         'resolution': row['resolution'],
         'codec': row['codec'],
+        'container': row['conteneur'],
+        'codecs': row['codecs'],
+        'priority': row['priorite'],
         'event': {
             'id': row['id_evenement'],
             'event_id': row['event_id'],
@@ -178,48 +359,149 @@ def get_recording(recording_id):
             'state': row['etat_capteur'],
             'metadata': row['event_metadata']
         } if row['id_evenement'] else None,
+        'linked_events': linked_events,
         'sensor': {
             'name': row['nom_capteur'],
             'type': row['type_capteur'],
             'device_id': row['device_id']
         },
-        'video_url': f'/api/recordings/{row["id_media"]}/video'
+        'video_url': f'/api/recordings/{recording_id}/video',
+        **thumbnail_urls(recording_id, row['has_thumbnail'])
     })
 
 
 @app.route('/api/recordings/<int:recording_id>/video', methods=['GET'])
 def get_recording_video(recording_id):
     """
-    Télécharge la vidéo (blob) d'un média
+    Télécharge la vidéo d'un média (BLOB ou fichier de MEDIA_DIR)
+
+    Les clips MP4 fast start se lisent dès les premiers Ko et acceptent les
+    requêtes Range (navigation dans le clip); les anciens clips sont des
+    flux H.264 bruts, servis comme tels. ?download=1 force le téléchargement.
 
     Returns:
-        Video file (video/mp4)
+        Video file (video/mp4, ou video/h264 pour un flux brut)
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    schema, local_id = attach_recording(conn, recording_id)
+    row = None
 
-    cursor.execute("""
-        SELECT m.video, e.event_id, m.id_media
-        FROM media m
-        LEFT JOIN evenement e ON m.id_evenement = e.id_evenement
-        WHERE m.id_media = ?
-    """, (recording_id,))
-
-    row = cursor.fetchone()
-    conn.close()
+    if schema is not None:
+        row = conn.execute(f"""
+            SELECT m.chemin, m.codec, m.conteneur, e.event_id
+            FROM {schema}.media m
+            LEFT JOIN evenement e ON m.id_evenement = e.id_evenement
+            WHERE m.id_media = ?
+        """, (local_id,)).fetchone()
 
     if not row:
+        conn.close()
         return jsonify({'error': 'Recording not found'}), 404
 
-    video_blob = row['video']
-    event_id = row['event_id'] if row['event_id'] else f"media_{row['id_media']}"
+    event_id = row['event_id'] if row['event_id'] else f"media_{recording_id}"
+
+    # Photo de délestage (snapshot JPEG), clip MP4, ou flux brut
+    if row['codec'] == 'jpeg':
+        mimetype, as_attachment, download_name = 'image/jpeg', True, f'snapshot_{event_id}.jpg'
+    elif row['conteneur'] == 'mp4':
+        mimetype, as_attachment = 'video/mp4', request.args.get('download', type=int) == 1
+        download_name = f'recording_{event_id}.mp4'
+    else:
+        mimetype, as_attachment, download_name = 'video/h264', True, f'recording_{event_id}.h264'
+    ranged = row['conteneur'] == 'mp4'
+
+    if row['chemin']:
+        # Stockage fichier: servi directement depuis le disque
+        conn.close()
+        source = media_file_path(row['chemin'])
+        if not os.path.exists(source):
+            return jsonify({'error': 'Video file missing'}), 404
+        return send_file(
+            source,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=ranged
+        )
+
+    # Le BLOB n'est lu que pour les médias non migrés (media_contenu, ou
+    # media.video avant split-payloads), par blocs au fil de l'envoi
+    return send_blob(conn, schema, local_id, mimetype, as_attachment, download_name, ranged)
+
+
+def send_blob(conn, schema, local_id, mimetype, as_attachment, download_name, ranged):
+    """
+    Réponse streamée depuis le BLOB d'un média (iter_blob_chunks)
+
+    La connexion reste ouverte pendant l'envoi et est fermée par le
+    générateur. Avec `ranged`, une requête Range d'un seul intervalle est
+    servie en 206 (navigation dans un clip MP4).
+    """
+    table = payload_table(conn, local_id, schema)
+    size = conn.execute(
+        f"SELECT length(video) FROM {schema}.{table} WHERE id_media = ?", (local_id,)
+    ).fetchone()[0] or 0
+
+    start, stop = 0, size
+    partial = False
+    byte_range = request.range if ranged else None
+    if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            conn.close()
+            return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+        start, stop = bounds
+        partial = True
+
+    def generate():
+        try:
+            yield from iter_blob_chunks(conn, table, 'video', local_id, schema=schema, start=start, stop=stop)
+        finally:
+            conn.close()
+
+    response = Response(generate(), status=206 if partial else 200,
+                        mimetype=mimetype, direct_passthrough=True)
+    response.content_length = stop - start
+    if partial:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    if ranged:
+        response.accept_ranges = 'bytes'
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                         filename=download_name)
+    return response
+
+
+@app.route('/api/recordings/<int:recording_id>/thumbnail', methods=['GET'])
+def get_recording_thumbnail(recording_id):
+    """
+    Aperçu d'un média, ou sa bande d'images clés avec ?strip=1
+    (quelques Ko, mis en cache par le navigateur: une miniature ne change pas)
+
+    Returns:
+        Image JPEG, 404 si pas (encore) extraite
+    """
+    strip = request.args.get('strip', type=int) == 1
+    column = 'bande' if strip else 'apercu'
+
+    # Lecture directe dans la base de la partition (pas de jointure)
+    key, local_id = split_media_id(recording_id)
+    conn = partitions.connect(key)
+    row = None
+    if conn is not None:
+        row = conn.execute(
+            f"SELECT {column} FROM miniature WHERE id_media = ?", (local_id,)
+        ).fetchone()
+        conn.close()
+
+    if not row or row[0] is None:
+        return jsonify({'error': 'Thumbnail not available'}), 404
 
-    # Retourner le blob comme fichier
     return send_file(
-        io.BytesIO(video_blob),
-        mimetype='video/mp4',
-        as_attachment=True,
-        download_name=f'recording_{event_id}.mp4'
+        io.BytesIO(row[0]),
+        mimetype='image/jpeg',
+        download_name=f'recording_{recording_id}_{"strip" if strip else "thumbnail"}.jpg',
+        etag=f'{recording_id}-{column}',
+        max_age=86400
     )
 
 
@@ -229,12 +511,28 @@ def delete_recording(recording_id):
     Supprime un média
     """
     conn = get_db_connection()
+    schema, local_id = attach_recording(conn, recording_id)
+    if schema is None:
+        conn.close()
+        return jsonify({'error': 'Recording not found'}), 404
+
     cursor = conn.cursor()
 
-    cursor.execute("DELETE FROM media WHERE id_media = ?", (recording_id,))
+    row = cursor.execute(
+        f"SELECT chemin FROM {schema}.media WHERE id_media = ?", (local_id,)
+    ).fetchone()
+
+    cursor.execute(f"DELETE FROM {schema}.media WHERE id_media = ?", (local_id,))
     deleted = cursor.rowcount
+    # foreign_keys désactivé: les liens ne partent pas en cascade
+    cursor.execute(f"DELETE FROM {schema}.media_evenement WHERE id_media = ?", (local_id,))
 
     conn.commit()
+
+    # Fichier supprimé seulement si aucun autre média ne partage ce contenu
+    if row and row['chemin']:
+        remove_unreferenced_file(conn, row['chemin'], schema=schema)
+
     conn.close()
 
     if deleted == 0:
@@ -243,86 +541,122 @@ def delete_recording(recording_id):
     return jsonify({'message': 'Recording deleted', 'id': recording_id})
 
 
-@app.route('/api/recordings/stats', methods=['GET'])
-def get_stats():
+@app.route('/api/recordings/<int:recording_id>', methods=['PATCH'])
+def update_recording(recording_id):
     """
-    Statistiques sur les enregistrements
+    Modifie la priorité d'un média (politique_eviction = priorite)
+
+    Body JSON:
+        - priority: entier, les plus basses sont évincées en premier
     """
+    data = request.get_json(silent=True) or {}
+    try:
+        priorite = int(data['priority'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'priority (integer) required'}), 400
+
     conn = get_db_connection()
+    schema, local_id = attach_recording(conn, recording_id)
+    if schema is None:
+        conn.close()
+        return jsonify({'error': 'Recording not found'}), 404
+
     cursor = conn.cursor()
 
-    # Statistiques globales
-    cursor.execute("""
-        SELECT
-            COUNT(*) as total_recordings,
-            SUM(taille) as total_size_bytes
-        FROM media
-    """)
-    global_stats = cursor.fetchone()
-
-    # Par type de média
-    cursor.execute("""
-        SELECT
-            type_media,
-            COUNT(*) as count,
-            SUM(taille) as total_size,
-            AVG(duree) as avg_duration
-        FROM media
-        GROUP BY type_media
-    """)
-    by_type = []
-    for row in cursor.fetchall():
-        by_type.append({
-            'type': row['type_media'],
-            'count': row['count'],
-            'total_size': row['total_size'],
-            'avg_duration': row['avg_duration']
-        })
+    cursor.execute(f"UPDATE {schema}.media SET priorite = ? WHERE id_media = ?", (priorite, local_id))
+    updated = cursor.rowcount
 
-    # Par caméra
-    cursor.execute("""
-        SELECT
-            numero_camera,
-            COUNT(*) as count,
-            SUM(taille) as total_size
-        FROM media
-        GROUP BY numero_camera
-    """)
-    by_camera = []
-    for row in cursor.fetchall():
-        by_camera.append({
-            'camera': row['numero_camera'],
-            'count': row['count'],
-            'total_size': row['total_size']
-        })
+    conn.commit()
+    conn.close()
 
-    # Par device
-    cursor.execute("""
-        SELECT
-            c.device_id,
-            COUNT(m.id_media) as count,
-            SUM(m.taille) as total_size
-        FROM media m
-        LEFT JOIN capteur c ON m.id_capteur = c.id_capteur
-        GROUP BY c.device_id
-    """)
-    by_device = []
-    for row in cursor.fetchall():
-        by_device.append({
-            'device_id': row['device_id'],
-            'count': row['count'],
-            'total_size': row['total_size']
-        })
+    if updated == 0:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    return jsonify({'id': recording_id, 'priority': priorite})
+
+
+@app.route('/api/recordings/stats', methods=['GET'])
+def get_stats():
+    """
+    Statistiques sur les enregistrements (toutes partitions: une requête
+    groupée par partition, cumulée ici)
+    """
+    conn = get_db_connection()
+
+    # (type, caméra, device) -> [nombre, taille, somme des durées, durées connues]
+    groups = {}
+    for key in partitions.keys():
+        schema = partitions.attach(conn, key)
+        if schema is None:
+            continue
+        for row in conn.execute(f"""
+            SELECT
+                m.type_media,
+                m.numero_camera,
+                c.device_id,
+                COUNT(*) as count,
+                SUM(m.taille) as total_size,
+                SUM(m.duree) as total_duration,
+                COUNT(m.duree) as durations
+            FROM {schema}.media m
+            LEFT JOIN capteur c ON m.id_capteur = c.id_capteur
+            GROUP BY m.type_media, m.numero_camera, c.device_id
+        """):
+            totals = groups.setdefault((row['type_media'], row['numero_camera'], row['device_id']), [0, 0, 0, 0])
+            totals[0] += row['count']
+            totals[1] += row['total_size'] or 0
+            totals[2] += row['total_duration'] or 0
+            totals[3] += row['durations']
+        partitions.detach(conn, key)
 
     conn.close()
 
+    def summarize(index):
+        """Cumule les groupes sur une dimension (0: type, 1: caméra, 2: device)"""
+        summary = {}
+        for group, totals in groups.items():
+            current = summary.setdefault(group[index], [0, 0, 0, 0])
+            for i, value in enumerate(totals):
+                current[i] += value
+        return sorted(summary.items(), key=lambda item: (item[0] is not None, item[0]))
+
+    by_type = [{
+        'type': type_media,
+        'count': count,
+        'total_size': total_size,
+        'avg_duration': total_duration / durations if durations else None
+    } for type_media, (count, total_size, total_duration, durations) in summarize(0)]
+
+    by_camera = [{
+        'camera': camera,
+        'count': count,
+        'total_size': total_size
+    } for camera, (count, total_size, _, _) in summarize(1)]
+
+    by_device = [{
+        'device_id': device,
+        'count': count,
+        'total_size': total_size
+    } for device, (count, total_size, _, _) in summarize(2)]
+
+    total_recordings = sum(totals[0] for totals in groups.values())
+    total_size_bytes = sum(totals[1] for totals in groups.values()) if total_recordings else None
+
+    # Budget de stockage (budget_stockage_mo, 0 = illimité)
+    config = get_config_cache()
+    budget_mb = config.get_float('budget_stockage_mo', 0) or 0
+
     return jsonify({
-        'total_recordings': global_stats['total_recordings'],
-        'total_size_bytes': global_stats['total_size_bytes'],
-        'total_size_mb': global_stats['total_size_bytes'] / 1024 / 1024 if global_stats['total_size_bytes'] else 0,
+        'total_recordings': total_recordings,
+        'total_size_bytes': total_size_bytes,
+        'total_size_mb': total_size_bytes / 1024 / 1024 if total_size_bytes else 0,
         'by_type': by_type,
         'by_camera': by_camera,
-        'by_device': by_device
+        'by_device': by_device,
+        'storage_budget': {
+            'budget_mb': budget_mb or None,
+            'eviction_policy': config.get('politique_eviction', 'anciens'),
+        }
     })
 
 
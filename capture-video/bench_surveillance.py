@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Benchmark d'ingestion du service de surveillance (tempête d'événements MQTT)
+
+- Appelle le vrai surveillance_service.on_message avec des messages
+  sensor/motion, sensor/button et sensor/pressure synthétiques, au débit
+  demandé par topic, depuis un seul thread (comme la boucle paho)
+- Base surveillance.db temporaire initialisée avec init_surveillance_db.sql
+- Caméras synthétiques (SyntheticBackend, --cameras 1 ou 2): H.264 valide au débit demandé,
+  cadencé à --time-scale fois le temps réel, avec démarrage lent et
+  pannes simulés si demandé
+- Rapport: débit offert/atteint et percentiles p50/p95/p99 du callback
+  MQTT, de chaque voie (contrôle et capteurs: réception → COMMIT, capture:
+  réception → début d'enregistrement) et d'une capture (mise en file →
+  média stocké)
+
+    python3 bench_surveillance.py --rate motion=5,button=20,pressure=20 --duration 10
+    python3 bench_surveillance.py --rate motion=50 --clip-seconds 1 --time-scale 0.1 --json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Topics et payloads au format des services capteurs
+TOPICS = {
+    'motion': ('sensor/motion', 'MOTION_DETECTED', 'sensor-motion', {'presence': True, 'gpio_pin': 17}),
+    'button': ('sensor/button', 'BUTTON_PRESSED', 'sensor-button', {'pressed': True, 'gpio_pin': 27}),
+    'pressure': ('sensor/pressure', 'PRESSURE_DETECTED', 'sensor-pressure', {'pressure': 'medium'}),
+}
+
+
+# ============================================
+# Mesures
+# ============================================
+
+def percentile(values, pct):
+    """Percentile par rang le plus proche (values triées)"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class LatencyRecorder:
+    """Échantillons de latence (secondes), thread-safe"""
+
+    def __init__(self):
+        self._values = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            values = sorted(self._values)
+        return {
+            'count': len(values),
+            'p50_ms': _ms(percentile(values, 50)),
+            'p95_ms': _ms(percentile(values, 95)),
+            'p99_ms': _ms(percentile(values, 99)),
+            'max_ms': _ms(values[-1] if values else None),
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+# ============================================
+# Génération de charge
+# ============================================
+
+def parse_rates(text):
+    """'motion=5,button=20' → {'motion': 5.0, 'button': 20.0}"""
+    rates = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in TOPICS:
+            raise argparse.ArgumentTypeError(f"topic inconnu: {name} ({', '.join(TOPICS)})")
+        rates[name] = float(value)
+    return rates
+
+
+def build_schedule(rates, duration):
+    """Instants d'envoi (relatifs) de chaque message, tous topics mélangés"""
+    schedule = []
+    for name, rate in rates.items():
+        if rate <= 0:
+            continue
+        interval = 1.0 / rate
+        count = int(duration * rate)
+        schedule.extend((i * interval, name) for i in range(count))
+    schedule.sort()
+    return schedule
+
+
+def make_message(name, device_id):
+    import paho.mqtt.client as mqtt
+
+    topic, event_type, source, data = TOPICS[name]
+    message = mqtt.MQTTMessage(topic=topic.encode())
+    message.payload = json.dumps({
+        'event_id': str(uuid.uuid4()),
+        'device_id': device_id,
+        'source': source,
+        'type': event_type,
+        'data': data,
+        'timestamp': time.time(),
+    }).encode()
+    return message
+
+
+# ============================================
+# Benchmark
+# ============================================
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='bench-surveillance-')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'surveillance.db')
+    os.environ['CAPTURE_WORKERS'] = str(args.workers)
+
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+
+    # Le module affiche sa bannière à l'import
+    with contextlib.redirect_stdout(output):
+        import surveillance_service as service
+    from capture_backends import BackendSelector, SyntheticBackend
+
+    service.TEMP_VIDEO_DIR = workdir
+
+    handler_latency = LatencyRecorder()
+    capture_latency = LatencyRecorder()
+    lane_latency = {lane.name: LatencyRecorder() for lane in service.LANES}
+    persisted = {'ok': 0, 'errors': 0, 'last': None}
+    persisted_lock = threading.Lock()
+
+    # Instrumentation: latence par voie (réception → fin) et COMMIT des événements
+    save_evenement_async = service.save_evenement_async
+    process_capture = service.process_capture
+
+    def timed_observe(lane, observe):
+        def wrapper(received, error=False):
+            lane_latency[lane.name].add(time.monotonic() - received)
+            observe(received, error)
+        return wrapper
+
+    for lane in service.LANES:
+        lane.observe = timed_observe(lane, lane.observe)
+
+    def timed_save_evenement_async(*a, **kw):
+        future = save_evenement_async(*a, **kw)
+        if future:
+            def done(f):
+                with persisted_lock:
+                    persisted['errors' if f.exception() else 'ok'] += 1
+                    persisted['last'] = time.perf_counter()
+            future.add_done_callback(done)
+        return future
+
+    def timed_process_capture(job):
+        ok = process_capture(job)
+        if ok:
+            capture_latency.add(time.monotonic() - job['enqueued_at'])
+        return ok
+
+    service.save_evenement_async = timed_save_evenement_async
+    service.process_capture = timed_process_capture
+
+    schedule = build_schedule(args.rate, args.duration)
+
+    try:
+        with contextlib.redirect_stdout(output):
+            service.init_database()
+            service.start_db_writer()
+            service.db_writer.execute(
+                "UPDATE configuration SET valeur = ? WHERE cle = 'duree_enregistrement'",
+                (str(args.clip_seconds),)
+            )
+            service.start_caches()
+            service.cameras = [
+                service.make_camera(numero, BackendSelector([SyntheticBackend(
+                    startup_ms=args.startup_ms,
+                    failure_rate=args.failure_rate,
+                    time_scale=args.time_scale,
+                    bitrate_kbps=args.bitrate_kbps,
+                )]))
+                for numero in range(1, args.cameras + 1)
+            ]
+            service.probe_cameras()
+            service.start_capture_workers(args.workers)
+            service.start_lanes()
+
+            messages = [(offset, make_message(name, service.DEVICE_ID)) for offset, name in schedule]
+
+            started = time.perf_counter()
+            for offset, message in messages:
+                delay = started + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent = time.perf_counter()
+                service.on_message(None, None, message)
+                handler_latency.add(time.perf_counter() - sent)
+            sent_elapsed = time.perf_counter() - started
+
+            # Attendre les COMMIT et les captures encore en file
+            drain_deadline = time.monotonic() + args.drain_timeout
+            while time.monotonic() < drain_deadline:
+                with persisted_lock:
+                    done = persisted['ok'] + persisted['errors']
+                if done >= len(messages) and service.capture_queue.unfinished_tasks == 0:
+                    break
+                time.sleep(0.05)
+
+            writer_stats = service.db_writer.get_stats()
+            capture_stats = service.get_capture_stats()
+            lane_stats = service.get_lane_stats()
+
+            service.stop_lanes()
+            service.stop_capture_workers(timeout=args.drain_timeout)
+            service.stop_db_writer()
+            service.stop_caches()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    persist_window = (persisted['last'] - started) if persisted['last'] else None
+
+    return {
+        'offered': {
+            'rates': args.rate,
+            'cameras': args.cameras,
+            'messages': len(schedule),
+            'duration_s': args.duration,
+        },
+        'achieved': {
+            'send_elapsed_s': round(sent_elapsed, 3),
+            'send_rate': round(len(schedule) / sent_elapsed, 1) if sent_elapsed else None,
+            'persisted': persisted['ok'],
+            'persist_errors': persisted['errors'],
+            'persist_rate': round(persisted['ok'] / persist_window, 1) if persist_window else None,
+        },
+        'latency': {
+            'on_message': handler_latency.summary(),
+            **{f"lane_{name}": recorder.summary() for name, recorder in lane_latency.items()},
+            'capture': capture_latency.summary(),
+        },
+        'slo_violations': {name: stats['slo_violations'] for name, stats in lane_stats.items()},
+        'writer': writer_stats,
+        'capture': {
+            key: capture_stats[key]
+            for key in ('completed', 'failed', 'coalesced', 'shed', 'max_queue_depth', 'avg_wait_s')
+        },
+    }
+
+
+def print_report(result):
+    offered = result['offered']
+    achieved = result['achieved']
+
+    print(f"📈 Benchmark surveillance_service.on_message")
+    print(f"   Offert: {offered['messages']} messages en {offered['duration_s']}s {offered['rates']}")
+    print(f"   Envoyé: {achieved['send_rate']} msg/s ({achieved['send_elapsed_s']}s)")
+    print(f"   Persisté: {achieved['persisted']} événements "
+          f"({achieved['persist_rate']} evt/s, {achieved['persist_errors']} erreurs)")
+
+    for name, summary in result['latency'].items():
+        print(f"   {name:<12} n={summary['count']:<6} p50={summary['p50_ms']}ms "
+              f"p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms max={summary['max_ms']}ms")
+    print(f"   SLO dépassés: {result['slo_violations']}")
+
+    writer = result['writer']
+    capture = result['capture']
+    print(f"   Écrivain: {writer['commits']} COMMIT pour {writer['writes']} écritures "
+          f"(lot max {writer['max_batch']})")
+    print(f"   Captures: {capture['completed']} ok, {capture['failed']} échecs, "
+          f"{capture['coalesced']} fusionnées, {capture['shed']} délestées, "
+          f"file max {capture['max_queue_depth']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark d'ingestion MQTT du service de surveillance")
+    parser.add_argument('--rate', type=parse_rates, default=parse_rates('motion=2,button=10,pressure=10'),
+                        help="Messages/s par topic (ex: motion=5,button=20,pressure=20)")
+    parser.add_argument('--duration', type=float, default=10, help="Durée d'envoi (s)")
+    parser.add_argument('--workers', type=int, default=1, help="Workers de capture")
+    parser.add_argument('--cameras', type=int, default=1, choices=(1, 2),
+                        help="Caméras synthétiques enregistrées en parallèle")
+    parser.add_argument('--clip-seconds', type=int, default=2, help="duree_enregistrement des clips")
+    parser.add_argument('--bitrate-kbps', type=int, default=2000, help="Débit de la caméra synthétique")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="Cadence de la caméra synthétique (1 = temps réel, 0 = au plus vite)")
+    parser.add_argument('--startup-ms', type=int, default=0, help="Démarrage simulé de l'encodeur")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Probabilité d'échec par capture")
+    parser.add_argument('--drain-timeout', type=float, default=60,
+                        help="Attente max des écritures et captures en fin de run (s)")
+    parser.add_argument('--json', action='store_true', help="Rapport JSON (comparaison entre versions)")
+    parser.add_argument('--verbose', action='store_true', help="Afficher les logs du service")
+
+    args = parser.parse_args(argv)
+    result = run_benchmark(args)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Backends de capture vidéo (libcamera-vid, ffmpeg/v4l2, raspivid, synthetic)
+
+- Chaque backend sait se sonder et construire ses commandes
+  (enregistrement d'un fichier ou flux continu sur stdout)
+- BackendSelector sonde les backends une seule fois au démarrage et
+  mémorise le premier disponible avec ses capacités
+- Nouveau sondage seulement après CAPTURE_REPROBE_AFTER échecs consécutifs
+  (ou toutes les CAPTURE_REPROBE_INTERVAL secondes si aucun n'est disponible)
+- Durée et nombre de captures/échecs suivis par backend
+- CAPTURE_BACKENDS choisit les backends et leur ordre (ex: "synthetic"
+  pour tester la capture sans caméra)
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from metrics import REGISTRY
+from synthetic_camera import SYNTHETIC_BITRATE_KBPS, SYNTHETIC_SOURCE_DIR, make_source, write_frames
+
+CAPTURE_REPROBE_AFTER = int(os.getenv("CAPTURE_REPROBE_AFTER", 3))
+CAPTURE_REPROBE_INTERVAL = int(os.getenv("CAPTURE_REPROBE_INTERVAL", 60))
+CAPTURE_DEVICE = os.getenv("CAPTURE_DEVICE", "/dev/video0")
+CAPTURE_BACKENDS = os.getenv("CAPTURE_BACKENDS", "libcamera-vid,ffmpeg,raspivid")
+SYNTHETIC_STARTUP_MS = int(os.getenv("SYNTHETIC_STARTUP_MS", 0))
+SYNTHETIC_FAILURE_RATE = float(os.getenv("SYNTHETIC_FAILURE_RATE", 0))
+SYNTHETIC_TIME_SCALE = float(os.getenv("SYNTHETIC_TIME_SCALE", 1.0))
+PROBE_TIMEOUT = 10
+
+CAPTURES_METRIC = REGISTRY.counter(
+    'capture_backend_captures_total', "Captures réussies par backend", ('backend',)
+)
+FAILURES_METRIC = REGISTRY.counter(
+    'capture_backend_failures_total', "Captures échouées par backend", ('backend',)
+)
+DURATION_METRIC = REGISTRY.histogram(
+    'capture_backend_duration_seconds', "Durée d'une capture réussie par backend", ('backend',)
+)
+
+
+class CaptureError(Exception):
+    """Échec d'une capture par un backend"""
+
+
+class CaptureBackend:
+    """
+    Base des backends: sonde + commandes
+
+    Args:
+        camera: index de la caméra CSI (libcamera-vid, raspivid)
+        device: périphérique V4L2 (ffmpeg)
+    """
+
+    name = None
+    binary = None
+    # Format des photos de snapshot() (codec de la ligne media)
+    snapshot_codec = 'jpeg'
+
+    def __init__(self, camera=0, device=CAPTURE_DEVICE):
+        self.camera = camera
+        self.device = device
+
+    def probe(self):
+        """
+        Vérifie que le backend peut capturer sur cet hôte
+
+        Returns:
+            dict | None: capacités détectées, None si indisponible
+        """
+        path = shutil.which(self.binary)
+        if not path:
+            return None
+        return {'path': path}
+
+    def record_command(self, output_file, settings):
+        raise NotImplementedError
+
+    def stream_command(self, settings):
+        """Commande d'encodage continu H.264 Annex B sur stdout"""
+        raise NotImplementedError
+
+    def snapshot_command(self, output_file, settings):
+        """Commande de capture d'une photo"""
+        raise NotImplementedError
+
+    def record(self, output_file, settings):
+        """Enregistre settings['duration'] secondes dans output_file"""
+        self._run(self.record_command(output_file, settings), settings['duration'] + 5)
+
+    def snapshot(self, output_file, settings):
+        """Capture une photo (snapshot_codec) dans output_file"""
+        self._run(self.snapshot_command(output_file, settings), PROBE_TIMEOUT)
+
+    def _run(self, cmd, timeout):
+        try:
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+            raise CaptureError(str(e))
+
+        if result.returncode != 0:
+            raise CaptureError(f"{self.name} failed: {result.stderr.strip()[-200:]}")
+
+
+class LibcameraBackend(CaptureBackend):
+    """libcamera-vid (Raspberry Pi OS moderne)"""
+
+    name = "libcamera-vid"
+    binary = "libcamera-vid"
+
+    def probe(self):
+        capabilities = super().probe()
+        if not capabilities:
+            return None
+
+        try:
+            result = subprocess.run(
+                [self.binary, "--list-cameras"],
+                capture_output=True,
+                text=True,
+                timeout=PROBE_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+
+        output = result.stdout + result.stderr
+        if "No cameras available" in output:
+            return None
+
+        # Lignes du type "0 : imx219 [3280x2464] (/base/soc/...)"
+        cameras = [line for line in output.splitlines() if line.strip()[:1].isdigit()]
+        if cameras and self.camera >= len(cameras):
+            return None
+        capabilities['cameras'] = len(cameras)
+        capabilities['camera'] = self.camera
+        return capabilities
+
+    def record_command(self, output_file, settings):
+        return [
+            "libcamera-vid",
+            "--camera", str(self.camera),
+            "-t", str(settings['duration'] * 1000),
+            "--width", str(settings['width']),
+            "--height", str(settings['height']),
+            "--framerate", str(settings['fps']),
+            "--codec", "h264",
+            "-o", output_file,
+            "--nopreview"
+        ]
+
+    def stream_command(self, settings):
+        return [
+            "libcamera-vid",
+            "--camera", str(self.camera),
+            "-t", "0",
+            "--width", str(settings['width']),
+            "--height", str(settings['height']),
+            "--framerate", str(settings['fps']),
+            "--codec", "h264",
+            "--inline",
+            "--intra", str(settings['fps']),
+            "-o", "-",
+            "--nopreview"
+        ]
+
+    def snapshot_command(self, output_file, settings):
+        return [
+            "libcamera-still",
+            "--camera", str(self.camera),
+            "-t", "1",
+            "--width", str(settings['width']),
+            "--height", str(settings['height']),
+            "-o", output_file,
+            "--nopreview"
+        ]
+
+
+class FfmpegBackend(CaptureBackend):
+    """ffmpeg avec v4l2 (plus universel)"""
+
+    name = "ffmpeg"
+    binary = "ffmpeg"
+
+    def probe(self):
+        capabilities = super().probe()
+        if not capabilities or not os.path.exists(self.device):
+            return None
+        capabilities['device'] = self.device
+        return capabilities
+
+    def record_command(self, output_file, settings):
+        return [
+            "ffmpeg",
+            "-f", "v4l2",
+            "-framerate", str(settings['fps']),
+            "-video_size", f"{settings['width']}x{settings['height']}",
+            "-i", self.device,
+            "-t", str(settings['duration']),
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-y",
+            output_file
+        ]
+
+    def stream_command(self, settings):
+        return [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-f", "v4l2",
+            "-framerate", str(settings['fps']),
+            "-video_size", f"{settings['width']}x{settings['height']}",
+            "-i", self.device,
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-tune", "zerolatency",
+            "-g", str(settings['fps']),
+            "-x264-params", "repeat-headers=1",
+            "-f", "h264",
+            "-"
+        ]
+
+    def snapshot_command(self, output_file, settings):
+        return [
+            "ffmpeg",
+            "-f", "v4l2",
+            "-video_size", f"{settings['width']}x{settings['height']}",
+            "-i", self.device,
+            "-frames:v", "1",
+            "-y",
+            output_file
+        ]
+
+
+class RaspividBackend(CaptureBackend):
+    """raspivid (Raspberry Pi ancien)"""
+
+    name = "raspivid"
+    binary = "raspivid"
+
+    def record_command(self, output_file, settings):
+        return [
+            "raspivid",
+            "-cs", str(self.camera),
+            "-t", str(settings['duration'] * 1000),
+            "-w", str(settings['width']),
+            "-h", str(settings['height']),
+            "-fps", str(settings['fps']),
+            "-o", output_file,
+            "-n"
+        ]
+
+    def stream_command(self, settings):
+        return [
+            "raspivid",
+            "-cs", str(self.camera),
+            "-t", "0",
+            "-w", str(settings['width']),
+            "-h", str(settings['height']),
+            "-fps", str(settings['fps']),
+            "-ih",
+            "-g", str(settings['fps']),
+            "-o", "-",
+            "-n"
+        ]
+
+    def snapshot_command(self, output_file, settings):
+        return [
+            "raspistill",
+            "-cs", str(self.camera),
+            "-t", "1",
+            "-w", str(settings['width']),
+            "-h", str(settings['height']),
+            "-o", output_file,
+            "-n"
+        ]
+
+
+class SyntheticBackend(CaptureBackend):
+    """
+    Caméra synthétique (synthetic_camera.py): H.264 valide sans matériel
+
+    Simule le temps de démarrage de l'encodeur (startup_ms), des pannes
+    (failure_rate, probabilité par capture) et une cadence réelle
+    (time_scale = 1) ou accélérée (time_scale = 0: aussi vite que possible).
+    """
+
+    name = "synthetic"
+    # Une image IDR (SPS/PPS inclus) tient lieu de photo
+    snapshot_codec = 'h264'
+
+    def __init__(self, startup_ms=SYNTHETIC_STARTUP_MS, failure_rate=SYNTHETIC_FAILURE_RATE,
+                 time_scale=SYNTHETIC_TIME_SCALE, bitrate_kbps=SYNTHETIC_BITRATE_KBPS,
+                 source_dir=SYNTHETIC_SOURCE_DIR, camera=0, device=CAPTURE_DEVICE):
+        super().__init__(camera, device)
+        self.startup_ms = startup_ms
+        self.failure_rate = failure_rate
+        self.time_scale = time_scale
+        self.bitrate_kbps = bitrate_kbps
+        self.source_dir = source_dir
+
+    def probe(self):
+        if self.source_dir and not os.path.isdir(self.source_dir):
+            return None
+        return {
+            'source': self.source_dir or 'mire',
+            'bitrate_kbps': self.bitrate_kbps,
+            'startup_ms': self.startup_ms,
+            'failure_rate': self.failure_rate,
+        }
+
+    def record(self, output_file, settings):
+        if self.startup_ms:
+            time.sleep(self.startup_ms / 1000)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise CaptureError(f"{self.name} failed: panne simulée")
+
+        try:
+            source = make_source(
+                settings['width'], settings['height'], settings['fps'],
+                self.bitrate_kbps, self.source_dir
+            )
+            with open(output_file, 'wb') as f:
+                write_frames(
+                    f, source, int(settings['duration'] * settings['fps']),
+                    settings['fps'], self.time_scale
+                )
+        except (OSError, ValueError) as e:
+            raise CaptureError(str(e))
+
+    def snapshot(self, output_file, settings):
+        self.record(output_file, dict(settings, duration=1 / settings['fps']))
+
+    def stream_command(self, settings):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_camera.py")
+        cmd = [
+            sys.executable, script, "stream",
+            "--width", str(settings['width']),
+            "--height", str(settings['height']),
+            "--fps", str(settings['fps']),
+            "--bitrate-kbps", str(self.bitrate_kbps),
+            "--failure-rate", str(self.failure_rate),
+        ]
+        if self.source_dir:
+            cmd += ["--source-dir", self.source_dir]
+        return cmd
+
+
+BACKEND_TYPES = {
+    backend.name: backend
+    for backend in (LibcameraBackend, FfmpegBackend, RaspividBackend, SyntheticBackend)
+}
+
+
+def default_backends(names=CAPTURE_BACKENDS, camera=0, device=CAPTURE_DEVICE):
+    """Backends par ordre de préférence (CAPTURE_BACKENDS) pour une caméra"""
+    backends = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in BACKEND_TYPES:
+            raise ValueError(f"Backend de capture inconnu: {name} ({', '.join(BACKEND_TYPES)})")
+        backends.append(BACKEND_TYPES[name](camera=camera, device=device))
+    return backends
+
+
+class BackendSelector:
+    """
+    Mémorise le backend de capture qui fonctionne
+
+    Le sondage n'a lieu qu'au premier usage puis après `reprobe_after`
+    échecs consécutifs du backend actif. En cas d'échec ponctuel, les autres
+    backends déjà sondés disponibles sont essayés pour ne pas perdre l'événement.
+    """
+
+    def __init__(self, backends=None, reprobe_after=CAPTURE_REPROBE_AFTER):
+        self.backends = backends if backends is not None else default_backends()
+        self.reprobe_after = max(1, reprobe_after)
+
+        self.active = None
+        self.capabilities = {}
+        self._probed_at = None
+        self._consecutive_failures = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            backend.name: {'captures': 0, 'failures': 0, 'total_s': 0.0, 'last_s': None}
+            for backend in self.backends
+        }
+
+    def probe(self):
+        """
+        Sonde tous les backends et retient le premier disponible
+
+        Returns:
+            CaptureBackend | None: backend actif
+        """
+        capabilities = {}
+        for backend in self.backends:
+            try:
+                found = backend.probe()
+            except Exception as e:
+                print(f"   ⚠️  Sondage {backend.name} en erreur: {e}")
+                found = None
+            if found is not None:
+                capabilities[backend.name] = found
+
+        with self._lock:
+            self.capabilities = capabilities
+            self.active = next((b for b in self.backends if b.name in capabilities), None)
+            self._probed_at = time.monotonic()
+            self._consecutive_failures = 0
+            active = self.active
+
+        if active:
+            print(f"🎥 Backend de capture: {active.name} {capabilities[active.name]}")
+        else:
+            print(f"❌ Aucun backend de capture disponible")
+        return active
+
+    def available_backends(self):
+        """Backends disponibles au dernier sondage, actif en premier"""
+        if self._probed_at is None or (
+            self.active is None
+            and time.monotonic() - self._probed_at >= CAPTURE_REPROBE_INTERVAL
+        ):
+            self.probe()
+
+        with self._lock:
+            available = [b for b in self.backends if b.name in self.capabilities]
+            if self.active in available:
+                available.remove(self.active)
+                available.insert(0, self.active)
+        return available
+
+    def record(self, output_file, settings):
+        """
+        Capture avec le backend actif (puis les autres disponibles)
+
+        Returns:
+            str | None: nom du backend ayant réussi, None si tous ont échoué
+        """
+        for backend in self.available_backends():
+            started = time.monotonic()
+            try:
+                backend.record(output_file, settings)
+            except CaptureError as e:
+                self._record_failure(backend, e)
+                continue
+
+            elapsed = time.monotonic() - started
+            self._record_success(backend, elapsed)
+            print(f"   ✅ Capturé avec {backend.name} ({elapsed:.1f}s)")
+            return backend.name
+
+        return None
+
+    def snapshot(self, output_file, settings):
+        """
+        Photo avec le backend actif (puis les autres disponibles)
+
+        Les échecs ne comptent pas pour le nouveau sondage: la caméra peut
+        être occupée par un enregistrement en cours.
+
+        Returns:
+            CaptureBackend | None: backend ayant réussi (snapshot_codec)
+        """
+        for backend in self.available_backends():
+            try:
+                backend.snapshot(output_file, settings)
+            except (CaptureError, NotImplementedError) as e:
+                print(f"   ⚠️  Photo {backend.name}: {e or 'non supportée'}")
+                continue
+            return backend
+        return None
+
+    def _record_success(self, backend, elapsed):
+        CAPTURES_METRIC.inc(backend=backend.name)
+        DURATION_METRIC.observe(elapsed, backend=backend.name)
+
+        with self._lock:
+            stats = self._stats[backend.name]
+            stats['captures'] += 1
+            stats['total_s'] += elapsed
+            stats['last_s'] = elapsed
+            if backend is self.active:
+                self._consecutive_failures = 0
+
+    def _record_failure(self, backend, error):
+        print(f"   ⚠️  {backend.name}: {error}")
+        FAILURES_METRIC.inc(backend=backend.name)
+
+        with self._lock:
+            self._stats[backend.name]['failures'] += 1
+            if backend is not self.active:
+                return
+            self._consecutive_failures += 1
+            reprobe = self._consecutive_failures >= self.reprobe_after
+
+        if reprobe:
+            print(f"🔎 {self.reprobe_after} échecs consécutifs de {backend.name}, nouveau sondage")
+            self.probe()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: backend actif, capacités et statistiques par backend
+        """
+        with self._lock:
+            backends = {}
+            for name, stats in self._stats.items():
+                stats = dict(stats)
+                stats['avg_s'] = stats['total_s'] / stats['captures'] if stats['captures'] else None
+                backends[name] = stats
+            return {
+                'active': self.active.name if self.active else None,
+                'capabilities': dict(self.capabilities),
+                'consecutive_failures': self._consecutive_failures,
+                'backends': backends,
+            }
+
+    def stream_commands(self, settings):
+        """Commandes d'encodage continu (mode ring), backend actif en premier"""
+        return [(b.name, b.stream_command(settings)) for b in self.available_backends()]
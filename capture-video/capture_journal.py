@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Journal des captures en cours (reprise après arrêt brutal)
+
+- Une ligne par fichier vidéo temporaire, validée avant le début de
+  l'enregistrement: 'demarre', puis 'termine' une fois le clip complet
+- Supprimée dans la transaction qui insère le média ('stocke'): une
+  ligne restante désigne donc toujours un clip non rangé
+- Au démarrage, les clips des lignes restantes sont ré-ingérés en une
+  seule transaction (un clip interrompu garde ce qui a été écrit), les
+  événements dont le fichier a disparu sont marqués dans leur metadata
+  ($.capture_interrompue) et le dossier temporaire est vidé
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_capture (
+    fichier TEXT PRIMARY KEY,          -- Chemin absolu du clip temporaire
+    etat TEXT NOT NULL CHECK(etat IN ('demarre', 'termine')),
+    event_id TEXT,
+    id_evenement INTEGER NOT NULL,
+    numero_camera INTEGER NOT NULL,
+    resolution TEXT,
+    duree INTEGER,                     -- Durée réelle ('termine')
+    evenements TEXT,                   -- id_evenement couverts (JSON, 'termine')
+    debut REAL NOT NULL,
+    maj REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def ensure_journal_schema(conn):
+    """Crée journal_capture (bases créées avant son introduction)"""
+    conn.executescript(JOURNAL_SCHEMA)
+
+
+# ============================================
+# Transitions (via l'écrivain partagé)
+# ============================================
+
+def start_entry(writer, fichier, event_id, id_evenement, numero_camera, resolution):
+    """
+    'demarre': à valider (result()) avant de créer le fichier, pour qu'aucun
+    clip n'existe sans sa ligne de journal
+
+    Returns:
+        Future: résolu après COMMIT
+    """
+    now = time.time()
+    return writer.submit("""
+        INSERT OR REPLACE INTO journal_capture
+        (fichier, etat, event_id, id_evenement, numero_camera, resolution, debut, maj)
+        VALUES (?, 'demarre', ?, ?, ?, ?, ?, ?)
+    """, (fichier, event_id, id_evenement, numero_camera, resolution, now, now), urgent=True)
+
+
+def complete_entry(writer, fichier, duree, evenements):
+    """'termine': clip complet, avec sa durée réelle et les événements couverts"""
+    return writer.submit("""
+        UPDATE journal_capture
+        SET etat = 'termine', duree = ?, evenements = ?, maj = ?
+        WHERE fichier = ?
+    """, (duree, json.dumps(sorted(set(evenements))), time.time(), fichier))
+
+
+def discard_entry(writer, fichier):
+    """Capture en échec: plus rien à reprendre"""
+    return writer.submit("DELETE FROM journal_capture WHERE fichier = ?", (fichier,))
+
+
+def remove_entry(conn, fichier):
+    """'stocke': à appeler dans la transaction qui insère le média"""
+    conn.execute("DELETE FROM journal_capture WHERE fichier = ?", (fichier,))
+
+
+# ============================================
+# Reprise au démarrage
+# ============================================
+
+def load_entries(db_path):
+    """
+    Returns:
+        list[dict]: lignes du journal, vide si la table est absente
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("SELECT * FROM journal_capture ORDER BY debut").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+    return [dict(row) for row in rows]
+
+
+def recover_file(entry):
+    """
+    Prépare le clip d'une ligne du journal pour la ré-ingestion
+
+    Un segment de prolongation interrompu (<fichier>.part) est ajouté au
+    clip: un flux H.264 Annex B se concatène tel quel. Un clip resté à
+    'demarre' reçoit une durée estimée d'après sa dernière écriture.
+
+    Returns:
+        tuple: (durée en secondes, id_evenement couverts), None si le
+               fichier est absent ou vide
+    """
+    fichier = entry['fichier']
+    part = f"{fichier}.part"
+
+    if os.path.exists(part):
+        if os.path.getsize(part) > 0:
+            with open(part, 'rb') as src, open(fichier, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+        os.remove(part)
+
+    if not os.path.exists(fichier) or os.path.getsize(fichier) == 0:
+        return None
+
+    if entry['etat'] == 'termine' and entry['duree'] is not None:
+        duree = entry['duree']
+    else:
+        duree = max(1, round(os.path.getmtime(fichier) - entry['debut']))
+
+    evenements = json.loads(entry['evenements']) if entry['evenements'] else []
+    return duree, {entry['id_evenement'], *evenements}
+
+
+def sweep_temp_dir(temp_dir):
+    """
+    Supprime les fichiers restés dans le dossier temporaire (photos,
+    segments et clips non journalisés), une fois le journal traité
+
+    Returns:
+        int: fichiers supprimés
+    """
+    removed = 0
+    try:
+        names = os.listdir(temp_dir)
+    except FileNotFoundError:
+        return 0
+
+    for name in names:
+        path = os.path.join(temp_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+            removed += 1
+    return removed
@@ -8,11 +8,16 @@ import paho.mqtt.client as mqtt
 import json
 import os
 import time
-import subprocess
 import sqlite3
 from datetime import datetime
 from pathlib import Path
 
+from capture_backends import BackendSelector
+from db_cache import ConfigCache
+from event_dedup import EventDeduplicator, load_recent_event_ids
+from media_store import insert_with_blob_from_file
+from metrics import REGISTRY, start_metrics_server
+
 # Configuration
 MQTT_BROKER = os.getenv("MQTT_BROKER", "mqtt-broker")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
@@ -24,12 +29,31 @@ VIDEO_HEIGHT = int(os.getenv("VIDEO_HEIGHT", 720))
 VIDEO_FPS = int(os.getenv("VIDEO_FPS", 30))
 
 # Chemins
-DB_PATH = "/data/recordings.db"
+DB_PATH = os.getenv("DB_PATH", "/data/recordings.db")
+# Base contenant la table configuration (partagée avec surveillance_service)
+CONFIG_DB_PATH = os.getenv("CONFIG_DB_PATH", "/data/surveillance.db")
 TEMP_VIDEO_DIR = "/tmp/videos"
 
 # Créer le dossier temporaire
 Path(TEMP_VIDEO_DIR).mkdir(parents=True, exist_ok=True)
 
+# Métriques (mêmes noms que surveillance_service)
+MESSAGES_METRIC = REGISTRY.counter('mqtt_messages_total', "Messages MQTT reçus", ('topic',))
+DUPLICATES_METRIC = REGISTRY.counter(
+    'mqtt_duplicates_total', "Redistributions QoS 1 écartées (event_id déjà reçu)", ('topic',)
+)
+ON_MESSAGE_METRIC = REGISTRY.histogram(
+    'mqtt_on_message_seconds', "Durée du callback on_message (capture incluse)", ('topic',)
+)
+MEDIA_METRIC = REGISTRY.counter('media_saved_total', "Enregistrements stockés, par résultat", ('result',))
+MEDIA_SAVE_METRIC = REGISTRY.histogram('media_save_seconds', "Durée de save_recording_to_db")
+MEDIA_SIZE_METRIC = REGISTRY.histogram(
+    'media_size_bytes', "Taille des clips stockés",
+    buckets=(256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+)
+RECORD_METRIC = REGISTRY.counter('record_video_total', "Enregistrements vidéo, par résultat", ('result',))
+RECORD_SECONDS_METRIC = REGISTRY.histogram('record_video_seconds', "Durée de record_video")
+
 print(f"""
 ╔════════════════════════════════════════════════════════════╗
 ║         Service Capture Vidéo - {DEVICE_ID:^23s}        ║
@@ -80,175 +104,149 @@ def init_database():
     print("✅ Base de données initialisée")
 
 
-def save_recording_to_db(event_id, video_data, metadata):
+def save_recording_to_db(event_id, video_file, metadata, duration=RECORD_DURATION):
     """
     Sauvegarde l'enregistrement dans SQLite
 
+    La vidéo est copiée par blocs dans le BLOB (zeroblob + blobopen) au lieu
+    d'être chargée entièrement en mémoire.
+
     Args:
         event_id: ID de l'événement qui a déclenché l'enregistrement
-        video_data: Données binaires de la vidéo (blob)
+        video_file: Chemin du fichier vidéo capturé
         metadata: Métadonnées JSON
+        duration: Durée demandée pour la capture (secondes)
     """
+    started = time.perf_counter()
+    MEDIA_SIZE_METRIC.observe(os.path.getsize(video_file))
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO recordings
-        (event_id, device_id, timestamp, duration, video_blob, video_size, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        event_id,
-        DEVICE_ID,
-        time.time(),
-        RECORD_DURATION,
-        video_data,
-        len(video_data),
-        json.dumps(metadata)
-    ))
-
-    recording_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
 
+    # Fermée même si la copie ou le COMMIT échoue (transaction annulée)
+    try:
+        recording_id = insert_with_blob_from_file(conn, 'recordings', 'video_blob', """
+            INSERT INTO recordings
+            (event_id, device_id, timestamp, duration, video_blob, video_size, metadata)
+            VALUES (:event_id, :device_id, :timestamp, :duration,
+                    zeroblob(:blob_size), :blob_size, :metadata)
+        """, {
+            'event_id': event_id,
+            'device_id': DEVICE_ID,
+            'timestamp': time.time(),
+            'duration': duration,
+            'metadata': json.dumps(metadata),
+        }, video_file)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    MEDIA_SAVE_METRIC.observe(time.perf_counter() - started)
     return recording_id
 
 
+# ============================================
+# Configuration partagée
+# ============================================
+
+# Cache de la table configuration de surveillance.db (None si absente:
+# les variables d'environnement s'appliquent alors seules)
+config_cache = None
+
+
+def start_config_cache():
+    """Charge la configuration partagée si surveillance.db est disponible"""
+    global config_cache
+
+    if not os.path.exists(CONFIG_DB_PATH):
+        print(f"⚠️  {CONFIG_DB_PATH} absente, configuration par variables d'environnement")
+        return
+
+    try:
+        cache = ConfigCache(CONFIG_DB_PATH)
+        cache.start()
+    except sqlite3.Error as e:
+        print(f"⚠️  Configuration partagée indisponible: {e}")
+        return
+
+    config_cache = cache
+    print(f"⚙️  Configuration partagée chargée depuis {CONFIG_DB_PATH}")
+
+
+def get_video_settings():
+    """
+    Paramètres de capture courants (variables d'environnement définies,
+    sinon table configuration, modifiable à chaud)
+
+    Returns:
+        dict: duration, width, height, fps
+    """
+    if config_cache is None:
+        return {
+            'duration': RECORD_DURATION,
+            'width': VIDEO_WIDTH,
+            'height': VIDEO_HEIGHT,
+            'fps': VIDEO_FPS,
+        }
+    return config_cache.get_video_settings(RECORD_DURATION, VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS)
+
+
 # ============================================
 # Capture vidéo
 # ============================================
 
-def record_video(event_id):
+# event_id déjà enregistrés (redistributions QoS 1 écartées avant la capture)
+event_dedup = EventDeduplicator()
+
+# Backend de capture sondé au démarrage puis mémorisé
+capture_backends = BackendSelector()
+
+
+def record_video(event_id, settings=None):
     """
-    Enregistre une vidéo de 10 secondes avec libcamera-vid
+    Enregistre une vidéo avec le backend de capture mémorisé
+    (libcamera-vid, ffmpeg ou raspivid, sondés une seule fois)
 
     Args:
         event_id: ID de l'événement MQTT
 
     Returns:
-        bytes: Données binaires de la vidéo (blob)
+        str: Chemin du fichier vidéo (à supprimer après stockage), None en cas d'échec
     """
+    settings = settings or get_video_settings()
     output_file = f"{TEMP_VIDEO_DIR}/recording_{event_id}_{int(time.time())}.h264"
+    started = time.perf_counter()
 
     print(f"📹 Démarrage enregistrement vidéo...")
     print(f"   Fichier: {output_file}")
-    print(f"   Durée: {RECORD_DURATION}s")
-
-    result = None
-
-    try:
-        # Méthode 1: Essayer libcamera-vid (Raspberry Pi OS moderne)
-        print(f"   Tentative avec libcamera-vid...")
-        cmd = [
-            "libcamera-vid",
-            "-t", str(RECORD_DURATION * 1000),  # milliseconds
-            "--width", str(VIDEO_WIDTH),
-            "--height", str(VIDEO_HEIGHT),
-            "--framerate", str(VIDEO_FPS),
-            "--codec", "h264",
-            "-o", output_file,
-            "--nopreview"
-        ]
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=RECORD_DURATION + 5
-        )
-
-        if result.returncode == 0:
-            print(f"   ✅ Capturé avec libcamera-vid")
-        else:
-            raise Exception("libcamera-vid failed")
-
-    except (FileNotFoundError, Exception) as e:
-        print(f"   ⚠️  libcamera-vid non disponible: {e}")
-
-        try:
-            # Méthode 2: Essayer ffmpeg avec v4l2 (plus universel)
-            print(f"   Tentative avec ffmpeg...")
-            cmd = [
-                "ffmpeg",
-                "-f", "v4l2",
-                "-framerate", str(VIDEO_FPS),
-                "-video_size", f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",
-                "-i", "/dev/video0",
-                "-t", str(RECORD_DURATION),
-                "-c:v", "libx264",
-                "-preset", "ultrafast",
-                "-y",  # overwrite
-                output_file
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=RECORD_DURATION + 5
-            )
-
-            if result.returncode == 0:
-                print(f"   ✅ Capturé avec ffmpeg")
-            else:
-                raise Exception(f"ffmpeg failed: {result.stderr}")
+    print(f"   Durée: {settings['duration']}s")
 
-        except (FileNotFoundError, Exception) as e2:
-            print(f"   ⚠️  ffmpeg non disponible: {e2}")
-
-            try:
-                # Méthode 3: Essayer raspivid (Raspberry Pi ancien)
-                print(f"   Tentative avec raspivid...")
-                cmd = [
-                    "raspivid",
-                    "-t", str(RECORD_DURATION * 1000),
-                    "-w", str(VIDEO_WIDTH),
-                    "-h", str(VIDEO_HEIGHT),
-                    "-fps", str(VIDEO_FPS),
-                    "-o", output_file,
-                    "-n"  # no preview
-                ]
-
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=RECORD_DURATION + 5
-                )
-
-                if result.returncode == 0:
-                    print(f"   ✅ Capturé avec raspivid")
-                else:
-                    raise Exception(f"raspivid failed: {result.stderr}")
-
-            except (FileNotFoundError, Exception) as e3:
-                print(f"   ❌ Toutes les méthodes de capture ont échoué")
-                print(f"      libcamera-vid: {e}")
-                print(f"      ffmpeg: {e2}")
-                print(f"      raspivid: {e3}")
-                return None
+    if not capture_backends.record(output_file, settings):
+        print(f"   ❌ Toutes les méthodes de capture ont échoué")
+        RECORD_METRIC.inc(result='failed')
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return None
 
     # Vérifier si le fichier a été créé et n'est pas vide
     if not os.path.exists(output_file):
         print(f"❌ Fichier vidéo non créé: {output_file}")
+        RECORD_METRIC.inc(result='failed')
         return None
 
     if os.path.getsize(output_file) == 0:
         print(f"❌ Fichier vidéo vide: {output_file}")
+        RECORD_METRIC.inc(result='failed')
         os.remove(output_file)
         return None
 
-    print(f"✅ Enregistrement terminé")
+    RECORD_METRIC.inc(result='ok')
+    RECORD_SECONDS_METRIC.observe(time.perf_counter() - started)
 
-    # Lire le fichier vidéo en mémoire
-    with open(output_file, 'rb') as f:
-        video_data = f.read()
-
-    # Supprimer le fichier temporaire
-    os.remove(output_file)
+    print(f"✅ Enregistrement terminé")
 
-    print(f"💾 Vidéo capturée: {len(video_data)} bytes")
+    print(f"💾 Vidéo capturée: {os.path.getsize(output_file)} bytes")
 
-    return video_data
+    return output_file
 
 
 # ============================================
@@ -269,6 +267,13 @@ def on_message(client, userdata, message):
     """
     Callback MQTT - Déclenché quand un mouvement est détecté
     """
+    MESSAGES_METRIC.inc(topic=message.topic)
+    with ON_MESSAGE_METRIC.time(topic=message.topic):
+        handle_motion(message)
+
+
+def handle_motion(message):
+    """Enregistre et stocke la vidéo d'un événement MOTION_DETECTED"""
     try:
         payload = json.loads(message.payload.decode())
 
@@ -280,31 +285,50 @@ def on_message(client, userdata, message):
         event_id = payload.get('event_id', f'event_{int(time.time())}')
         device_id = payload.get('device_id', 'unknown')
 
+        if 'event_id' in payload and event_dedup.is_duplicate(event_id):
+            DUPLICATES_METRIC.inc(topic=message.topic)
+            print(f"♻️  Doublon ignoré: {event_id}")
+            return
+
         print(f"\n🚨 Mouvement détecté!")
         print(f"   Event ID: {event_id}")
         print(f"   Device: {device_id}")
 
         # Démarrer l'enregistrement
-        video_data = record_video(event_id)
+        settings = get_video_settings()
+        video_file = record_video(event_id, settings)
 
-        if video_data:
+        if video_file:
             # Métadonnées
             metadata = {
                 'event_type': event_type,
                 'device_id': device_id,
                 'trigger_timestamp': payload.get('timestamp'),
-                'video_resolution': f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",
-                'video_fps': VIDEO_FPS,
+                'video_resolution': f"{settings['width']}x{settings['height']}",
+                'video_fps': settings['fps'],
                 'video_codec': 'h264'
             }
 
             # Sauvegarder dans la base de données
-            recording_id = save_recording_to_db(event_id, video_data, metadata)
+            try:
+                size = os.path.getsize(video_file)
+                recording_id = save_recording_to_db(event_id, video_file, metadata, settings['duration'])
+            except Exception:
+                MEDIA_METRIC.inc(result='error')
+                event_dedup.forget(event_id)
+                raise
+            else:
+                MEDIA_METRIC.inc(result='ok')
+            finally:
+                # Supprimer le fichier temporaire
+                os.remove(video_file)
 
             print(f"✅ Enregistrement sauvegardé dans la BD (ID: {recording_id})")
-            print(f"   Taille: {len(video_data) / 1024:.2f} KB")
+            print(f"   Taille: {size / 1024:.2f} KB")
         else:
             print(f"❌ Échec de l'enregistrement")
+            # Une redistribution pourra retenter la capture
+            event_dedup.forget(event_id)
 
     except json.JSONDecodeError:
         print(f"⚠️  Message MQTT non-JSON: {message.payload}")
@@ -321,6 +345,12 @@ def main():
 
     # Initialiser la base de données
     init_database()
+    start_config_cache()
+    event_dedup.seed(load_recent_event_ids(DB_PATH, 'recordings', event_dedup.capacity))
+
+    # Sonder les backends de capture une seule fois
+    capture_backends.probe()
+    start_metrics_server()
 
     # Créer le client MQTT
     client = mqtt.Client(client_id=f"capture-video-{DEVICE_ID}")
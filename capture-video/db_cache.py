@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Caches en mémoire des tables de référence de surveillance.db
+
+- Chargement complet au démarrage
+- Invalidation par PRAGMA data_version (connexion dédiée, lecture seule)
+  puis par le compteur de la table cache_version, tenu à jour par des
+  triggers: seules les modifications de la table concernée provoquent
+  un rechargement, pas les insertions d'événements
+- Rechargement explicite possible via reload()
+
+Les lectures (chemin chaud) ne font aucune requête SQL.
+"""
+
+import os
+import sqlite3
+import threading
+
+CACHE_POLL_INTERVAL = float(os.getenv("CACHE_POLL_INTERVAL", 1.0))
+
+# Variables d'environnement des paramètres de capture: définies, elles
+# priment sur la table configuration
+VIDEO_ENV_SETTINGS = (
+    ('RECORD_DURATION', 'duration'),
+    ('VIDEO_WIDTH', 'width'),
+    ('VIDEO_HEIGHT', 'height'),
+    ('VIDEO_FPS', 'fps'),
+)
+
+
+class CachedTable:
+    """
+    Base des caches: surveille une table et la recharge quand elle change
+
+    Les sous-classes définissent `table` et `_load(conn)`, qui retourne le
+    nouvel état (remplacé atomiquement, lectures sans verrou).
+    """
+
+    table = None
+
+    def __init__(self, db_path, poll_interval=CACHE_POLL_INTERVAL):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._table_version = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.reloads = 0
+
+    # --------------------------------------------
+    # Chargement
+    # --------------------------------------------
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def _read_table_version(self, conn):
+        """Version de la table (None si cache_version n'existe pas)"""
+        try:
+            row = conn.execute(
+                "SELECT version FROM cache_version WHERE nom_table = ?", (self.table,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    def _load(self, conn):
+        raise NotImplementedError
+
+    def _apply(self, state):
+        raise NotImplementedError
+
+    def reload(self):
+        """Recharge inconditionnellement la table"""
+        with self._lock:
+            conn = self._connect()
+            self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            self._table_version = self._read_table_version(conn)
+            self._apply(self._load(conn))
+            self.reloads += 1
+
+    def refresh_if_changed(self):
+        """
+        Recharge la table seulement si elle a été modifiée
+
+        Returns:
+            bool: True si un rechargement a eu lieu
+        """
+        with self._lock:
+            conn = self._connect()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+
+            table_version = self._read_table_version(conn)
+            if table_version is not None and table_version == self._table_version:
+                return False
+
+        self.reload()
+        return True
+
+    # --------------------------------------------
+    # Surveillance en arrière-plan
+    # --------------------------------------------
+
+    def start(self):
+        """Charge la table puis surveille ses modifications"""
+        self.reload()
+
+        if self._thread or self.poll_interval <= 0:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._poll, name=f"cache-{self.table}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self.refresh_if_changed():
+                    print(f"🔄 Cache '{self.table}' rechargé")
+            except sqlite3.Error as e:
+                print(f"⚠️  Rafraîchissement cache '{self.table}' impossible: {e}")
+
+
+class SensorRegistry(CachedTable):
+    """
+    Registre des capteurs indexé par (type_capteur, device_id, actif)
+
+    Chaque clé donne la liste des id_capteur triés, le premier correspondant
+    à l'ancien `SELECT ... LIMIT 1`.
+    """
+
+    table = 'capteur'
+
+    def __init__(self, db_path, poll_interval=CACHE_POLL_INTERVAL):
+        super().__init__(db_path, poll_interval)
+        self._index = {}
+        self._rows = {}
+
+    def _load(self, conn):
+        rows = conn.execute("""
+            SELECT id_capteur, nom_capteur, type_capteur, device_id, actif
+            FROM capteur
+            ORDER BY id_capteur
+        """).fetchall()
+
+        index = {}
+        by_id = {}
+        for id_capteur, nom, type_capteur, device_id, actif in rows:
+            index.setdefault((type_capteur, device_id, actif), []).append(id_capteur)
+            by_id[id_capteur] = {
+                'id_capteur': id_capteur,
+                'nom_capteur': nom,
+                'type_capteur': type_capteur,
+                'device_id': device_id,
+                'actif': actif,
+            }
+        return index, by_id
+
+    def _apply(self, state):
+        self._index, self._rows = state
+
+    def get_ids(self, type_capteur, device_id, actif=1):
+        """Tous les id_capteur correspondant à la clé"""
+        return list(self._index.get((type_capteur, device_id, actif), ()))
+
+    def get_id(self, type_capteur, device_id, actif=1):
+        """Premier id_capteur correspondant à la clé, ou None"""
+        ids = self._index.get((type_capteur, device_id, actif))
+        return ids[0] if ids else None
+
+    def get(self, id_capteur):
+        """Ligne capteur complète (dict) ou None"""
+        return self._rows.get(id_capteur)
+
+
+class ConfigCache(CachedTable):
+    """
+    Table configuration (cle → valeur) en mémoire
+
+    Les abonnés enregistrés via on_change() sont appelés avec l'ensemble des
+    clés modifiées après chaque rechargement.
+    """
+
+    table = 'configuration'
+
+    def __init__(self, db_path, poll_interval=CACHE_POLL_INTERVAL):
+        super().__init__(db_path, poll_interval)
+        self._values = {}
+        self._listeners = []
+
+    def _load(self, conn):
+        return dict(conn.execute("SELECT cle, valeur FROM configuration").fetchall())
+
+    def _apply(self, state):
+        previous, self._values = self._values, state
+
+        changed = {
+            key for key in previous.keys() | state.keys()
+            if previous.get(key) != state.get(key)
+        }
+        if changed and self.reloads:
+            for listener in self._listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    print(f"⚠️  Abonné configuration en erreur: {e}")
+
+    def on_change(self, listener):
+        """Enregistre listener(cles_modifiees) appelé après un rechargement"""
+        self._listeners.append(listener)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def get_int(self, key, default=None):
+        try:
+            return int(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=None):
+        try:
+            return float(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def as_dict(self):
+        return dict(self._values)
+
+    def get_video_settings(self, duration, width, height, fps):
+        """
+        Paramètres de capture courants
+
+        Les arguments sont les valeurs des variables d'environnement (ou
+        leurs défauts). Une variable définie (RECORD_DURATION, VIDEO_WIDTH,
+        VIDEO_HEIGHT, VIDEO_FPS) l'emporte; sinon duree_enregistrement,
+        resolution_video et fps_video s'appliquent, modifiables à chaud.
+
+        Returns:
+            dict: duration, width, height, fps
+        """
+        defaults = {'duration': duration, 'width': width, 'height': height, 'fps': fps}
+        settings = {
+            'duration': self.get_int('duree_enregistrement', duration),
+            'width': width,
+            'height': height,
+            'fps': self.get_int('fps_video', fps),
+        }
+
+        resolution = self.get('resolution_video')
+        if resolution:
+            try:
+                settings['width'], settings['height'] = (int(v) for v in resolution.lower().split('x'))
+            except ValueError:
+                pass
+
+        for name, key in VIDEO_ENV_SETTINGS:
+            if os.getenv(name):
+                settings[key] = defaults[key]
+        return settings
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Écrivain SQLite à validation groupée (group commit)
+
+- Une seule connexion d'écriture persistante, en mode WAL
+- Les insertions sont regroupées dans de courtes transactions
+  (flush sur taille de lot ou délai maximal)
+- Chaque écriture renvoie un Future résolu avec le lastrowid après COMMIT
+- Les écritures urgentes (urgent=True) passent devant la file et valident
+  leur lot sans attendre le délai de regroupement
+- Une connexion de lecture persistante sert les petites requêtes SELECT
+- Une opération peut demander des bases attachées (partitions de médias):
+  l'ATTACH est fait avant la transaction de son lot, les bases les moins
+  récemment utilisées sont détachées au-delà de DB_MAX_ATTACHED
+
+Une rafale de 200 événements capteurs coûte ainsi quelques fsync au lieu
+d'un par événement.
+"""
+
+import itertools
+import os
+from collections import OrderedDict
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import REGISTRY
+
+WRITER_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", 64))
+WRITER_BATCH_INTERVAL = float(os.getenv("DB_BATCH_INTERVAL_MS", 50)) / 1000
+WRITER_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL")
+WRITER_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+# Bases attachées simultanément à la connexion d'écriture (SQLite: 10 max)
+WRITER_MAX_ATTACHED = int(os.getenv("DB_MAX_ATTACHED", 8))
+
+# Ordre de la file d'écriture (FIFO à priorité égale)
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_STOP = 2
+
+BATCH_METRIC = REGISTRY.histogram(
+    'db_writer_batch_size', "Opérations par transaction groupée",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+COMMIT_METRIC = REGISTRY.histogram(
+    'db_writer_transaction_seconds', "Durée d'un lot, de BEGIN à COMMIT (secondes)"
+)
+ERRORS_METRIC = REGISTRY.counter(
+    'db_writer_errors_total', "Opérations d'écriture en erreur"
+)
+
+
+def open_connection(db_path, check_same_thread=True):
+    """Ouvre une connexion configurée pour le mode WAL (autocommit explicite)"""
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA busy_timeout = {WRITER_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {WRITER_SYNCHRONOUS}")
+    return conn
+
+
+class EventWriter:
+    """
+    Propriétaire unique de la connexion d'écriture
+
+    Les écritures sont soumises depuis n'importe quel thread via submit() ou
+    submit_call() et exécutées par un thread dédié, par lots.
+    """
+
+    def __init__(self, db_path, batch_size=WRITER_BATCH_SIZE, batch_interval=WRITER_BATCH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread = None
+        # Erreur qui a arrêté le thread d'écriture: les soumissions suivantes échouent
+        self._crashed = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+
+        # Bases attachées à la connexion d'écriture, de la moins récemment
+        # utilisée à la plus récente (thread d'écriture uniquement)
+        self._attached = OrderedDict()
+        self._detach_lock = threading.Lock()
+        self._detach_requests = set()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'writes': 0,         # Opérations exécutées
+            'errors': 0,         # Opérations en erreur
+            'commits': 0,        # Transactions validées (= fsync)
+            'max_batch': 0,      # Plus gros lot observé
+            'urgent': 0,         # Écritures urgentes (lot validé sans attendre)
+            'attached': 0,       # ATTACH effectués
+        }
+
+    # --------------------------------------------
+    # Cycle de vie
+    # --------------------------------------------
+
+    def start(self):
+        """Ouvre les connexions et démarre le thread d'écriture"""
+        if self._thread:
+            return
+
+        self._read_conn = open_connection(self.db_path, check_same_thread=False)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Vide la file, valide le dernier lot et ferme les connexions"""
+        if not self._thread:
+            return
+
+        self._queue.put((PRIORITY_STOP, next(self._sequence), None, None, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+        with self._read_lock:
+            self._read_conn.close()
+            self._read_conn = None
+
+    # --------------------------------------------
+    # API publique
+    # --------------------------------------------
+
+    def submit(self, sql, params=(), urgent=False, attach=None):
+        """
+        Soumet une requête d'écriture
+
+        Args:
+            urgent: passer devant les écritures en attente et valider sans
+                    attendre le délai de regroupement (signaux de contrôle)
+            attach: {nom: chemin} des bases à attacher pour cette requête
+
+        Returns:
+            Future: résolu avec cursor.lastrowid une fois le lot validé
+        """
+        return self.submit_call(lambda conn: conn.execute(sql, params).lastrowid, urgent, attach)
+
+    def submit_call(self, fn, urgent=False, attach=None):
+        """
+        Soumet une fonction fn(conn) exécutée dans la transaction du lot
+
+        Args:
+            attach: {nom: chemin} des bases que fn utilise (ATTACH impossible
+                    dans une transaction: fait avant le BEGIN du lot)
+
+        Returns:
+            Future: résolu avec la valeur de retour de fn après COMMIT
+        """
+        future = Future()
+        if self._crashed is not None:
+            future.set_exception(self._crashed)
+            return future
+        priority = PRIORITY_URGENT if urgent else PRIORITY_NORMAL
+        self._queue.put((priority, next(self._sequence), fn, future, attach))
+        return future
+
+    def detach(self, name):
+        """
+        Détache une base de la connexion d'écriture (avant suppression de
+        son fichier)
+
+        Returns:
+            Future: résolu une fois la base détachée
+        """
+        with self._detach_lock:
+            self._detach_requests.add(name)
+        return self.submit_call(lambda conn: None, urgent=True)
+
+    def execute(self, sql, params=()):
+        """Version synchrone de submit(): attend la validation du lot"""
+        return self.submit(sql, params).result()
+
+    def query(self, sql, params=(), one=False):
+        """
+        Exécute un SELECT sur la connexion de lecture persistante
+
+        Returns:
+            list | tuple | None: toutes les lignes, ou la première si one=True
+        """
+        with self._read_lock:
+            cursor = self._read_conn.execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+
+    def get_stats(self):
+        """Retourne un instantané des compteurs de l'écrivain"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    # --------------------------------------------
+    # Thread d'écriture
+    # --------------------------------------------
+
+    def _collect_batch(self, first):
+        """
+        Accumule les opérations jusqu'à batch_size ou batch_interval
+
+        Dès qu'une écriture urgente fait partie du lot, seules les opérations
+        déjà en file sont ajoutées: le lot est validé sans attendre.
+        """
+        batch = [first]
+        urgent = first[0] == PRIORITY_URGENT
+        deadline = time.monotonic() + self.batch_interval
+        stop = False
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not urgent:
+                break
+            try:
+                item = self._queue.get_nowait() if urgent else self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] == PRIORITY_STOP:
+                stop = True
+                break
+            urgent = urgent or item[0] == PRIORITY_URGENT
+            batch.append(item)
+
+        return [(fn, future, attach) for _, _, fn, future, attach in batch], urgent, stop
+
+    def _prepare_attachments(self, conn, batch):
+        """
+        Hors transaction: détache les bases demandées par detach(), puis
+        attache celles que le lot utilise (LRU au-delà de DB_MAX_ATTACHED)
+        """
+        with self._detach_lock:
+            requests, self._detach_requests = self._detach_requests, set()
+        for name in requests:
+            if self._attached.pop(name, None):
+                conn.execute(f"DETACH DATABASE {name}")
+
+        required = {}
+        for _, _, attach in batch:
+            required.update(attach or {})
+
+        for name, path in required.items():
+            if name in self._attached:
+                self._attached.move_to_end(name)
+                continue
+
+            for old in list(self._attached):
+                if len(self._attached) < WRITER_MAX_ATTACHED:
+                    break
+                if old not in required:
+                    del self._attached[old]
+                    conn.execute(f"DETACH DATABASE {old}")
+
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+            self._attached[name] = path
+            with self._stats_lock:
+                self._stats['attached'] += 1
+
+    def _write_batch(self, conn, batch, urgent=False):
+        """Exécute un lot dans une seule transaction puis résout les futures"""
+        results = []
+        started = time.perf_counter()
+
+        try:
+            self._prepare_attachments(conn, batch)
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            self._fail(batch, e)
+            return
+
+        try:
+            for fn, future, _ in batch:
+                # Chaque opération dans son propre SAVEPOINT: un échec (ex:
+                # event_id en double) n'annule que cette opération, le reste
+                # du lot est conservé
+                conn.execute("SAVEPOINT operation")
+                try:
+                    value = fn(conn)
+                except Exception as e:
+                    # Disque plein, erreur d'E/S: SQLite a annulé toute la
+                    # transaction, savepoints compris; le lot entier échoue
+                    if not conn.in_transaction:
+                        raise
+                    conn.execute("ROLLBACK TO operation")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, value, None))
+                conn.execute("RELEASE operation")
+
+            conn.execute("COMMIT")
+        except Exception as e:
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            self._fail(batch, e)
+            return
+
+        COMMIT_METRIC.observe(time.perf_counter() - started)
+        BATCH_METRIC.observe(len(batch))
+
+        errors = 0
+        for future, value, error in results:
+            if error is not None:
+                errors += 1
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+        with self._stats_lock:
+            self._stats['writes'] += len(batch)
+            self._stats['errors'] += errors
+            self._stats['commits'] += 1
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+            if urgent:
+                self._stats['urgent'] += 1
+        if errors:
+            ERRORS_METRIC.inc(errors)
+
+    def _fail(self, batch, error):
+        """Résout en erreur les futures d'un lot qui ne le sont pas encore"""
+        failed = 0
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+                failed += 1
+
+        with self._stats_lock:
+            self._stats['errors'] += failed
+        ERRORS_METRIC.inc(failed)
+
+    def _run(self):
+        batch = []
+        try:
+            conn = open_connection(self.db_path)
+        except sqlite3.Error as e:
+            self._abort(batch, e)
+            return
+
+        try:
+            stop = False
+            while not stop:
+                first = self._queue.get()
+                if first[0] == PRIORITY_STOP:
+                    break
+
+                batch = [first[2:]]
+                batch, urgent, stop = self._collect_batch(first)
+                self._write_batch(conn, batch, urgent)
+                batch = []
+        except Exception as e:
+            self._abort(batch, e)
+        finally:
+            conn.close()
+
+    def _abort(self, batch, error):
+        """
+        Thread d'écriture arrêté sur une erreur inattendue: le lot en cours,
+        les opérations en file et les soumissions suivantes échouent au
+        lieu de rester en attente
+        """
+        print(f"❌ Écrivain SQLite arrêté: {error}")
+        self._crashed = error
+        pending = list(batch)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != PRIORITY_STOP:
+                pending.append((item[2], item[3], item[4]))
+        self._fail(pending, error)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Suppression des doublons MQTT (redistributions QoS 1)
+
+- Les services s'abonnent en qos=1: après une reconnexion, le broker
+  redistribue les messages non acquittés
+- Un LRU borné d'event_id écarte ces doublons dans on_message, avant
+  toute écriture en base ou capture vidéo
+- Amorcé au démarrage avec les event_id les plus récents de la base, pour
+  couvrir les redistributions qui suivent un redémarrage du service
+
+Seuls les event_id fournis par l'émetteur sont suivis: un identifiant
+généré localement est unique par construction.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", 4096))
+
+
+class EventDeduplicator:
+    """LRU borné des event_id déjà reçus (thread-safe)"""
+
+    def __init__(self, capacity=DEDUP_CAPACITY):
+        self.capacity = max(1, capacity)
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.duplicates = 0
+
+    def is_duplicate(self, event_id):
+        """
+        Enregistre event_id et indique s'il avait déjà été vu
+
+        Returns:
+            bool: True pour une redistribution (à ignorer)
+        """
+        with self._lock:
+            if event_id in self._seen:
+                self._seen.move_to_end(event_id)
+                self.duplicates += 1
+                return True
+
+            self._seen[event_id] = None
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, event_id):
+        """Oublie event_id (écriture échouée: une redistribution doit passer)"""
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def seed(self, event_ids):
+        """Amorce avec des event_id du plus ancien au plus récent"""
+        with self._lock:
+            for event_id in event_ids:
+                self._seen[event_id] = None
+                self._seen.move_to_end(event_id)
+            while len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
+
+
+def load_recent_event_ids(db_path, table, limit=DEDUP_CAPACITY):
+    """
+    event_id les plus récents d'une table (colonnes event_id et timestamp)
+
+    Returns:
+        list: du plus ancien au plus récent, vide si la table est absente
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(f"""
+            SELECT event_id FROM {table}
+            WHERE event_id IS NOT NULL
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+    return [row[0] for row in reversed(rows)]
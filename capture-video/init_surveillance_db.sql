@@ -3,6 +3,11 @@
 -- Base de données pour système de surveillance
 -- ============================================
 
+-- Pages libérées par la purge rendues au système via
+-- PRAGMA incremental_vacuum (sans effet sur une base existante:
+-- voir `python3 retention.py enable-incremental-vacuum`)
+PRAGMA auto_vacuum = INCREMENTAL;
+
 -- Table: capteur
 -- Gestion des capteurs physiques
 CREATE TABLE IF NOT EXISTS capteur (
@@ -36,11 +41,19 @@ CREATE INDEX IF NOT EXISTS idx_evenement_event_id ON evenement(event_id);
 
 -- Table: media
 -- Stockage des photos et vidéos
+-- Avec MEDIA_PARTITIONS=mois, les nouveaux médias sont rangés dans une base
+-- par mois (partitions/media_AAAA_MM.db, mêmes tables media,
+-- media_evenement, miniature et media_stats: voir media_partitions.py);
+-- cette table garde les médias antérieurs, et vue_evenements_recents ne
+-- compte que ceux-ci (défaut MEDIA_PARTITIONS=aucune: tout reste ici)
 CREATE TABLE IF NOT EXISTS media (
     id_media INTEGER PRIMARY KEY AUTOINCREMENT,
     type_media TEXT NOT NULL CHECK(type_media IN ('video', 'photo')),
-    video BLOB NOT NULL,
+    video BLOB NOT NULL,               -- Vide (x''): contenu dans media_contenu ou sur disque
     taille INTEGER NOT NULL,
+    chemin TEXT,                       -- Chemin relatif à MEDIA_DIR (MEDIA_STORE=file)
+    sha256 TEXT,                       -- Empreinte du contenu (MEDIA_STORE=file)
+    priorite INTEGER NOT NULL DEFAULT 0, -- Éviction budget: plus basse évincée d'abord
     duree INTEGER,
     date_media TEXT NOT NULL,
     timestamp REAL NOT NULL,
@@ -49,6 +62,8 @@ CREATE TABLE IF NOT EXISTS media (
     numero_camera INTEGER NOT NULL CHECK(numero_camera IN (1, 2)),
     resolution TEXT,
     codec TEXT,
+    conteneur TEXT,                    -- 'mp4' (fast start), NULL: flux brut
+    codecs TEXT,                       -- Chaîne RFC 6381 (ex: avc1.64001f)
     FOREIGN KEY (id_capteur) REFERENCES capteur(id_capteur) ON DELETE CASCADE,
     FOREIGN KEY (id_evenement) REFERENCES evenement(id_evenement) ON DELETE SET NULL
 );
@@ -57,8 +72,75 @@ CREATE INDEX IF NOT EXISTS idx_media_capteur ON media(id_capteur, date_media DES
 CREATE INDEX IF NOT EXISTS idx_media_evenement ON media(id_evenement);
 CREATE INDEX IF NOT EXISTS idx_media_camera ON media(numero_camera, date_media DESC);
 CREATE INDEX IF NOT EXISTS idx_media_timestamp ON media(timestamp DESC);
+-- Pagination par curseur de /api/recordings (ORDER BY timestamp DESC, id_media DESC)
+CREATE INDEX IF NOT EXISTS idx_media_recent ON media(timestamp DESC, id_media DESC);
 CREATE INDEX IF NOT EXISTS idx_media_type ON media(type_media);
 
+-- Table: media_contenu
+-- Contenu vidéo (MEDIA_STORE=blob), séparé des métadonnées: les parcours
+-- de media (statistiques, purge) ne lisent pas les pages des vidéos.
+-- Anciennes lignes encore dans media.video: media_store.py split-payloads
+CREATE TABLE IF NOT EXISTS media_contenu (
+    id_media INTEGER PRIMARY KEY,
+    video BLOB NOT NULL
+);
+
+-- Suppression avec le média (foreign_keys n'est pas activé par les services)
+CREATE TRIGGER IF NOT EXISTS trigger_media_contenu_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM media_contenu WHERE id_media = OLD.id_media;
+END;
+
+-- Table: media_evenement
+-- Événements couverts par un média (rafale de détections fusionnées
+-- dans un seul clip); media.id_evenement reste l'événement déclencheur
+CREATE TABLE IF NOT EXISTS media_evenement (
+    id_media INTEGER NOT NULL,
+    id_evenement INTEGER NOT NULL,
+    PRIMARY KEY (id_media, id_evenement),
+    FOREIGN KEY (id_media) REFERENCES media(id_media) ON DELETE CASCADE,
+    FOREIGN KEY (id_evenement) REFERENCES evenement(id_evenement) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_media_evenement_evenement ON media_evenement(id_evenement);
+
+-- Table: journal_capture
+-- Clips temporaires pas encore rangés dans media (reprise au démarrage,
+-- voir capture_journal.py): 'demarre' puis 'termine', ligne supprimée
+-- dans la transaction qui insère le média
+CREATE TABLE IF NOT EXISTS journal_capture (
+    fichier TEXT PRIMARY KEY,          -- Chemin absolu du clip temporaire
+    etat TEXT NOT NULL CHECK(etat IN ('demarre', 'termine')),
+    event_id TEXT,
+    id_evenement INTEGER NOT NULL,
+    numero_camera INTEGER NOT NULL,
+    resolution TEXT,
+    duree INTEGER,                     -- Durée réelle ('termine')
+    evenements TEXT,                   -- id_evenement couverts (JSON, 'termine')
+    debut REAL NOT NULL,
+    maj REAL NOT NULL
+) WITHOUT ROWID;
+
+-- Table: miniature
+-- Aperçu et bande d'images clés par média (quelques Ko), extraits après
+-- la capture par thumbnails.py et servis par /api/recordings/<id>/thumbnail
+CREATE TABLE IF NOT EXISTS miniature (
+    id_media INTEGER PRIMARY KEY,
+    apercu BLOB,                       -- JPEG (NULL: extraction impossible)
+    bande BLOB,                        -- Images clés côte à côte (JPEG)
+    nb_images INTEGER NOT NULL DEFAULT 0,
+    date_creation TEXT NOT NULL DEFAULT (datetime('now')),
+    FOREIGN KEY (id_media) REFERENCES media(id_media) ON DELETE CASCADE
+);
+
+-- Suppression avec le média (foreign_keys n'est pas activé par les services)
+CREATE TRIGGER IF NOT EXISTS trigger_miniature_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM miniature WHERE id_media = OLD.id_media;
+END;
+
 -- Table: notification
 -- Historique des notifications envoyées
 CREATE TABLE IF NOT EXISTS notification (
@@ -82,6 +164,90 @@ CREATE TABLE IF NOT EXISTS configuration (
     date_modification TEXT NOT NULL DEFAULT (datetime('now'))
 );
 
+-- Table: cache_version
+-- Compteurs de modification des tables mises en cache par les services
+-- (incrémentés par trigger, lus après un changement de PRAGMA data_version)
+CREATE TABLE IF NOT EXISTS cache_version (
+    nom_table TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO cache_version (nom_table, version) VALUES
+('capteur', 0),
+('configuration', 0);
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_capteur_insert
+AFTER INSERT ON capteur
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'capteur';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_capteur_update
+AFTER UPDATE ON capteur
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'capteur';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_capteur_delete
+AFTER DELETE ON capteur
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'capteur';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_configuration_insert
+AFTER INSERT ON configuration
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'configuration';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_configuration_update
+AFTER UPDATE ON configuration
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'configuration';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_version_configuration_delete
+AFTER DELETE ON configuration
+BEGIN
+    UPDATE cache_version SET version = version + 1 WHERE nom_table = 'configuration';
+END;
+
+-- Table: media_stats
+-- Taille totale des médias, tenue à jour par trigger: le contrôle du
+-- budget de stockage (budget_stockage_mo) ne parcourt jamais media
+CREATE TABLE IF NOT EXISTS media_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    taille_totale INTEGER NOT NULL DEFAULT 0,
+    nb_medias INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO media_stats (id, taille_totale, nb_medias)
+SELECT 1, COALESCE(SUM(taille), 0), COUNT(*) FROM media;
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_insert
+AFTER INSERT ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale + NEW.taille, nb_medias = nb_medias + 1
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_update
+AFTER UPDATE OF taille ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale - OLD.taille + NEW.taille
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_delete
+AFTER DELETE ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale - OLD.taille, nb_medias = nb_medias - 1
+    WHERE id = 1;
+END;
+
 -- ============================================
 -- Vue: Événements récents avec médias
 -- ============================================
@@ -107,15 +273,10 @@ ORDER BY e.timestamp DESC
 LIMIT 100;
 
 -- ============================================
--- Trigger: Purge automatique anciens médias
+-- Purge des anciens médias: faite en arrière-plan par retention.py
+-- (clé retention_jours), plus dans la transaction de chaque insertion
 -- ============================================
-CREATE TRIGGER IF NOT EXISTS trigger_purge_anciens_medias
-AFTER INSERT ON media
-BEGIN
-    -- Supprimer les médias de plus de 30 jours
-    DELETE FROM media
-    WHERE timestamp < (strftime('%s', 'now') - 2592000);
-END;
+DROP TRIGGER IF EXISTS trigger_purge_anciens_medias;
 
 -- ============================================
 -- Données initiales: Capteurs
@@ -129,14 +290,20 @@ INSERT OR IGNORE INTO capteur (id_capteur, nom_capteur, type_capteur, device_id,
 
 -- ============================================
 -- Configuration initiale
+-- (OR IGNORE: les valeurs modifiées à chaud survivent au redémarrage)
 -- ============================================
-INSERT OR REPLACE INTO configuration (cle, valeur) VALUES
+INSERT OR IGNORE INTO configuration (cle, valeur) VALUES
 ('mode_systeme', 'actif'),
 ('duree_enregistrement', '10'),
 ('resolution_video', '1280x720'),
 ('fps_video', '30'),
 ('codec_video', 'h264'),
-('retention_jours', '30');
+('retention_jours', '30'),
+('duree_max_clip', '60'),
+('budget_stockage_mo', '0'),
+('politique_eviction', 'anciens'),
+('file_capture_max', '4'),
+('politique_delestage', 'fusion');
 
 -- ============================================
 -- Requêtes utiles (commentées)
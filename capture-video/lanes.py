@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Voies de traitement priorisées du service de surveillance
+
+- Une voie par classe de travail (contrôle, persistance capteurs, capture
+  vidéo), chacune avec sa file et ses propres workers: un signal de
+  contrôle n'attend jamais derrière une rafale de capteurs ou une capture
+- Latence mesurée par voie, de la réception MQTT à la fin du travail (COMMIT
+  si la tâche renvoie un Future), comparée à l'objectif (SLO) de la voie
+- Histogramme lane_latency_seconds{lane} et compteur
+  lane_slo_violations_total{lane} sur /metrics
+
+Une voie sans workers (workers=0) est exécutée ailleurs (ex: pool de
+capture) et seulement mesurée via observe().
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import REGISTRY
+
+LANE_CONTROL_WORKERS = int(os.getenv("LANE_CONTROL_WORKERS", 1))
+LANE_SENSOR_WORKERS = int(os.getenv("LANE_SENSOR_WORKERS", 1))
+LANE_CONTROL_SLO_MS = float(os.getenv("LANE_CONTROL_SLO_MS", 100))
+LANE_SENSOR_SLO_MS = float(os.getenv("LANE_SENSOR_SLO_MS", 1000))
+# Capture: réception → début de l'enregistrement (hors durée du clip)
+LANE_CAPTURE_SLO_MS = float(os.getenv("LANE_CAPTURE_SLO_MS", 2000))
+
+LATENCY_METRIC = REGISTRY.histogram(
+    'lane_latency_seconds', "Réception MQTT → fin du traitement, par voie", ('lane',)
+)
+SLO_METRIC = REGISTRY.counter(
+    'lane_slo_violations_total', "Traitements au-delà du SLO de la voie", ('lane',)
+)
+
+
+class Lane:
+    """
+    File + workers dédiés à une classe de travail
+
+    Args:
+        name: nom de la voie (label des métriques)
+        workers: threads dédiés (0 = voie seulement mesurée)
+        slo_ms: latence visée, réception → fin du traitement
+    """
+
+    def __init__(self, name, workers=1, slo_ms=1000):
+        self.name = name
+        self.workers = max(0, workers)
+        self.slo_ms = slo_ms
+
+        self._queue = queue.Queue()
+        self._threads = []
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,        # Tâches mises en file
+            'completed': 0,        # Latences mesurées
+            'errors': 0,           # Tâches en erreur
+            'slo_violations': 0,   # Latences au-delà de slo_ms
+            'max_latency_ms': 0.0,
+        }
+
+    # --------------------------------------------
+    # Cycle de vie
+    # --------------------------------------------
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"lane-{self.name}-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Arrête les workers après les tâches déjà en file"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    # --------------------------------------------
+    # API publique
+    # --------------------------------------------
+
+    def submit(self, fn, *args, received=None):
+        """
+        Met fn(*args) en file; la latence est mesurée depuis received
+        (time.monotonic() à la réception), à la fin de fn ou, si fn renvoie
+        un Future, à sa résolution
+        """
+        received = time.monotonic() if received is None else received
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+
+        if not self._threads:
+            self._execute(received, fn, args)
+            return
+        self._queue.put((received, fn, args))
+
+    def observe(self, received, error=False):
+        """Enregistre la latence d'un traitement terminé maintenant"""
+        latency = time.monotonic() - received
+        violated = latency * 1000 > self.slo_ms
+
+        LATENCY_METRIC.observe(latency, lane=self.name)
+        if violated:
+            SLO_METRIC.inc(lane=self.name)
+
+        with self._stats_lock:
+            self._stats['completed'] += 1
+            self._stats['errors'] += bool(error)
+            self._stats['slo_violations'] += violated
+            self._stats['max_latency_ms'] = max(self._stats['max_latency_ms'], latency * 1000)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['workers'] = self.workers
+        stats['slo_ms'] = self.slo_ms
+        return stats
+
+    # --------------------------------------------
+    # Workers
+    # --------------------------------------------
+
+    def _execute(self, received, fn, args):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            print(f"❌ Voie {self.name}: {e}")
+            self.observe(received, error=True)
+            return
+
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self.observe(received, future.exception() is not None))
+        else:
+            self.observe(received)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._execute(*item)
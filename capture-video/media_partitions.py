@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Partitionnement des médias par mois (une base SQLite par mois)
+
+- Les médias d'un mois (media, media_contenu, media_evenement, miniature,
+  media_stats) sont rangés dans MEDIA_PARTITION_DIR/media_AAAA_MM.db, créée au premier
+  média du mois et attachée à la demande (ATTACH ... AS media_AAAA_MM)
+- id_media global = (AAAAMM << 32) | id local à la partition: l'identifiant
+  désigne sa partition sans table de routage et reste un entier exact en
+  JavaScript (< 2^53)
+- Les médias antérieurs au partitionnement restent dans main.media
+  (identifiants < 2^32, inchangés)
+- Un mois entièrement hors rétention est supprimé en effaçant son fichier
+  (et son dossier de MEDIA_DIR en MEDIA_STORE=file), sans DELETE ni VACUUM
+- Les requêtes sur les clips récents parcourent les partitions de la plus
+  récente à la plus ancienne et s'arrêtent dès que la page est remplie
+- Sauvegarde: les mois passés ne changent plus, seul le mois courant (et
+  main) est à recopier
+
+Activé par MEDIA_PARTITIONS=mois. Par défaut (aucune), tout reste dans
+main.media: vue_evenements_recents et les requêtes SQL directes sur
+main.media ne voient pas les partitions.
+
+En mode WAL, une transaction qui touche main et une partition n'est
+atomique que fichier par fichier: après un arrêt brutal pendant le COMMIT,
+une ligne de journal_capture peut survivre à l'insertion de son média.
+"""
+
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+
+MEDIA_PARTITIONS = os.getenv("MEDIA_PARTITIONS", "aucune")
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+# Par défaut: dossier partitions/ à côté de la base principale
+MEDIA_PARTITION_DIR = os.getenv("MEDIA_PARTITION_DIR")
+
+# Clé des médias restés dans main.media
+LEGACY_KEY = 0
+ID_SHIFT = 32
+ID_MASK = (1 << ID_SHIFT) - 1
+
+PARTITION_FILE = re.compile(r'^media_(\d{4})_(\d{2})\.db$')
+
+# Tables d'une partition: celles de init_surveillance_db.sql, sans clés
+# étrangères vers main (impossibles entre fichiers)
+PARTITION_SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+
+CREATE TABLE IF NOT EXISTS media (
+    id_media INTEGER PRIMARY KEY AUTOINCREMENT,
+    type_media TEXT NOT NULL CHECK(type_media IN ('video', 'photo')),
+    video BLOB NOT NULL,
+    taille INTEGER NOT NULL,
+    chemin TEXT,
+    sha256 TEXT,
+    priorite INTEGER NOT NULL DEFAULT 0,
+    duree INTEGER,
+    date_media TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    id_capteur INTEGER NOT NULL,
+    id_evenement INTEGER,
+    numero_camera INTEGER NOT NULL CHECK(numero_camera IN (1, 2)),
+    resolution TEXT,
+    codec TEXT,
+    conteneur TEXT,
+    codecs TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_capteur ON media(id_capteur, date_media DESC);
+CREATE INDEX IF NOT EXISTS idx_media_evenement ON media(id_evenement);
+CREATE INDEX IF NOT EXISTS idx_media_camera ON media(numero_camera, date_media DESC);
+CREATE INDEX IF NOT EXISTS idx_media_timestamp ON media(timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_media_type ON media(type_media);
+CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256);
+CREATE INDEX IF NOT EXISTS idx_media_priorite ON media(priorite, timestamp);
+CREATE INDEX IF NOT EXISTS idx_media_recent ON media(timestamp DESC, id_media DESC);
+
+CREATE TABLE IF NOT EXISTS media_contenu (
+    id_media INTEGER PRIMARY KEY,
+    video BLOB NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_contenu_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM media_contenu WHERE id_media = OLD.id_media;
+END;
+
+CREATE TABLE IF NOT EXISTS media_evenement (
+    id_media INTEGER NOT NULL,
+    id_evenement INTEGER NOT NULL,
+    PRIMARY KEY (id_media, id_evenement)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_media_evenement_evenement ON media_evenement(id_evenement);
+
+CREATE TABLE IF NOT EXISTS miniature (
+    id_media INTEGER PRIMARY KEY,
+    apercu BLOB,
+    bande BLOB,
+    nb_images INTEGER NOT NULL DEFAULT 0,
+    date_creation TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+CREATE TRIGGER IF NOT EXISTS trigger_miniature_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM miniature WHERE id_media = OLD.id_media;
+END;
+
+CREATE TABLE IF NOT EXISTS media_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    taille_totale INTEGER NOT NULL DEFAULT 0,
+    nb_medias INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO media_stats (id, taille_totale, nb_medias) VALUES (1, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_insert
+AFTER INSERT ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale + NEW.taille, nb_medias = nb_medias + 1
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_update
+AFTER UPDATE OF taille ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale - OLD.taille + NEW.taille
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_stats_delete
+AFTER DELETE ON media
+BEGIN
+    UPDATE media_stats
+    SET taille_totale = taille_totale - OLD.taille, nb_medias = nb_medias - 1
+    WHERE id = 1;
+END;
+"""
+
+
+# ============================================
+# Clés et identifiants
+# ============================================
+
+def partition_key(timestamp):
+    """Clé AAAAMM du mois (heure locale, comme media.date_media)"""
+    date = datetime.fromtimestamp(timestamp)
+    return date.year * 100 + date.month
+
+
+def month_bounds(key):
+    """
+    Returns:
+        tuple: (début, fin) du mois en epoch, fin exclue
+    """
+    year, month = divmod(key, 100)
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return start.timestamp(), end.timestamp()
+
+
+def partition_name(key):
+    """Nom de la base attachée et de son fichier: media_AAAA_MM"""
+    return f"media_{key // 100:04d}_{key % 100:02d}"
+
+
+def make_media_id(key, local_id):
+    """id_media global d'un média de la partition `key`"""
+    return (key << ID_SHIFT) | local_id
+
+
+def split_media_id(id_media):
+    """
+    Returns:
+        tuple: (clé de partition, id_media local)
+    """
+    return id_media >> ID_SHIFT, id_media & ID_MASK
+
+
+def id_offset(key):
+    """À ajouter à l'id_media local pour obtenir l'id global (requêtes SQL)"""
+    return key << ID_SHIFT
+
+
+# ============================================
+# Routage
+# ============================================
+
+class MediaPartitions:
+    """
+    Routage des médias vers leur base mensuelle
+
+    Partagé entre threads: seule la création des fichiers est protégée par
+    un verrou, l'attachement se fait connexion par connexion.
+    """
+
+    def __init__(self, db_path=DB_PATH, partition_dir=MEDIA_PARTITION_DIR, mode=MEDIA_PARTITIONS):
+        if mode not in ('mois', 'aucune'):
+            raise ValueError(f"MEDIA_PARTITIONS inconnu: {mode}")
+
+        self.db_path = db_path
+        self.partition_dir = partition_dir or os.path.join(os.path.dirname(db_path), "partitions")
+        self.enabled = mode == 'mois'
+
+        self._lock = threading.Lock()
+        self._created = set()
+        # media_stats des partitions lues hors transaction: {clé: (signature, stats)}
+        self._stats_cache = {}
+
+    # --------------------------------------------
+    # Partitions
+    # --------------------------------------------
+
+    def key_for(self, timestamp):
+        """Partition d'un média capturé à `timestamp` (epoch)"""
+        return partition_key(timestamp) if self.enabled else LEGACY_KEY
+
+    def schema(self, key):
+        """Nom de la base (main pour les médias non partitionnés)"""
+        return 'main' if key == LEGACY_KEY else partition_name(key)
+
+    def path(self, key):
+        if key == LEGACY_KEY:
+            return self.db_path
+        return os.path.join(self.partition_dir, f"{partition_name(key)}.db")
+
+    def media_subdir(self, key):
+        """Dossier de MEDIA_DIR des fichiers de la partition (supprimé avec elle)"""
+        return None if key == LEGACY_KEY else partition_name(key)
+
+    def keys(self):
+        """
+        Partitions existantes, de la plus récente à la plus ancienne, puis
+        main (médias antérieurs au partitionnement)
+
+        Returns:
+            list[int]
+        """
+        keys = []
+        try:
+            names = os.listdir(self.partition_dir)
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            match = PARTITION_FILE.match(name)
+            if match:
+                keys.append(int(match.group(1)) * 100 + int(match.group(2)))
+
+        return sorted(keys, reverse=True) + [LEGACY_KEY]
+
+    def oldest_keys(self, count):
+        """
+        main puis les `count` partitions les plus anciennes qui contiennent
+        encore des médias (candidates à l'éviction)
+        """
+        partitions = [
+            key for key in sorted(self.keys())
+            if key != LEGACY_KEY and self.cached_stats(key)[1] > 0
+        ]
+        return [LEGACY_KEY] + partitions[:count]
+
+    def ensure(self, key):
+        """Crée la base de la partition et ses tables si besoin"""
+        if key == LEGACY_KEY or key in self._created:
+            return
+
+        with self._lock:
+            if key in self._created:
+                return
+            os.makedirs(self.partition_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path(key), isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(PARTITION_SCHEMA)
+            finally:
+                conn.close()
+            self._created.add(key)
+
+    def attachments(self, *keys):
+        """
+        Bases à attacher pour écrire dans ces partitions (créées si besoin)
+
+        Returns:
+            dict: {nom: chemin}, pour EventWriter.submit_call(attach=...)
+        """
+        result = {}
+        for key in keys:
+            if key != LEGACY_KEY:
+                self.ensure(key)
+                result[self.schema(key)] = self.path(key)
+        return result
+
+    # --------------------------------------------
+    # Connexions de lecture
+    # --------------------------------------------
+
+    def attach(self, conn, key):
+        """
+        Attache une partition existante à une connexion de lecture
+
+        Returns:
+            str | None: nom de la base, None si la partition n'existe pas
+        """
+        schema = self.schema(key)
+        if key == LEGACY_KEY:
+            return schema
+
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        if schema not in attached:
+            if not os.path.exists(self.path(key)):
+                return None
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (self.path(key),))
+        return schema
+
+    def detach(self, conn, key):
+        """Détache une partition (SQLite limite le nombre de bases attachées)"""
+        if key != LEGACY_KEY:
+            conn.execute(f"DETACH DATABASE {self.schema(key)}")
+
+    def connect(self, key):
+        """
+        Connexion directe à la base d'une partition (lectures sans jointure
+        vers main)
+
+        Returns:
+            sqlite3.Connection | None: None si la partition n'existe pas
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        return sqlite3.connect(path)
+
+    # --------------------------------------------
+    # Taille et suppression
+    # --------------------------------------------
+
+    def partition_stats(self, key, conn=None):
+        """
+        Taille et nombre de médias d'une partition (media_stats)
+
+        Args:
+            conn: connexion où la partition est attachée, sinon lecture
+                  par une connexion directe
+
+        Returns:
+            tuple: (taille totale, nombre de médias), (0, 0) si absente
+        """
+        sql = "SELECT taille_totale, nb_medias FROM {}media_stats WHERE id = 1"
+        try:
+            if conn is not None:
+                row = conn.execute(sql.format(f"{self.schema(key)}.")).fetchone()
+            else:
+                direct = self.connect(key)
+                if direct is None:
+                    return 0, 0
+                try:
+                    row = direct.execute(sql.format("")).fetchone()
+                finally:
+                    direct.close()
+        except sqlite3.OperationalError:
+            return 0, 0
+        return tuple(row) if row else (0, 0)
+
+    def _signature(self, key):
+        """Date et taille du fichier et de son -wal: changent à chaque COMMIT"""
+        signature = []
+        for suffix in ('', '-wal'):
+            try:
+                stat = os.stat(self.path(key) + suffix)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def cached_stats(self, key):
+        """
+        partition_stats() par connexion directe, gardé tant que le fichier
+        de la partition n'a pas changé
+
+        Le cache suit aussi les écritures des autres processus (API); la
+        signature est relevée avant la lecture, un COMMIT concurrent la
+        périme.
+        """
+        signature = self._signature(key)
+        with self._lock:
+            cached = self._stats_cache.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        stats = self.partition_stats(key)
+        with self._lock:
+            self._stats_cache[key] = (signature, stats)
+        return stats
+
+    def storage_total(self, conn):
+        """
+        Taille totale des médias, toutes partitions confondues
+
+        Les bases attachées à `conn` sont lues dans sa transaction, les
+        autres dans le cache (cached_stats): pas de connexion ouverte par
+        partition à chaque insertion.
+        """
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        return sum(
+            self.partition_stats(key, conn)[0] if self.schema(key) in attached
+            else self.cached_stats(key)[0]
+            for key in self.keys()
+        )
+
+    def drop(self, key, media_dir=None):
+        """
+        Supprime une partition: fichier de la base (et -wal/-shm) et
+        dossier de ses fichiers dans MEDIA_DIR
+
+        À appeler après EventWriter.detach(). Les connexions de lecture
+        encore ouvertes sur le fichier gardent leurs données jusqu'à leur
+        fermeture.
+
+        Returns:
+            int: nombre de médias supprimés
+        """
+        if key == LEGACY_KEY:
+            raise ValueError("main.media ne se supprime pas par fichier")
+
+        _, count = self.partition_stats(key)
+        path = self.path(key)
+        for suffix in ('-wal', '-shm', ''):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+        if media_dir:
+            shutil.rmtree(os.path.join(media_dir, self.media_subdir(key)), ignore_errors=True)
+
+        with self._lock:
+            self._created.discard(key)
+            self._stats_cache.pop(key, None)
+        return count
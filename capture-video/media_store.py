@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+"""
+Stockage des médias vidéo
+
+Deux backends, choisis par MEDIA_STORE:
+- blob: la vidéo est copiée dans media_contenu.video par blocs de taille
+  fixe (ligne réservée avec zeroblob(n), puis écriture via
+  Connection.blobopen): la mémoire utilisée reste constante quelle que soit
+  la durée du clip. media ne garde que les métadonnées (media.video vide):
+  ses lignes tiennent à plusieurs par page, et les parcours (statistiques,
+  purge) ne traversent plus les pages de débordement des vidéos
+- file: la vidéo est rangée sur disque sous un chemin dérivé de son SHA-256
+  (MEDIA_DIR/ab/cd/<sha256>.h264); media ne garde que chemin, taille et
+  empreinte, et media.video reste vide. Les médias d'une partition
+  mensuelle sont rangés sous MEDIA_DIR/media_AAAA_MM/, supprimé avec elle
+
+Migration en ligne des BLOB existants vers le stockage fichier (main et
+partitions mensuelles):
+
+    python3 media_store.py migrate --batch 20 --pause 0.5
+
+Migration en ligne des BLOB encore dans media.video vers media_contenu:
+
+    python3 media_store.py split-payloads --batch 20 --pause 0.5
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from media_partitions import MediaPartitions
+
+BLOB_CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_KB", 256)) * 1024
+MEDIA_STORE = os.getenv("MEDIA_STORE", "blob")
+MEDIA_DIR = os.getenv("MEDIA_DIR", "/data/media")
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+
+
+# ============================================
+# Schéma
+# ============================================
+
+# Colonnes ajoutées à media après sa création (bases existantes)
+MEDIA_ADDED_COLUMNS = {
+    'chemin': 'TEXT',
+    'sha256': 'TEXT',
+    'priorite': 'INTEGER NOT NULL DEFAULT 0',
+    'conteneur': 'TEXT',
+    'codecs': 'TEXT',
+}
+
+
+# Contenu vidéo (MEDIA_STORE=blob), séparé des métadonnées de media
+MEDIA_CONTENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_contenu (
+    id_media INTEGER PRIMARY KEY,
+    video BLOB NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trigger_media_contenu_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM media_contenu WHERE id_media = OLD.id_media;
+END;
+"""
+
+
+def ensure_media_schema(conn):
+    """Ajoute à media les colonnes et tables manquantes (bases créées avant leur introduction)"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(media)")}
+
+    for column, definition in MEDIA_ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE media ADD COLUMN {column} {definition}")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_priorite ON media(priorite, timestamp)")
+    # Pagination par curseur de /api/recordings
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_recent ON media(timestamp DESC, id_media DESC)")
+    conn.executescript(MEDIA_CONTENT_SCHEMA)
+
+
+# ============================================
+# BLOB incrémental
+# ============================================
+
+def write_blob_from_file(conn, table, column, rowid, path, chunk_size=BLOB_CHUNK_SIZE, schema='main'):
+    """
+    Copie le fichier `path` dans un BLOB réservé avec zeroblob(taille)
+
+    Args:
+        schema: base de la table (partition attachée)
+
+    Returns:
+        int: nombre d'octets copiés
+    """
+    copied = 0
+
+    with open(path, 'rb') as src:
+        if not hasattr(conn, 'blobopen'):
+            # Python < 3.11: pas d'I/O incrémentale, écriture en un bloc
+            data = src.read()
+            conn.execute(f"UPDATE {schema}.{table} SET {column} = ? WHERE rowid = ?", (data, rowid))
+            return len(data)
+
+        with conn.blobopen(table, column, rowid, name=schema) as blob:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                blob.write(chunk)
+                copied += len(chunk)
+
+    return copied
+
+
+def insert_with_blob_from_file(conn, table, column, sql, params, path, chunk_size=BLOB_CHUNK_SIZE,
+                               schema='main'):
+    """
+    Insère une ligne dont le BLOB est alimenté depuis un fichier
+
+    `sql` utilise des paramètres nommés et `zeroblob(:blob_size)` à la place
+    du BLOB; `blob_size` (taille du fichier) est ajouté à `params`.
+
+    Returns:
+        int: rowid de la ligne insérée
+    """
+    size = os.path.getsize(path)
+    rowid = conn.execute(sql, dict(params, blob_size=size)).lastrowid
+
+    copied = write_blob_from_file(conn, table, column, rowid, path, chunk_size, schema)
+    if copied != size:
+        raise IOError(f"{path}: {copied} octets copiés sur {size}")
+
+    return rowid
+
+
+def payload_table(conn, id_media, schema='main'):
+    """
+    Table du BLOB d'un média: media_contenu, ou media pour une ligne pas
+    encore migrée (split-payloads)
+    """
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.media_contenu WHERE id_media = ?", (id_media,)
+    ).fetchone()
+    return 'media_contenu' if row else 'media'
+
+
+def iter_blob_chunks(conn, table, column, rowid, chunk_size=BLOB_CHUNK_SIZE, schema='main',
+                     start=0, stop=None):
+    """
+    Lit un BLOB par blocs (sans le charger entièrement en mémoire)
+
+    Args:
+        start, stop: plage d'octets [start, stop[ (requête Range), tout le
+                     BLOB par défaut
+    """
+    if not hasattr(conn, 'blobopen'):
+        # substr() compte à partir de 1; sans longueur, jusqu'à la fin
+        length = f"{stop - start}" if stop is not None else f"length({column})"
+        row = conn.execute(
+            f"SELECT substr({column}, ?, {length}) FROM {schema}.{table} WHERE rowid = ?",
+            (start + 1, rowid)
+        ).fetchone()
+        if row and row[0]:
+            yield bytes(row[0])
+        return
+
+    with conn.blobopen(table, column, rowid, readonly=True, name=schema) as blob:
+        remaining = (len(blob) if stop is None else stop) - start
+        blob.seek(start)
+        while remaining > 0:
+            chunk = blob.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# ============================================
+# Stockage fichier adressé par contenu
+# ============================================
+
+def content_path(sha256, extension='h264'):
+    """Chemin relatif à MEDIA_DIR: ab/cd/<sha256>.<extension>"""
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{extension}")
+
+
+def store_chunks(chunks, media_dir=MEDIA_DIR, extension='h264'):
+    """
+    Écrit un flux d'octets dans le magasin de fichiers
+
+    Écriture dans un fichier temporaire du même volume, empreinte calculée
+    au fil de l'eau, puis renommage atomique. Un contenu déjà présent n'est
+    pas réécrit.
+
+    Returns:
+        tuple: (chemin relatif, sha256, taille)
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=media_dir, prefix='.incoming-')
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            for chunk in chunks:
+                digest.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        sha256 = digest.hexdigest()
+        relative = content_path(sha256, extension)
+        final_path = os.path.join(media_dir, relative)
+
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return relative, sha256, size
+
+
+def store_in_subdir(chunks, media_dir=MEDIA_DIR, subdir=None, extension='h264'):
+    """
+    store_chunks() sous MEDIA_DIR/<subdir> (partition mensuelle)
+
+    Returns:
+        tuple: (chemin relatif à MEDIA_DIR, sha256, taille)
+    """
+    if not subdir:
+        return store_chunks(chunks, media_dir, extension)
+
+    relative, sha256, size = store_chunks(chunks, os.path.join(media_dir, subdir), extension)
+    return os.path.join(subdir, relative), sha256, size
+
+
+def iter_file_chunks(path, chunk_size=BLOB_CHUNK_SIZE):
+    with open(path, 'rb') as src:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def remove_unreferenced_file(conn, chemin, media_dir=MEDIA_DIR, schema='main'):
+    """
+    Supprime le fichier d'un média si plus aucune ligne ne le référence
+    (un même contenu peut être partagé par plusieurs lignes, d'une même
+    partition: chaque partition a son dossier)
+
+    Returns:
+        bool: True si le fichier a été supprimé
+    """
+    if not chemin:
+        return False
+
+    row = conn.execute(f"SELECT 1 FROM {schema}.media WHERE chemin = ? LIMIT 1", (chemin,)).fetchone()
+    if row:
+        return False
+
+    try:
+        os.remove(os.path.join(media_dir, chemin))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def media_file_path(chemin, media_dir=MEDIA_DIR):
+    """Chemin absolu d'un média stocké sur disque"""
+    return os.path.join(media_dir, chemin)
+
+
+# ============================================
+# Backends d'insertion
+# ============================================
+
+# Colonnes communes de l'INSERT media (paramètres nommés)
+MEDIA_INSERT_COLUMNS = (
+    'type_media', 'duree', 'date_media', 'timestamp', 'id_capteur',
+    'id_evenement', 'numero_camera', 'resolution', 'codec', 'priorite',
+    'conteneur', 'codecs',
+)
+
+
+def media_extension(codec, conteneur=None):
+    """Extension du fichier d'un média: mp4, jpg ou h264 (flux brut)"""
+    if conteneur == 'mp4':
+        return 'mp4'
+    return 'jpg' if codec == 'jpeg' else 'h264'
+
+
+class BlobMediaStore:
+    """Vidéo dans la colonne media.video (copie incrémentale)"""
+
+    name = 'blob'
+
+    def stage(self, path, extension='h264', subdir=None):
+        """Préparation hors transaction (rien à faire: copie lors de l'INSERT)"""
+        return path
+
+    def insert(self, conn, columns, staged, schema='main'):
+        """
+        Insère une ligne media pour le fichier préparé par stage(), et son
+        contenu dans media_contenu
+
+        Args:
+            columns: valeurs des colonnes de MEDIA_INSERT_COLUMNS
+            schema: base de la table media (partition attachée)
+
+        Returns:
+            int: id_media local à la base
+        """
+        names = ", ".join(MEDIA_INSERT_COLUMNS)
+        values = ", ".join(f":{name}" for name in MEDIA_INSERT_COLUMNS)
+
+        id_media = conn.execute(f"""
+            INSERT INTO {schema}.media (video, taille, {names})
+            VALUES (x'', :taille, {values})
+        """, dict(columns, taille=os.path.getsize(staged))).lastrowid
+
+        insert_with_blob_from_file(conn, 'media_contenu', 'video', f"""
+            INSERT INTO {schema}.media_contenu (id_media, video)
+            VALUES (:id_media, zeroblob(:blob_size))
+        """, {'id_media': id_media}, staged, schema=schema)
+        return id_media
+
+    def discard(self, conn, staged, schema='main'):
+        """Insertion abandonnée: rien n'a été écrit hors de la transaction"""
+        return False
+
+
+class FileMediaStore:
+    """
+    Vidéo sur disque sous un chemin adressé par contenu
+
+    La copie et l'empreinte sont faites par stage(), hors de la transaction
+    d'écriture: l'INSERT ne porte que le chemin, la taille et le SHA-256.
+    """
+
+    name = 'file'
+
+    def __init__(self, media_dir=MEDIA_DIR):
+        self.media_dir = media_dir
+
+    def stage(self, path, extension='h264', subdir=None):
+        """
+        Args:
+            subdir: dossier de la partition du média dans MEDIA_DIR
+
+        Returns:
+            tuple: (chemin relatif, sha256, taille)
+        """
+        return store_in_subdir(iter_file_chunks(path), self.media_dir, subdir, extension)
+
+    def insert(self, conn, columns, staged, schema='main'):
+        relative, sha256, size = staged
+
+        names = ", ".join(MEDIA_INSERT_COLUMNS)
+        values = ", ".join(f":{name}" for name in MEDIA_INSERT_COLUMNS)
+
+        return conn.execute(f"""
+            INSERT INTO {schema}.media (video, taille, chemin, sha256, {names})
+            VALUES (x'', :taille, :chemin, :sha256, {values})
+        """, dict(columns, taille=size, chemin=relative, sha256=sha256)).lastrowid
+
+    def discard(self, conn, staged, schema='main'):
+        """
+        Insertion abandonnée: supprime le fichier préparé par stage(), sauf
+        s'il est déjà référencé (même contenu)
+
+        Returns:
+            bool: True si le fichier a été supprimé
+        """
+        return remove_unreferenced_file(conn, staged[0], self.media_dir, schema)
+
+
+def get_media_store(name=MEDIA_STORE):
+    """Backend de stockage configuré (MEDIA_STORE=blob|file)"""
+    if name == 'file':
+        return FileMediaStore()
+    if name == 'blob':
+        return BlobMediaStore()
+    raise ValueError(f"MEDIA_STORE inconnu: {name}")
+
+
+# ============================================
+# Migration BLOB → fichiers
+# ============================================
+
+def migrate_blobs_to_files(db_path=DB_PATH, media_dir=MEDIA_DIR, batch=20, pause=0.5, limit=None,
+                           subdir=None):
+    """
+    Déplace les BLOB de media vers le magasin de fichiers, par lots
+
+    Chaque lot est d'abord exporté (lecture seule, sans verrou d'écriture),
+    puis les lignes sont mises à jour dans une transaction courte: les
+    services peuvent continuer à écrire pendant la migration.
+
+    Args:
+        db_path: surveillance.db ou base d'une partition mensuelle
+        subdir: dossier de la partition dans MEDIA_DIR
+
+    Returns:
+        int: nombre de médias migrés
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    ensure_media_schema(conn)
+
+    migrated = 0
+    last_id = 0
+
+    try:
+        while limit is None or migrated < limit:
+            size = batch if limit is None else min(batch, limit - migrated)
+            rows = conn.execute("""
+                SELECT m.id_media, m.codec, m.conteneur FROM media m
+                WHERE m.chemin IS NULL AND m.id_media > ?
+                  AND (EXISTS (SELECT 1 FROM media_contenu c WHERE c.id_media = m.id_media)
+                       OR length(m.video) > 0)
+                ORDER BY m.id_media
+                LIMIT ?
+            """, (last_id, size)).fetchall()
+
+            if not rows:
+                break
+
+            exported = []
+            for id_media, codec, conteneur in rows:
+                last_id = id_media
+                relative, sha256, _ = store_in_subdir(
+                    iter_blob_chunks(conn, payload_table(conn, id_media), 'video', id_media), media_dir, subdir,
+                    media_extension(codec, conteneur)
+                )
+                exported.append((id_media, relative, sha256))
+
+            conn.execute("BEGIN IMMEDIATE")
+            orphans = []
+            for id_media, relative, sha256 in exported:
+                cursor = conn.execute("""
+                    UPDATE media SET video = x'', chemin = ?, sha256 = ?
+                    WHERE id_media = ? AND chemin IS NULL
+                """, (relative, sha256, id_media))
+                if cursor.rowcount == 0:
+                    # Ligne supprimée entre-temps (purge, API)
+                    orphans.append(relative)
+                else:
+                    conn.execute("DELETE FROM media_contenu WHERE id_media = ?", (id_media,))
+                    migrated += 1
+            conn.execute("COMMIT")
+
+            for relative in orphans:
+                remove_unreferenced_file(conn, relative, media_dir)
+
+            print(f"📦 {migrated} média(s) migré(s) (dernier id_media: {last_id})")
+            time.sleep(pause)
+    finally:
+        conn.close()
+
+    return migrated
+
+
+# ============================================
+# Migration media.video → media_contenu
+# ============================================
+
+def move_payload(conn, id_media, chunk_size=BLOB_CHUNK_SIZE):
+    """
+    Déplace le BLOB de media.video vers media_contenu, par blocs, dans la
+    transaction de l'appelant
+
+    Returns:
+        int: octets déplacés (0: rien à déplacer, ligne supprimée entre-temps)
+    """
+    row = conn.execute(
+        "SELECT length(video) FROM media WHERE id_media = ? AND chemin IS NULL", (id_media,)
+    ).fetchone()
+    if not row or not row[0]:
+        return 0
+
+    size = row[0]
+    conn.execute(
+        "INSERT INTO media_contenu (id_media, video) VALUES (?, zeroblob(?))", (id_media, size)
+    )
+
+    if hasattr(conn, 'blobopen'):
+        with conn.blobopen('media', 'video', id_media, readonly=True) as src, \
+                conn.blobopen('media_contenu', 'video', id_media) as dst:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                dst.write(chunk)
+    else:
+        conn.execute("""
+            UPDATE media_contenu SET video = (SELECT video FROM media WHERE id_media = ?)
+            WHERE id_media = ?
+        """, (id_media, id_media))
+
+    conn.execute("UPDATE media SET video = x'' WHERE id_media = ?", (id_media,))
+    return size
+
+
+def split_payloads(db_path=DB_PATH, batch=20, pause=0.5, limit=None):
+    """
+    Déplace les BLOB encore dans media.video vers media_contenu, par lots
+
+    Une transaction courte par lot (copie par blocs, mémoire constante):
+    les services continuent à écrire pendant la migration, et lisent
+    indifféremment les lignes migrées ou non (payload_table()).
+
+    Args:
+        db_path: surveillance.db ou base d'une partition mensuelle
+
+    Returns:
+        int: nombre de médias déplacés
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    ensure_media_schema(conn)
+
+    moved = 0
+    moved_bytes = 0
+    last_id = 0
+
+    try:
+        while limit is None or moved < limit:
+            size = batch if limit is None else min(batch, limit - moved)
+            ids = [row[0] for row in conn.execute("""
+                SELECT id_media FROM media
+                WHERE chemin IS NULL AND length(video) > 0 AND id_media > ?
+                ORDER BY id_media
+                LIMIT ?
+            """, (last_id, size))]
+
+            if not ids:
+                break
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for id_media in ids:
+                    copied = move_payload(conn, id_media)
+                    if copied:
+                        moved += 1
+                        moved_bytes += copied
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            last_id = ids[-1]
+            print(f"📦 {moved} média(s) déplacé(s), {moved_bytes / 1024 / 1024:.1f} MB "
+                  f"(dernier id_media: {last_id})")
+            time.sleep(pause)
+    finally:
+        conn.close()
+
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Outils du magasin de médias")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    migrate = sub.add_parser('migrate', help="Déplacer les BLOB de media vers MEDIA_DIR")
+    migrate.add_argument('--db', default=DB_PATH)
+    migrate.add_argument('--media-dir', default=MEDIA_DIR)
+    migrate.add_argument('--batch', type=int, default=20, help="Médias par transaction")
+    migrate.add_argument('--pause', type=float, default=0.5, help="Pause entre deux lots (s)")
+    migrate.add_argument('--limit', type=int, default=None, help="Nombre max de médias")
+
+    split = sub.add_parser('split-payloads', help="Déplacer media.video vers media_contenu")
+    split.add_argument('--db', default=DB_PATH)
+    split.add_argument('--batch', type=int, default=20, help="Médias par transaction")
+    split.add_argument('--pause', type=float, default=0.5, help="Pause entre deux lots (s)")
+    split.add_argument('--limit', type=int, default=None, help="Nombre max de médias")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        print(f"🚚 Migration des BLOB de {args.db} vers {args.media_dir}")
+        partitions = MediaPartitions(args.db)
+        count = 0
+        for key in partitions.keys():
+            remaining = None if args.limit is None else args.limit - count
+            if remaining == 0:
+                break
+            count += migrate_blobs_to_files(partitions.path(key), args.media_dir, args.batch, args.pause,
+                                            remaining, partitions.media_subdir(key))
+        print(f"✅ Migration terminée: {count} média(s) déplacé(s)")
+        print(f"   Espace libéré après VACUUM (ou incremental_vacuum)")
+
+    if args.command == 'split-payloads':
+        print(f"🚚 Séparation des BLOB de media vers media_contenu ({args.db})")
+        partitions = MediaPartitions(args.db)
+        count = 0
+        for key in partitions.keys():
+            remaining = None if args.limit is None else args.limit - count
+            if remaining == 0:
+                break
+            count += split_payloads(partitions.path(key), args.batch, args.pause, remaining)
+        print(f"✅ Séparation terminée: {count} média(s) déplacé(s)")
+        print(f"   Pages libérées dans media rendues après VACUUM (ou incremental_vacuum)")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
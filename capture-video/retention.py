@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Purge des médias en arrière-plan (rétention)
+
+- Remplace le trigger trigger_purge_anciens_medias, qui supprimait les
+  anciens médias dans la transaction de chaque insertion
+- Durée de rétention lue à chaque passe dans la clé retention_jours
+  (0 = pas de purge)
+- Partitions mensuelles (MEDIA_PARTITIONS=mois): un mois entièrement
+  antérieur à la rétention est supprimé en effaçant son fichier; seul le
+  mois à cheval sur la limite (et main.media) est purgé ligne à ligne
+- Suppression par petits lots soumis à l'écrivain partagé: les insertions
+  d'événements et de médias s'intercalent entre deux lots
+- Passe bornée dans le temps (RETENTION_MAX_RUN_SECONDS), reprise à la
+  passe suivante
+- Espace rendu au système par PRAGMA incremental_vacuum
+  (base en auto_vacuum = INCREMENTAL)
+- Budget de stockage (clé budget_stockage_mo, 0 = illimité): la taille
+  totale des médias est lue dans media_stats (tenue par trigger). Avant
+  chaque insertion, make_room() évince juste ce qu'il faut pour que le
+  clip tienne; chaque passe redescend sous BUDGET_LOW_WATERMARK du budget.
+  Ordre d'éviction selon politique_eviction: anciens (plus anciens
+  d'abord) ou priorite (priorité la plus basse, puis plus anciens), parmi
+  main.media et les EVICTION_PARTITIONS partitions les plus anciennes
+  qui ont encore des médias
+
+Passe manuelle, ou conversion d'une base existante (service arrêté):
+
+    python3 retention.py run
+    python3 retention.py enable-incremental-vacuum
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from media_partitions import LEGACY_KEY, MediaPartitions, month_bounds
+from media_store import MEDIA_DIR, remove_unreferenced_file
+
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 600))
+RETENTION_START_DELAY = int(os.getenv("RETENTION_START_DELAY", 30))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 50))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE_MS", 100)) / 1000
+RETENTION_MAX_RUN_SECONDS = float(os.getenv("RETENTION_MAX_RUN_SECONDS", 30))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", 1024))
+BUDGET_LOW_WATERMARK = float(os.getenv("BUDGET_LOW_WATERMARK", 0.9))
+# Partitions mensuelles les plus anciennes attachées pour l'éviction
+EVICTION_PARTITIONS = int(os.getenv("EVICTION_PARTITIONS", 2))
+DEFAULT_RETENTION_DAYS = 30
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+
+# Valeur de PRAGMA auto_vacuum pour le mode INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Ordre d'éviction par politique (servi par idx_media_timestamp / idx_media_priorite)
+EVICTION_ORDER = {
+    'anciens': 'timestamp, id_media',
+    'priorite': 'priorite, timestamp, id_media',
+}
+
+
+def get_storage_total(conn, partitions=None):
+    """
+    Taille totale des médias (octets), lue dans media_stats de main et de
+    chaque partition mensuelle
+
+    Returns:
+        int | None: None si media_stats n'existe pas (schéma minimal)
+    """
+    try:
+        row = conn.execute("SELECT taille_totale FROM media_stats WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if row is None or partitions is None:
+        return row[0] if row else None
+    return partitions.storage_total(conn)
+
+
+def evict_media(conn, target_bytes, policy='anciens', limit=None, partitions=None, keys=(LEGACY_KEY,)):
+    """
+    Supprime des médias, dans l'ordre de la politique, jusqu'à ce que la
+    taille totale ne dépasse plus `target_bytes`
+
+    Args:
+        keys: partitions (attachées à `conn`) où choisir les médias évincés
+
+    Returns:
+        tuple: (médias supprimés, (partition, chemin) des fichiers à vérifier)
+    """
+    total = get_storage_total(conn, partitions)
+    order = EVICTION_ORDER.get(policy, EVICTION_ORDER['anciens'])
+    schemas = {key: partitions.schema(key) if partitions else 'main' for key in keys}
+    # Premier candidat de chaque partition (servi par son index), puis le
+    # meilleur d'entre eux
+    candidates = " UNION ALL ".join(
+        f"SELECT * FROM (SELECT {key} AS cle, id_media, chemin, taille, priorite, timestamp "
+        f"FROM {schema}.media ORDER BY {order} LIMIT 1)"
+        for key, schema in schemas.items()
+    )
+    deleted = 0
+    chemins = set()
+
+    while total is not None and total > target_bytes and (limit is None or deleted < limit):
+        row = conn.execute(
+            f"SELECT cle, id_media, chemin, taille FROM ({candidates}) ORDER BY {order} LIMIT 1"
+        ).fetchone()
+        if not row:
+            break
+
+        key, id_media, chemin, taille = row
+        conn.execute(f"DELETE FROM {schemas[key]}.media WHERE id_media = ?", (id_media,))
+        conn.execute(f"DELETE FROM {schemas[key]}.media_evenement WHERE id_media = ?", (id_media,))
+        total -= taille
+        deleted += 1
+        if chemin:
+            chemins.add((key, chemin))
+
+    return deleted, chemins
+
+
+class RetentionWorker:
+    """
+    Thread de purge des médias plus anciens que retention_jours, et
+    d'éviction au-delà de budget_stockage_mo
+
+    Toutes les écritures passent par `writer` (EventWriter): la purge ne
+    prend jamais le verrou d'écriture plus longtemps qu'un lot.
+    """
+
+    def __init__(self, writer, config, media_dir=MEDIA_DIR, interval=RETENTION_INTERVAL,
+                 batch_size=RETENTION_BATCH_SIZE, max_run_seconds=RETENTION_MAX_RUN_SECONDS,
+                 partitions=None):
+        self.writer = writer
+        self.config = config
+        self.media_dir = media_dir
+        self.partitions = partitions or MediaPartitions(writer.db_path)
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.max_run_seconds = max_run_seconds
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'runs': 0,            # Passes effectuées
+            'deleted': 0,         # Médias supprimés
+            'evicted': 0,         # Médias évincés par le budget de stockage
+            'partitions': 0,      # Partitions mensuelles supprimées (fichier effacé)
+            'files': 0,           # Fichiers supprimés (MEDIA_STORE=file)
+            'vacuumed_pages': 0,  # Pages rendues par incremental_vacuum
+            'last_run': None,     # Fin de la dernière passe (epoch)
+        }
+
+    # --------------------------------------------
+    # Cycle de vie
+    # --------------------------------------------
+
+    def start(self, delay=RETENTION_START_DELAY):
+        if self._thread:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(delay,), name="retention", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Interrompt la passe en cours après le lot courant"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, delay):
+        if self._stop.wait(delay):
+            return
+
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️  Purge des médias en erreur: {e}")
+            self._stop.wait(self.interval)
+
+    # --------------------------------------------
+    # Purge
+    # --------------------------------------------
+
+    def get_retention_days(self):
+        return self.config.get_int('retention_jours', DEFAULT_RETENTION_DAYS)
+
+    def run_once(self):
+        """
+        Une passe: suppression des mois expirés, purge par âge, éviction
+        sous le budget, incremental_vacuum
+
+        Returns:
+            dict: médias supprimés et évincés, partitions et fichiers
+                  supprimés, pages rendues
+        """
+        result = {'deleted': 0, 'evicted': 0, 'partitions': 0, 'files': 0, 'vacuumed_pages': 0}
+        days = self.get_retention_days()
+        touched = set()
+
+        if days and days > 0:
+            cutoff = time.time() - days * 86400
+            result['partitions'], result['deleted'] = self.drop_expired(cutoff)
+            deadline = time.monotonic() + self.max_run_seconds
+
+            for key in self.partitions.keys():
+                # Seuls main et le mois à cheval sur la limite ont des lignes à purger
+                if key != LEGACY_KEY and month_bounds(key)[0] >= cutoff:
+                    continue
+                while not self._stop.is_set() and time.monotonic() < deadline:
+                    deleted, files = self.purge_batch(cutoff, key)
+                    result['deleted'] += deleted
+                    result['files'] += files
+                    if deleted:
+                        touched.add(key)
+                    if deleted < self.batch_size:
+                        break
+                    self._stop.wait(RETENTION_BATCH_PAUSE)
+
+        budget, policy = self.get_budget()
+        if budget:
+            evicted, files = self.enforce_budget(int(budget * BUDGET_LOW_WATERMARK), policy)
+            result['evicted'] += evicted
+            result['files'] += files
+            if evicted:
+                touched.update(self.eviction_keys())
+
+        if result['deleted'] or result['evicted']:
+            result['vacuumed_pages'] = self.incremental_vacuum(touched)
+            print(f"🧹 Rétention {days}j: {result['deleted']} média(s) supprimé(s) "
+                  f"(dont {result['partitions']} mois par fichier), "
+                  f"{result['evicted']} évincé(s) (budget), "
+                  f"{result['vacuumed_pages']} page(s) libérée(s)")
+
+        with self._stats_lock:
+            self._stats['runs'] += 1
+            for key, value in result.items():
+                self._stats[key] += value
+            self._stats['last_run'] = time.time()
+
+        return result
+
+    def drop_expired(self, cutoff):
+        """
+        Supprime les partitions mensuelles entièrement antérieures à
+        `cutoff` (epoch): fichier effacé, sans DELETE ni VACUUM
+
+        Returns:
+            tuple: (partitions supprimées, médias supprimés)
+        """
+        dropped = 0
+        deleted = 0
+
+        for key in self.partitions.keys():
+            if key == LEGACY_KEY or month_bounds(key)[1] > cutoff or self._stop.is_set():
+                continue
+            schema = self.partitions.schema(key)
+            self.writer.detach(schema).result()
+            count = self.partitions.drop(key, self.media_dir)
+            print(f"🗑️  Partition {schema} supprimée ({count} média(s))")
+            dropped += 1
+            deleted += count
+
+        return dropped, deleted
+
+    def purge_batch(self, cutoff, key=LEGACY_KEY):
+        """
+        Supprime au plus batch_size médias antérieurs à `cutoff` (epoch)
+        dans la partition `key`
+
+        Returns:
+            tuple: (médias supprimés, fichiers supprimés)
+        """
+        schema = self.partitions.schema(key)
+
+        def purge(conn):
+            rows = conn.execute(f"""
+                DELETE FROM {schema}.media
+                WHERE id_media IN (
+                    SELECT id_media FROM {schema}.media
+                    WHERE timestamp < ?
+                    ORDER BY timestamp
+                    LIMIT ?
+                )
+                RETURNING id_media, chemin
+            """, (cutoff, self.batch_size)).fetchall()
+
+            conn.executemany(
+                f"DELETE FROM {schema}.media_evenement WHERE id_media = ?",
+                [(id_media,) for id_media, _ in rows]
+            )
+            return len(rows), {(key, chemin) for _, chemin in rows if chemin}
+
+        deleted, chemins = self.writer.submit_call(purge, attach=self.partitions.attachments(key)).result()
+        return deleted, self.remove_files(chemins)
+
+    # --------------------------------------------
+    # Budget de stockage
+    # --------------------------------------------
+
+    def get_budget(self):
+        """
+        Returns:
+            tuple: (budget en octets ou None si illimité, politique d'éviction)
+        """
+        budget_mo = self.config.get_float('budget_stockage_mo', 0) or 0
+        policy = self.config.get('politique_eviction', 'anciens')
+        return (int(budget_mo * 1024 * 1024) if budget_mo > 0 else None), policy
+
+    def eviction_keys(self):
+        """
+        Partitions où l'éviction choisit ses médias (à attacher avec
+        l'insertion): main et les plus anciennes qui ont encore des médias
+        """
+        return self.partitions.oldest_keys(EVICTION_PARTITIONS)
+
+    def make_room(self, conn, incoming, keys=(LEGACY_KEY,)):
+        """
+        Contrôle avant insertion, dans la transaction de l'écrivain
+
+        Une lecture de media_stats par partition quand le budget est
+        respecté; sinon éviction du strict nécessaire pour que `incoming`
+        octets tiennent, au plus batch_size médias (la passe périodique
+        termine). Un clip plus gros que le budget n'évince rien.
+
+        Args:
+            keys: partitions attachées à `conn` (eviction_keys())
+
+        Returns:
+            set: (partition, chemin) à passer à remove_files() après COMMIT
+        """
+        budget, policy = self.get_budget()
+        if not budget:
+            return set()
+        if incoming > budget:
+            print(f"⚠️  Clip de {incoming / 1024 / 1024:.1f} Mo plus gros que le budget de stockage "
+                  f"({budget / 1024 / 1024:.0f} Mo): aucune éviction")
+            return set()
+
+        evicted, chemins = evict_media(conn, budget - incoming, policy, self.batch_size,
+                                       self.partitions, keys)
+        if evicted:
+            print(f"💽 Budget de stockage atteint: {evicted} média(s) évincé(s) ({policy})")
+            with self._stats_lock:
+                self._stats['evicted'] += evicted
+        return chemins
+
+    def enforce_budget(self, target_bytes, policy):
+        """
+        Redescend sous `target_bytes` par lots de batch_size
+
+        Returns:
+            tuple: (médias évincés, fichiers supprimés)
+        """
+        evicted = 0
+        files = 0
+        deadline = time.monotonic() + self.max_run_seconds
+
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            # Relues à chaque lot: les partitions vidées cèdent la place aux suivantes
+            keys = self.eviction_keys()
+            count, chemins = self.writer.submit_call(
+                lambda conn: evict_media(conn, target_bytes, policy, self.batch_size, self.partitions, keys),
+                attach=self.partitions.attachments(*keys)
+            ).result()
+            evicted += count
+            files += self.remove_files(chemins)
+            # Lot incomplet: budget atteint, ou partitions candidates vidées
+            # (le lot suivant passe aux mois suivants)
+            if count == 0:
+                break
+            self._stop.wait(RETENTION_BATCH_PAUSE)
+
+        return evicted, files
+
+    def remove_files(self, chemins):
+        """
+        Supprime les fichiers devenus orphelins, après COMMIT des lignes
+
+        La vérification passe par l'écrivain: elle est ordonnée avec les
+        insertions qui réutiliseraient le même contenu.
+        """
+        if not chemins:
+            return 0
+
+        def remove(conn):
+            return sum(
+                remove_unreferenced_file(conn, chemin, self.media_dir, self.partitions.schema(key))
+                for key, chemin in chemins
+            )
+
+        keys = {key for key, _ in chemins}
+        return self.writer.submit_call(remove, attach=self.partitions.attachments(*keys)).result()
+
+    def incremental_vacuum(self, keys=(LEGACY_KEY,)):
+        """
+        Rend les pages libres au système, par tranches de RETENTION_VACUUM_PAGES
+
+        Args:
+            keys: partitions où des médias ont été supprimés
+
+        Returns:
+            int: nombre de pages libérées (0 si les bases ne sont pas en
+                 auto_vacuum = INCREMENTAL)
+        """
+        keys = sorted(keys) or [LEGACY_KEY]
+
+        def vacuum(conn):
+            freed = 0
+            for key in keys:
+                schema = self.partitions.schema(key)
+                if conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                    continue
+                pages = min(conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0],
+                            RETENTION_VACUUM_PAGES - freed)
+                # Le pragma ne retourne aucune ligne: le module sqlite3 ne l'exécute
+                # qu'une étape, soit une page libérée par appel
+                for _ in range(pages):
+                    conn.execute(f"PRAGMA {schema}.incremental_vacuum(1)")
+                freed += pages
+            return freed
+
+        total = 0
+        deadline = time.monotonic() + self.max_run_seconds
+
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            freed = self.writer.submit_call(vacuum, attach=self.partitions.attachments(*keys)).result()
+            total += freed
+            if freed < RETENTION_VACUUM_PAGES:
+                break
+            self._stop.wait(RETENTION_BATCH_PAUSE)
+
+        return total
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+# ============================================
+# Ligne de commande
+# ============================================
+
+def enable_incremental_vacuum(db_path=DB_PATH):
+    """
+    Passe une base existante en auto_vacuum = INCREMENTAL
+
+    Nécessite un VACUUM complet (réécriture de la base): à lancer service
+    arrêté.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            print(f"✅ {db_path} est déjà en auto_vacuum incrémental")
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        print(f"🗜️  VACUUM de {db_path}...")
+        conn.execute("VACUUM")
+        print(f"✅ auto_vacuum incrémental activé")
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    from db_cache import ConfigCache
+    from db_writer import EventWriter
+
+    parser = argparse.ArgumentParser(description="Rétention des médias")
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help="Effectuer une passe de purge")
+    sub.add_parser('enable-incremental-vacuum', help="Convertir la base (service arrêté)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'enable-incremental-vacuum':
+        enable_incremental_vacuum(args.db)
+        return 0
+
+    writer = EventWriter(args.db)
+    config = ConfigCache(args.db, poll_interval=0)
+    writer.start()
+    config.start()
+    try:
+        result = RetentionWorker(writer, config).run_once()
+        print(f"✅ Passe terminée: {result}")
+    finally:
+        writer.stop()
+        config.stop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
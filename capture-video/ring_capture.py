@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Capture avec pré-déclenchement (ring buffer H.264)
+
+- Un encodeur unique tourne en continu et écrit un flux H.264 Annex B
+  sur sa sortie standard
+- Le flux est découpé en GOP (un GOP commence à une image IDR) conservés
+  en mémoire sur les dernières PRE_TRIGGER_SECONDS secondes
+- Sur déclenchement, le clip contient les GOP déjà en mémoire puis ceux
+  produits pendant la durée d'enregistrement: la première image est
+  disponible immédiatement, sans temps de démarrage caméra
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+PRE_TRIGGER_SECONDS = float(os.getenv("PRE_TRIGGER_SECONDS", 5))
+RING_MAX_BYTES = int(os.getenv("RING_MAX_MB", 64)) * 1024 * 1024
+ENCODER_READ_SIZE = 64 * 1024
+ENCODER_RESTART_DELAY = 2
+
+# Types de NAL units H.264
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+
+def nal_type(nal):
+    """Type d'une NAL unit (start code inclus)"""
+    offset = 4 if nal[2] == 0 else 3
+    return nal[offset] & 0x1F
+
+
+def is_first_slice(nal):
+    """True si la slice commence l'image (first_mb_in_slice == 0)"""
+    offset = 4 if nal[2] == 0 else 3
+    return len(nal) > offset + 1 and nal[offset + 1] & 0x80 != 0
+
+
+class NalSplitter:
+    """Découpe un flux Annex B en NAL units (start code inclus)"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    def feed(self, data):
+        """
+        Ajoute des octets du flux
+
+        Returns:
+            list[bytes]: NAL units complètes (la dernière reste en attente)
+        """
+        self._buffer += data
+        nals = []
+
+        start = self._find_start(0)
+        if start < 0:
+            return nals
+
+        while True:
+            next_start = self._find_start(max(start + 3, self._scan_from))
+            if next_start < 0:
+                break
+            nals.append(bytes(self._buffer[start:next_start]))
+            start = next_start
+
+        del self._buffer[:start]
+        self._scan_from = max(0, len(self._buffer) - 3)
+        return nals
+
+    def _find_start(self, offset):
+        pos = self._buffer.find(b'\x00\x00\x01', offset)
+        if pos > 0 and self._buffer[pos - 1] == 0:
+            return pos - 1
+        return pos
+
+
+class Gop:
+    """Groupe d'images débutant par une IDR"""
+
+    __slots__ = ('timestamp', 'end_timestamp', 'data', 'has_params')
+
+    def __init__(self, timestamp, data, has_params):
+        self.timestamp = timestamp
+        self.end_timestamp = timestamp
+        self.data = data
+        self.has_params = has_params
+
+
+class GopAssembler:
+    """
+    Regroupe les NAL units en GOP
+
+    Les NAL non-VCL (AUD, SEI, SPS, PPS) sont rattachées à l'image qui les
+    suit. Les derniers SPS/PPS sont mémorisés pour pouvoir rendre décodable
+    un clip dont le premier GOP ne les répète pas.
+    """
+
+    def __init__(self, on_gop):
+        self.on_gop = on_gop
+        self.params = {}
+        self._prefix = []
+        self._current = None
+        self._current_ts = None
+
+    def push(self, nal, timestamp):
+        kind = nal_type(nal)
+
+        if kind in (NAL_SPS, NAL_PPS):
+            self.params[kind] = nal
+
+        if kind not in (NAL_SLICE, NAL_IDR):
+            self._prefix.append(nal)
+            return
+
+        if kind == NAL_IDR and is_first_slice(nal):
+            self._close(timestamp)
+            self._current = self._prefix + [nal]
+            self._current_ts = timestamp
+        elif self._current is not None:
+            self._current.extend(self._prefix)
+            self._current.append(nal)
+        # Sinon: slices avant la première IDR, non décodables, ignorées
+
+        self._prefix = []
+
+    def _close(self, timestamp):
+        if self._current is None:
+            return
+
+        has_params = any(nal_type(nal) == NAL_SPS for nal in self._current)
+        gop = Gop(self._current_ts, b''.join(self._current), has_params)
+        gop.end_timestamp = timestamp
+        self._current = None
+        self.on_gop(gop)
+
+    def parameter_sets(self):
+        """SPS + PPS courants (Annex B), à placer en tête d'un clip"""
+        return self.params.get(NAL_SPS, b'') + self.params.get(NAL_PPS, b'')
+
+
+class GopRing:
+    """
+    Ring buffer des GOP couvrant au moins `pre_seconds` secondes
+
+    Les abonnés (taps) reçoivent chaque GOP terminé après leur inscription.
+    """
+
+    def __init__(self, pre_seconds, max_bytes=RING_MAX_BYTES):
+        self.pre_seconds = pre_seconds
+        self.max_bytes = max_bytes
+
+        self._gops = deque()
+        self._bytes = 0
+        self._taps = []
+        self._lock = threading.Lock()
+
+    def append(self, gop):
+        with self._lock:
+            self._gops.append(gop)
+            self._bytes += len(gop.data)
+            self._prune(gop.end_timestamp)
+            taps = list(self._taps)
+
+        for tap in taps:
+            tap(gop)
+
+    def _prune(self, now):
+        # Conserver le GOP qui contient l'instant now - pre_seconds
+        cutoff = now - self.pre_seconds
+        while len(self._gops) > 1 and (
+            self._gops[1].timestamp <= cutoff or self._bytes > self.max_bytes
+        ):
+            self._bytes -= len(self._gops.popleft().data)
+
+    def snapshot_and_tap(self, since, tap, after=None):
+        """
+        GOP couvrant [since, maintenant] + inscription atomique de `tap`
+
+        Args:
+            after: timestamp du dernier GOP déjà écrit (prolongation): seuls
+                   les GOP strictement postérieurs sont retournés
+
+        Returns:
+            list[Gop]: GOP déjà en mémoire, du plus ancien au plus récent
+        """
+        with self._lock:
+            gops = list(self._gops)
+            self._taps.append(tap)
+
+        if after is not None:
+            return [gop for gop in gops if gop.timestamp > after]
+
+        first = 0
+        for i, gop in enumerate(gops):
+            if gop.timestamp <= since:
+                first = i
+        return gops[first:]
+
+    def remove_tap(self, tap):
+        with self._lock:
+            self._taps.remove(tap)
+
+    def latest(self):
+        """Dernier GOP terminé, ou None"""
+        with self._lock:
+            return self._gops[-1] if self._gops else None
+
+    def clear(self):
+        with self._lock:
+            self._gops.clear()
+            self._bytes = 0
+
+    def buffered_seconds(self):
+        with self._lock:
+            if not self._gops:
+                return 0.0
+            return self._gops[-1].end_timestamp - self._gops[0].timestamp
+
+
+class RingRecorder:
+    """
+    Encodeur continu + ring buffer de GOP
+
+    `commands(settings)` retourne la liste [(nom, commande)] des encodeurs
+    continus à essayer (voir BackendSelector.stream_commands). L'encodeur est
+    supervisé par un thread: s'il s'arrête, il est relancé (en passant à la
+    commande suivante s'il meurt dès le démarrage).
+    """
+
+    def __init__(self, commands, pre_seconds=PRE_TRIGGER_SECONDS):
+        self.pre_seconds = pre_seconds
+        self.commands = commands
+        self.ring = GopRing(pre_seconds)
+
+        self.encoder_name = None
+        self._assembler = None
+        self._settings = None
+        self._process = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    # --------------------------------------------
+    # Cycle de vie de l'encodeur
+    # --------------------------------------------
+
+    def start(self, settings):
+        """Démarre (ou redémarre) l'encodeur avec ces paramètres"""
+        self.stop()
+
+        self._settings = dict(settings)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._supervise, name="ring-encoder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            process = self._process
+        if process and process.poll() is None:
+            process.terminate()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.ring.clear()
+
+    def restart(self, settings):
+        print(f"🔁 Redémarrage de l'encodeur continu "
+              f"({settings['width']}x{settings['height']} @ {settings['fps']} fps)")
+        self.start(settings)
+
+    def is_running(self):
+        """True si l'encodeur alimente le ring buffer"""
+        with self._lock:
+            return self._process is not None and self._process.poll() is None
+
+    def _supervise(self):
+        commands = self.commands(self._settings)
+        if not commands:
+            print("❌ Aucun backend disponible pour l'encodage continu: "
+                  "ring buffer désactivé (captures directes)")
+            return
+        index = 0
+
+        while not self._stop.is_set():
+            name, cmd = commands[index % len(commands)]
+            started = time.monotonic()
+
+            try:
+                self._run_encoder(name, cmd)
+            except FileNotFoundError:
+                print(f"   ⚠️  {name} non disponible pour l'encodage continu")
+            except Exception as e:
+                print(f"   ⚠️  Encodeur continu {name} en erreur: {e}")
+
+            if self._stop.is_set():
+                break
+
+            # Mort au démarrage: essayer la commande suivante
+            if time.monotonic() - started < ENCODER_RESTART_DELAY * 2:
+                index += 1
+            self.ring.clear()
+            self._stop.wait(ENCODER_RESTART_DELAY)
+
+    def _run_encoder(self, name, cmd):
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with self._lock:
+            self._process = process
+            self.encoder_name = name
+            self._assembler = GopAssembler(self.ring.append)
+
+        print(f"🎥 Encodeur continu démarré avec {name} "
+              f"(pré-déclenchement {self.pre_seconds:.0f}s)")
+
+        splitter = NalSplitter()
+        try:
+            while True:
+                chunk = process.stdout.read1(ENCODER_READ_SIZE)
+                if not chunk:
+                    break
+                now = time.monotonic()
+                for nal in splitter.feed(chunk):
+                    self._assembler.push(nal, now)
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+            with self._lock:
+                self._process = None
+
+        if not self._stop.is_set():
+            print(f"   ⚠️  Encodeur continu {name} arrêté (code {process.returncode})")
+
+    # --------------------------------------------
+    # Enregistrement
+    # --------------------------------------------
+
+    def snapshot(self, output_file):
+        """
+        Écrit la dernière image IDR du ring buffer (SPS/PPS inclus): photo
+        sans solliciter la caméra
+
+        Returns:
+            bool: False si le ring buffer est vide
+        """
+        gop = self.ring.latest()
+        if gop is None:
+            return False
+
+        # Start code final: la dernière NAL du GOP est ainsi complète
+        nals = NalSplitter().feed(gop.data + b'\x00\x00\x01')
+        with open(output_file, 'wb') as f:
+            if not gop.has_params and self._assembler:
+                f.write(self._assembler.parameter_sets())
+            for nal in nals:
+                if nal_type(nal) == NAL_SLICE:
+                    break
+                f.write(nal)
+        return True
+
+    def record(self, output_file, duration, pre_seconds=None, until=None, append=False, after=None):
+        """
+        Écrit pre_seconds avant le déclenchement + duration après
+
+        Args:
+            until: callable optionnel retournant l'instant de fin (monotonic)
+                   courant, réévalué à chaque GOP pour prolonger le clip
+            append: ajouter au fichier existant (segment de prolongation)
+            after: timestamp du dernier GOP écrit par le segment précédent
+                   (retourné par l'appel précédent): le segment reprend au
+                   GOP suivant, sans le réécrire
+
+        Returns:
+            tuple | None: (durée couverte par le segment en secondes,
+                          timestamp de son dernier GOP), None si le ring
+                          buffer ne produit aucune image
+        """
+        pre_seconds = self.pre_seconds if pre_seconds is None else pre_seconds
+        trigger = time.monotonic()
+
+        def end():
+            requested = trigger + duration
+            return max(requested, until()) if until else requested
+
+        gops = queue.Queue()
+        pre_gops = self.ring.snapshot_and_tap(trigger - pre_seconds, gops.put, after)
+        first_ts = None
+        last_ts = None
+        last_gop = after
+
+        try:
+            with open(output_file, 'ab' if append else 'wb') as f:
+                def write(gop):
+                    nonlocal first_ts, last_ts, last_gop
+                    if last_gop is not None and gop.timestamp <= last_gop:
+                        return
+                    last_gop = gop.timestamp
+                    if first_ts is None:
+                        first_ts = gop.timestamp
+                        if not gop.has_params and self._assembler:
+                            f.write(self._assembler.parameter_sets())
+                    f.write(gop.data)
+                    last_ts = gop.end_timestamp
+
+                for gop in pre_gops:
+                    write(gop)
+
+                while last_ts is None or last_ts < end():
+                    # Marge: au plus un GOP (une seconde) après la fin demandée
+                    timeout = end() + 2 - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        write(gops.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+        finally:
+            self.ring.remove_tap(gops.put)
+
+        if first_ts is None:
+            return None
+        return last_ts - first_ts, last_gop
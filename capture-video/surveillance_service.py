@@ -11,11 +11,30 @@ import paho.mqtt.client as mqtt
 import json
 import os
 import time
-import subprocess
 import sqlite3
+import math
+import queue
+import shutil
+import threading
 from datetime import datetime
 from pathlib import Path
 
+from db_cache import ConfigCache, SensorRegistry
+from capture_backends import CAPTURE_DEVICE, BackendSelector, default_backends
+from capture_journal import (complete_entry, discard_entry, ensure_journal_schema, load_entries,
+                             recover_file, remove_entry, start_entry, sweep_temp_dir)
+from db_writer import EventWriter
+from event_dedup import EventDeduplicator, load_recent_event_ids
+from lanes import (LANE_CAPTURE_SLO_MS, LANE_CONTROL_SLO_MS, LANE_CONTROL_WORKERS,
+                   LANE_SENSOR_SLO_MS, LANE_SENSOR_WORKERS, Lane)
+from media_partitions import MediaPartitions, make_media_id
+from media_store import ensure_media_schema, get_media_store, media_extension
+from metrics import REGISTRY, start_metrics_server
+from retention import RetentionWorker
+from ring_capture import PRE_TRIGGER_SECONDS, RingRecorder
+from thumbnails import ThumbnailWorker, ensure_thumbnail_schema
+from transmux import TransmuxError, transmux_to_mp4
+
 # ============================================
 # Configuration
 # ============================================
@@ -25,19 +44,78 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
 MQTT_TOPIC_MOTION = os.getenv("MQTT_TOPIC_MOTION", "sensor/motion")
 MQTT_TOPIC_BUTTON = os.getenv("MQTT_TOPIC_BUTTON", "sensor/button")
 MQTT_TOPIC_PRESSURE = os.getenv("MQTT_TOPIC_PRESSURE", "sensor/pressure")
+MQTT_TOPIC_RELOAD = os.getenv("MQTT_TOPIC_RELOAD", "system/reload")
 
 DEVICE_ID = os.getenv("DEVICE_ID", "raspberry-1")
 RECORD_DURATION = int(os.getenv("RECORD_DURATION", 10))
 VIDEO_WIDTH = int(os.getenv("VIDEO_WIDTH", 1280))
 VIDEO_HEIGHT = int(os.getenv("VIDEO_HEIGHT", 720))
 VIDEO_FPS = int(os.getenv("VIDEO_FPS", 30))
-
-DB_PATH = "/data/surveillance.db"
-TEMP_VIDEO_DIR = "/tmp/videos"
+CAPTURE_WORKERS = int(os.getenv("CAPTURE_WORKERS", 1))
+# direct: un processus caméra par événement
+# ring: encodeur continu + pré-déclenchement (PRE_TRIGGER_SECONDS)
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "direct")
+# Caméras enregistrées en parallèle à chaque détection: périphériques V4L2
+# séparés par des virgules, numero_camera = position (index CSI = position - 1
+# pour libcamera-vid / raspivid)
+CAMERAS = os.getenv("CAMERAS", CAPTURE_DEVICE)
+# Durée maximale d'un clip prolongé par une rafale de détections
+# (surchargée par la clé de configuration duree_max_clip)
+MAX_CLIP_DURATION = int(os.getenv("MAX_CLIP_DURATION", 60))
+# File de capture bornée (clé file_capture_max) et politique de délestage
+# quand elle est pleine (clé politique_delestage):
+# abandon_recent | abandon_ancien | fusion | photo
+CAPTURE_QUEUE_MAX = int(os.getenv("CAPTURE_QUEUE_MAX", 4))
+CAPTURE_SHED_POLICY = os.getenv("CAPTURE_SHED_POLICY", "fusion")
+SHED_POLICIES = ('abandon_recent', 'abandon_ancien', 'fusion', 'photo')
+
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+# Clips temporaires à côté de la base: ceux d'une capture interrompue
+# survivent à la recréation du conteneur et sont repris au démarrage
+TEMP_VIDEO_DIR = os.getenv("TEMP_VIDEO_DIR", os.path.join(os.path.dirname(DB_PATH), "tmp_videos"))
 
 # Créer le dossier temporaire
 Path(TEMP_VIDEO_DIR).mkdir(parents=True, exist_ok=True)
 
+# ============================================
+# Métriques (exposées sur METRICS_PORT)
+# ============================================
+
+MESSAGES_METRIC = REGISTRY.counter(
+    'mqtt_messages_total', "Messages MQTT reçus", ('topic',)
+)
+DUPLICATES_METRIC = REGISTRY.counter(
+    'mqtt_duplicates_total', "Redistributions QoS 1 écartées (event_id déjà reçu)", ('topic',)
+)
+ON_MESSAGE_METRIC = REGISTRY.histogram(
+    'mqtt_on_message_seconds', "Durée du callback on_message (thread réseau MQTT)", ('topic',)
+)
+EVENEMENTS_METRIC = REGISTRY.counter(
+    'evenements_saved_total', "Événements soumis à l'écrivain, par résultat", ('type', 'result')
+)
+EVENEMENT_PERSIST_METRIC = REGISTRY.histogram(
+    'evenement_persist_seconds', "Soumission d'un événement → COMMIT"
+)
+MEDIA_METRIC = REGISTRY.counter(
+    'media_saved_total', "Médias stockés, par résultat", ('result',)
+)
+MEDIA_SAVE_METRIC = REGISTRY.histogram(
+    'media_save_seconds', "Durée de save_media (copie + COMMIT)"
+)
+MEDIA_SIZE_METRIC = REGISTRY.histogram(
+    'media_size_bytes', "Taille des clips stockés",
+    buckets=(256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+)
+RECORD_METRIC = REGISTRY.counter(
+    'record_video_total', "Enregistrements vidéo, par résultat", ('result',)
+)
+RECORD_SECONDS_METRIC = REGISTRY.histogram(
+    'record_video_seconds', "Durée de record_video (prolongations incluses)"
+)
+SHED_METRIC = REGISTRY.counter(
+    'capture_shed_total', "Captures délestées (file de capture pleine), par politique", ('policy',)
+)
+
 print(f"""
 ╔════════════════════════════════════════════════════════════╗
 ║         Service Surveillance - {DEVICE_ID:^23s}        ║
@@ -45,7 +123,11 @@ print(f"""
 
 📡 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}
 📹 Topics: {MQTT_TOPIC_MOTION}, {MQTT_TOPIC_BUTTON}, {MQTT_TOPIC_PRESSURE}
+🔄 Rechargement caches: {MQTT_TOPIC_RELOAD}
 ⏱️  Durée enregistrement: {RECORD_DURATION}s
+🎬 Workers de capture: {CAPTURE_WORKERS}
+🎞️  Mode de capture: {CAPTURE_MODE}
+📷 Caméras: {CAMERAS}
 💾 Base de données: {DB_PATH}
 """)
 
@@ -97,6 +179,8 @@ def init_database():
                 type_media TEXT NOT NULL,
                 video BLOB NOT NULL,
                 taille INTEGER NOT NULL,
+                chemin TEXT,
+                sha256 TEXT,
                 duree INTEGER,
                 date_media TEXT NOT NULL,
                 timestamp REAL NOT NULL,
@@ -109,6 +193,12 @@ def init_database():
                 FOREIGN KEY (id_evenement) REFERENCES evenement(id_evenement) ON DELETE SET NULL
             );
 
+            CREATE TABLE IF NOT EXISTS media_evenement (
+                id_media INTEGER NOT NULL,
+                id_evenement INTEGER NOT NULL,
+                PRIMARY KEY (id_media, id_evenement)
+            ) WITHOUT ROWID;
+
             CREATE TABLE IF NOT EXISTS configuration (
                 cle TEXT PRIMARY KEY,
                 valeur TEXT NOT NULL,
@@ -123,52 +213,154 @@ def init_database():
             (4, 'Caméra 1', 'camera', 'raspberry-1');
 
             -- Config par défaut
-            INSERT OR REPLACE INTO configuration (cle, valeur) VALUES
+            INSERT OR IGNORE INTO configuration (cle, valeur) VALUES
             ('mode_systeme', 'actif'),
             ('duree_enregistrement', '10');
         """)
 
+    # Bases créées avant ces colonnes: chemin, sha256, priorite
+    ensure_media_schema(conn)
+    ensure_journal_schema(conn)
+    ensure_thumbnail_schema(conn)
+
     conn.commit()
     conn.close()
     print("✅ Base de données initialisée")
 
 
-def get_capteur_id_by_type(capteur_type):
-    """Récupère l'ID du capteur par son type"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# Écrivain unique (connexion persistante WAL, validation groupée)
+db_writer = None
 
-    cursor.execute("""
-        SELECT id_capteur FROM capteur
-        WHERE type_capteur = ? AND device_id = ? AND actif = 1
-        LIMIT 1
-    """, (capteur_type, DEVICE_ID))
+# Stockage des vidéos (MEDIA_STORE=blob|file)
+media_backend = get_media_store()
 
-    row = cursor.fetchone()
-    conn.close()
+# Bases mensuelles des médias (MEDIA_PARTITIONS=mois|aucune)
+media_partitions = MediaPartitions(DB_PATH)
 
-    return row[0] if row else None
+# Registre des capteurs et configuration en mémoire
+# (aucune requête sur le chemin chaud)
+sensor_registry = None
+config_cache = None
 
+# Purge des anciens médias (retention_jours), hors chemin d'insertion
+retention_worker = None
 
-def save_evenement(event_id, capteur_type, etat, metadata=None):
+# Aperçus et bandes d'images clés, extraits après l'insertion des médias
+thumbnail_worker = None
+
+# event_id déjà reçus (redistributions QoS 1 écartées avant toute écriture)
+event_dedup = EventDeduplicator()
+
+
+def start_db_writer():
+    """Démarre l'écrivain SQLite partagé par tout le service"""
+    global db_writer
+
+    db_writer = EventWriter(DB_PATH)
+    db_writer.start()
+    print(f"💾 Écrivain SQLite démarré (lots de {db_writer.batch_size}, "
+          f"{db_writer.batch_interval * 1000:.0f} ms)")
+
+
+def stop_db_writer():
+    """Valide les écritures en attente et ferme la connexion"""
+    if db_writer:
+        db_writer.stop()
+
+
+def start_caches():
+    """Charge les tables de référence en mémoire et surveille leurs changements"""
+    global sensor_registry, config_cache
+
+    sensor_registry = SensorRegistry(DB_PATH)
+    sensor_registry.start()
+    print(f"📇 Registre capteurs chargé")
+
+    config_cache = ConfigCache(DB_PATH)
+    config_cache.on_change(report_config_change)
+    config_cache.start()
+    print(f"⚙️  Configuration chargée (mode: {get_config('mode_systeme', 'inconnu')})")
+
+
+def stop_caches():
+    for cache in (sensor_registry, config_cache):
+        if cache:
+            cache.stop()
+
+
+def start_retention():
+    """Démarre la purge en arrière-plan (écrivain et configuration requis)"""
+    global retention_worker
+
+    retention_worker = RetentionWorker(db_writer, config_cache, partitions=media_partitions)
+    retention_worker.start()
+    print(f"🧹 Rétention des médias: {retention_worker.get_retention_days()} jours "
+          f"(passe toutes les {retention_worker.interval}s)")
+
+
+def stop_retention():
+    if retention_worker:
+        retention_worker.stop()
+
+
+def start_thumbnails():
+    """Démarre l'extraction des miniatures (médias récents puis rattrapage)"""
+    global thumbnail_worker
+
+    thumbnail_worker = ThumbnailWorker(db_writer, DB_PATH, partitions=media_partitions)
+    thumbnail_worker.start()
+    print(f"🖼️  Miniatures: aperçu + bande d'images clés après chaque capture")
+
+
+def stop_thumbnails():
+    if thumbnail_worker:
+        thumbnail_worker.stop()
+
+
+def seed_event_dedup():
+    """Amorce la déduplication avec les derniers event_id enregistrés"""
+    event_ids = load_recent_event_ids(DB_PATH, 'evenement', event_dedup.capacity)
+    event_dedup.seed(event_ids)
+    print(f"🧾 Déduplication amorcée ({len(event_ids)} event_id récents)")
+
+
+def reload_caches():
+    """Rechargement explicite (topic MQTT_TOPIC_RELOAD)"""
+    try:
+        sensor_registry.reload()
+        config_cache.reload()
+        print(f"🔄 Caches rechargés")
+    except sqlite3.Error as e:
+        print(f"❌ Rechargement des caches impossible: {e}")
+
+
+def get_capteur_id_by_type(capteur_type):
+    """Récupère l'ID du capteur par son type (depuis le registre en mémoire)"""
+    return sensor_registry.get_id(capteur_type, DEVICE_ID)
+
+
+def save_evenement_async(event_id, capteur_type, etat, metadata=None, urgent=False):
     """
-    Enregistre un événement dans la base de données
+    Soumet l'insertion d'un événement à l'écrivain groupé
+
+    Args:
+        urgent: valider sans attendre le délai de regroupement (voie contrôle)
 
     Returns:
-        int: id_evenement
+        Future | None: résolu avec id_evenement après COMMIT,
+                       None si le capteur est inconnu
     """
     id_capteur = get_capteur_id_by_type(capteur_type)
 
     if not id_capteur:
         print(f"⚠️  Capteur type '{capteur_type}' non trouvé dans la base")
+        EVENEMENTS_METRIC.inc(type=capteur_type, result='unknown_sensor')
         return None
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
     now = datetime.now()
+    submitted = time.perf_counter()
 
-    cursor.execute("""
+    future = db_writer.submit("""
         INSERT INTO evenement
         (event_id, date_evenement, timestamp, etat_capteur, id_capteur, metadata)
         VALUES (?, ?, ?, ?, ?, ?)
@@ -179,175 +371,1096 @@ def save_evenement(event_id, capteur_type, etat, metadata=None):
         etat,
         id_capteur,
         json.dumps(metadata) if metadata else None
-    ))
+    ), urgent=urgent)
 
-    id_evenement = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    def observe(future):
+        error = future.exception()
+        EVENEMENT_PERSIST_METRIC.observe(time.perf_counter() - submitted)
+        EVENEMENTS_METRIC.inc(type=capteur_type, result='error' if error else 'ok')
+        # Écriture perdue (hors doublon en base): laisser passer une redistribution
+        if error and not isinstance(error, sqlite3.IntegrityError):
+            event_dedup.forget(event_id)
 
-    return id_evenement
+    future.add_done_callback(observe)
+    return future
 
 
-def save_media(video_data, id_evenement, id_capteur, numero_camera=1):
+def save_evenement(event_id, capteur_type, etat, metadata=None):
     """
-    Enregistre un média (vidéo) dans la base de données
+    Enregistre un événement dans la base de données
 
     Returns:
-        int: id_media
+        int: id_evenement
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    future = save_evenement_async(event_id, capteur_type, etat, metadata)
+    return future.result() if future else None
 
-    now = datetime.now()
 
-    cursor.execute("""
-        INSERT INTO media
-        (type_media, video, taille, duree, date_media, timestamp,
-         id_capteur, id_evenement, numero_camera, resolution, codec)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        'video',
-        video_data,
-        len(video_data),
-        RECORD_DURATION,
-        now.isoformat(),
-        time.time(),
-        id_capteur,
-        id_evenement,
-        numero_camera,
-        f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",
-        'h264'
-    ))
+def save_media(video_file, id_evenement, id_capteur, numero_camera=1, settings=None,
+               linked_evenements=(), priorite=0, type_media='video', codec='h264',
+               conteneur=None, codecs=None, journal_file=None):
+    """
+    Enregistre un média (vidéo ou photo) dans la base de données
+
+    Le fichier est rangé par le backend MEDIA_STORE: copié par blocs dans
+    le BLOB (blob) ou sur disque sous un chemin adressé par contenu (file),
+    dans la partition du mois courant (MEDIA_PARTITIONS).
+    Si budget_stockage_mo est atteint, les médias à évincer sont supprimés
+    dans la même transaction, juste avant l'insertion.
+
+    Args:
+        video_file: Chemin du fichier vidéo capturé
+        settings: Paramètres utilisés pour la capture (get_video_settings())
+        linked_evenements: id_evenement couverts par le clip (rafale fusionnée),
+                           reliés via media_evenement dans la même transaction
+        priorite: ordre d'éviction (politique_eviction = priorite)
+        type_media, codec: 'photo' / 'jpeg' pour un snapshot de délestage
+        conteneur, codecs: 'mp4' et chaîne RFC 6381 d'un clip remultiplexé
+                           (package_clip), None pour un flux brut
+        journal_file: clip brut inscrit au journal des captures, si video_file
+                      en est dérivé (MP4)
 
-    id_media = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    Returns:
+        int: id_media global (partition incluse)
+    """
+    started = time.perf_counter()
+    try:
+        id_media = _save_media(video_file, id_evenement, id_capteur, numero_camera,
+                               settings, linked_evenements, priorite, type_media, codec,
+                               conteneur, codecs, journal_file)
+    except Exception:
+        MEDIA_METRIC.inc(result='error')
+        raise
+    MEDIA_METRIC.inc(result='ok')
+    MEDIA_SAVE_METRIC.observe(time.perf_counter() - started)
+    if thumbnail_worker:
+        thumbnail_worker.notify()
+    return id_media
 
+
+def _save_media(video_file, id_evenement, id_capteur, numero_camera, settings,
+                linked_evenements, priorite, type_media, codec, conteneur, codecs, journal_file):
+    settings = settings or get_video_settings()
+    now = datetime.now()
+    key = media_partitions.key_for(now.timestamp())
+    keys = {key, *retention_worker.eviction_keys()} if retention_worker else {key}
+    incoming = os.path.getsize(video_file)
+    MEDIA_SIZE_METRIC.observe(incoming)
+    staged = media_backend.stage(video_file, media_extension(codec, conteneur), media_partitions.media_subdir(key))
+    evicted = set()
+
+    def insert(conn):
+        if retention_worker:
+            evicted.update(retention_worker.make_room(conn, incoming, keys))
+
+        schema = media_partitions.schema(key)
+        id_media = media_backend.insert(conn, {
+            'type_media': type_media,
+            'duree': settings['duration'],
+            'date_media': now.isoformat(),
+            'timestamp': now.timestamp(),
+            'id_capteur': id_capteur,
+            'id_evenement': id_evenement,
+            'numero_camera': numero_camera,
+            'resolution': f"{settings['width']}x{settings['height']}",
+            'codec': codec,
+            'priorite': priorite,
+            'conteneur': conteneur,
+            'codecs': codecs,
+        }, staged, schema)
+
+        link_media_evenements(conn, id_media, {id_evenement, *linked_evenements}, schema)
+        # Clip rangé: sa ligne de journal disparaît avec l'insertion
+        remove_entry(conn, journal_file or video_file)
+        return make_media_id(key, id_media)
+
+    try:
+        id_media = db_writer.submit_call(insert, attach=media_partitions.attachments(*keys)).result()
+    except Exception:
+        discard_staged(staged, key)
+        raise
+    if evicted:
+        retention_worker.remove_files(evicted)
     return id_media
 
 
+def discard_staged(staged, key):
+    """
+    Supprime le contenu préparé par stage() quand son insertion échoue
+    (MEDIA_STORE=file: fichier écrit avant la transaction)
+
+    Passe par l'écrivain, comme RetentionWorker.remove_files: ordonné avec
+    les insertions qui réutiliseraient le même contenu.
+    """
+    schema = media_partitions.schema(key)
+    try:
+        db_writer.submit_call(
+            lambda conn: media_backend.discard(conn, staged, schema),
+            attach=media_partitions.attachments(key)
+        ).result()
+    except Exception as e:
+        print(f"⚠️  Contenu préparé non supprimé: {e}")
+
+
+def link_media_evenements(conn, id_media, id_evenements, schema='main'):
+    """Relie un média (id local à sa partition) à tous les événements qu'il couvre"""
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {schema}.media_evenement (id_media, id_evenement) VALUES (?, ?)",
+        [(id_media, id_evenement) for id_evenement in id_evenements if id_evenement]
+    )
+
+
 def get_config(key, default=None):
-    """Récupère une valeur de configuration"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Récupère une valeur de configuration (depuis le cache en mémoire)"""
+    return config_cache.get(key, default)
 
-    cursor.execute("SELECT valeur FROM configuration WHERE cle = ?", (key,))
-    row = cursor.fetchone()
-    conn.close()
 
-    return row[0] if row else default
+def get_video_settings():
+    """
+    Paramètres de capture courants: une variable d'environnement définie
+    prime; sinon la table configuration, dont les modifications
+    s'appliquent à chaud
+
+    Returns:
+        dict: duration, width, height, fps
+    """
+    return config_cache.get_video_settings(RECORD_DURATION, VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS)
+
+
+def report_config_change(keys):
+    """Journalise les clés de configuration modifiées à chaud"""
+    values = ", ".join(f"{key}={config_cache.get(key)}" for key in sorted(keys))
+    print(f"⚙️  Configuration modifiée: {values}")
 
 
 # ============================================
 # Capture vidéo
 # ============================================
 
-def record_video(event_id):
+# media.numero_camera IN (1, 2)
+MAX_CAMERAS = 2
+
+
+def make_camera(numero, backends, device=None):
+    """Caméra: numéro, backends sondés puis mémorisés, encodeur continu (mode ring)"""
+    return {'numero': numero, 'device': device, 'backends': backends, 'ring': None}
+
+
+def build_cameras(devices=CAMERAS):
     """
-    Enregistre une vidéo avec libcamera-vid, ffmpeg ou raspivid
+    Une entrée par caméra configurée (CAMERAS), chacune avec ses propres
+    backends et donc son propre processus de capture
 
     Returns:
-        bytes: Données binaires de la vidéo
+        list[dict]: caméras par numéro croissant
     """
-    output_file = f"{TEMP_VIDEO_DIR}/recording_{event_id}_{int(time.time())}.h264"
+    devices = [device.strip() for device in devices.split(',') if device.strip()] or [CAPTURE_DEVICE]
+    if len(devices) > MAX_CAMERAS:
+        print(f"⚠️  {len(devices)} caméras configurées, seules les {MAX_CAMERAS} premières sont utilisées")
+        devices = devices[:MAX_CAMERAS]
 
-    print(f"📹 Démarrage enregistrement vidéo...")
-    print(f"   Fichier: {output_file}")
-    print(f"   Durée: {RECORD_DURATION}s")
+    return [
+        make_camera(numero, BackendSelector(default_backends(camera=numero - 1, device=device)), device)
+        for numero, device in enumerate(devices, start=1)
+    ]
+
+
+cameras = build_cameras()
 
-    try:
-        # Méthode 1: libcamera-vid
-        print(f"   Tentative avec libcamera-vid...")
-        cmd = [
-            "libcamera-vid",
-            "-t", str(RECORD_DURATION * 1000),
-            "--width", str(VIDEO_WIDTH),
-            "--height", str(VIDEO_HEIGHT),
-            "--framerate", str(VIDEO_FPS),
-            "--codec", "h264",
-            "-o", output_file,
-            "--nopreview"
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=RECORD_DURATION + 5)
-
-        if result.returncode == 0:
-            print(f"   ✅ Capturé avec libcamera-vid")
-        else:
-            raise Exception("libcamera-vid failed")
 
-    except (FileNotFoundError, Exception) as e:
-        print(f"   ⚠️  libcamera-vid non disponible: {e}")
+def probe_cameras():
+    """Sonde les backends de chaque caméra une seule fois"""
+    for camera in cameras:
+        print(f"📷 Caméra {camera['numero']} ({camera['device'] or 'défaut'})")
+        camera['backends'].probe()
 
+
+def get_camera_capteur_id(numero_camera):
+    """id_capteur de la caméra n (capteurs 'camera' du device, par id croissant)"""
+    ids = sensor_registry.get_ids('camera', DEVICE_ID)
+    return ids[numero_camera - 1] if len(ids) >= numero_camera else None
+
+
+def recover_captures():
+    """
+    Reprend les captures interrompues par un arrêt du service (journal_capture):
+    clips ré-ingérés en une seule transaction, événements dont le clip a
+    disparu marqués ($.capture_interrompue), puis dossier temporaire vidé
+
+    Returns:
+        int: médias ré-ingérés
+    """
+    entries = load_entries(DB_PATH)
+    recovered = []
+    lost = []
+
+    for entry in entries:
         try:
-            # Méthode 2: ffmpeg
-            print(f"   Tentative avec ffmpeg...")
-            cmd = [
-                "ffmpeg",
-                "-f", "v4l2",
-                "-framerate", str(VIDEO_FPS),
-                "-video_size", f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",
-                "-i", "/dev/video0",
-                "-t", str(RECORD_DURATION),
-                "-c:v", "libx264",
-                "-preset", "ultrafast",
-                "-y",
-                output_file
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=RECORD_DURATION + 5)
-
-            if result.returncode == 0:
-                print(f"   ✅ Capturé avec ffmpeg")
-            else:
-                raise Exception(f"ffmpeg failed: {result.stderr}")
-
-        except (FileNotFoundError, Exception) as e2:
-            print(f"   ⚠️  ffmpeg non disponible: {e2}")
-
-            try:
-                # Méthode 3: raspivid
-                print(f"   Tentative avec raspivid...")
-                cmd = [
-                    "raspivid",
-                    "-t", str(RECORD_DURATION * 1000),
-                    "-w", str(VIDEO_WIDTH),
-                    "-h", str(VIDEO_HEIGHT),
-                    "-fps", str(VIDEO_FPS),
-                    "-o", output_file,
-                    "-n"
-                ]
-
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=RECORD_DURATION + 5)
-
-                if result.returncode == 0:
-                    print(f"   ✅ Capturé avec raspivid")
-                else:
-                    raise Exception(f"raspivid failed: {result.stderr}")
-
-            except (FileNotFoundError, Exception) as e3:
-                print(f"   ❌ Toutes les méthodes ont échoué")
-                return None
-
-    # Vérifier le fichier
-    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            prepared = recover_file(entry)
+        except OSError as e:
+            print(f"⚠️  Clip {entry['fichier']} illisible: {e}")
+            prepared = None
+
+        id_capteur = get_camera_capteur_id(entry['numero_camera'])
+        if prepared is None or not id_capteur:
+            lost.append(entry)
+            continue
+
+        duree, evenements = prepared
+        # Cadence courante: le journal ne garde pas celle de la capture
+        settings = dict(get_video_settings(), duration=duree)
+        clip, conteneur, codecs = package_clip(entry['fichier'], settings)
+        key = media_partitions.key_for(entry['debut'])
+        try:
+            staged = media_backend.stage(clip, media_extension('h264', conteneur), media_partitions.media_subdir(key))
+        except OSError as e:
+            # Entrée gardée au journal: nouvel essai au prochain démarrage
+            print(f"⚠️  Clip {entry['fichier']} non préparé, reprise au prochain démarrage: {e}")
+            continue
+        recovered.append((entry, id_capteur, settings['duration'], evenements, clip, conteneur, codecs,
+                          os.path.getsize(clip), key, staged))
+
+    keys = {key for *_, key, _ in recovered}
+    if retention_worker:
+        keys.update(retention_worker.eviction_keys())
+    evicted = set()
+
+    def ingest(conn):
+        for entry, id_capteur, duree, evenements, clip, conteneur, codecs, size, key, staged in recovered:
+            if retention_worker:
+                evicted.update(retention_worker.make_room(conn, size, keys))
+
+            schema = media_partitions.schema(key)
+            id_media = media_backend.insert(conn, {
+                'type_media': 'video',
+                'duree': duree,
+                'date_media': datetime.fromtimestamp(entry['debut']).isoformat(),
+                'timestamp': entry['debut'],
+                'id_capteur': id_capteur,
+                'id_evenement': entry['id_evenement'],
+                'numero_camera': entry['numero_camera'],
+                'resolution': entry['resolution'],
+                'codec': 'h264',
+                'priorite': 0,
+                'conteneur': conteneur,
+                'codecs': codecs,
+            }, staged, schema)
+            link_media_evenements(conn, id_media, evenements, schema)
+            remove_entry(conn, entry['fichier'])
+
+        for entry in lost:
+            conn.execute("""
+                UPDATE evenement
+                SET metadata = json_set(COALESCE(metadata, '{}'), '$.capture_interrompue', json(?))
+                WHERE id_evenement = ?
+            """, (json.dumps({'numero_camera': entry['numero_camera'], 'etat': entry['etat'],
+                              'timestamp': entry['debut']}), entry['id_evenement']))
+            remove_entry(conn, entry['fichier'])
+
+    if entries:
+        try:
+            db_writer.submit_call(ingest, attach=media_partitions.attachments(*keys)).result()
+        except Exception as e:
+            # Journal et clips conservés pour le prochain démarrage, qui
+            # prépare à nouveau leur contenu
+            print(f"❌ Reprise des captures impossible: {e}")
+            for *_, key, staged in recovered:
+                discard_staged(staged, key)
+            return 0
+        if evicted:
+            retention_worker.remove_files(evicted)
+        for entry, _, _, _, clip, *_ in recovered:
+            remove_temp_files(entry['fichier'], clip)
+        MEDIA_METRIC.inc(len(recovered), result='recovered')
+
+    removed = sweep_temp_dir(TEMP_VIDEO_DIR)
+    if entries or removed:
+        print(f"♻️  Captures interrompues: {len(recovered)} clip(s) ré-ingéré(s), "
+              f"{len(lost)} perdu(s), {removed} fichier(s) temporaire(s) supprimé(s)")
+    return len(recovered)
+
+
+def start_ring_recorder():
+    """Démarre un encodeur continu par caméra si CAPTURE_MODE=ring"""
+    if CAPTURE_MODE != 'ring':
+        return
+
+    for camera in cameras:
+        camera['ring'] = RingRecorder(camera['backends'].stream_commands, PRE_TRIGGER_SECONDS)
+        camera['ring'].start(get_video_settings())
+    config_cache.on_change(restart_ring_on_change)
+
+
+def stop_ring_recorder():
+    for camera in cameras:
+        if camera['ring']:
+            camera['ring'].stop()
+
+
+def restart_ring_on_change(keys):
+    """Applique à chaud une nouvelle résolution / cadence aux encodeurs continus"""
+    if keys & {'resolution_video', 'fps_video'}:
+        for camera in cameras:
+            if camera['ring']:
+                camera['ring'].restart(get_video_settings())
+
+
+def record_segment(output_file, settings, append=False, camera=None):
+    """
+    Enregistre un segment en capture directe
+
+    Args:
+        append: ajouter le segment à output_file (prolongation d'un clip)
+        camera: caméra à utiliser (première caméra par défaut)
+
+    Returns:
+        float | None: durée du segment, None en cas d'échec
+    """
+    camera = camera or cameras[0]
+    target = f"{output_file}.part" if append else output_file
+
+    if not camera['backends'].record(target, settings):
+        print(f"   ❌ Toutes les méthodes ont échoué")
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+
+    if not os.path.exists(target) or os.path.getsize(target) == 0:
         print(f"❌ Fichier vidéo invalide")
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+
+    # Un flux H.264 Annex B se concatène tel quel (SPS/PPS en tête de segment)
+    if append:
+        with open(target, 'rb') as src, open(output_file, 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(target)
+
+    return settings['duration']
+
+
+def record_video(event_id, settings=None, session=None, camera=None, id_evenement=None):
+    """
+    Enregistre une vidéo (voir _record_video) et mesure durée et résultat
+
+    Returns:
+        str: Chemin du fichier vidéo (à supprimer après stockage), None en cas d'échec
+    """
+    started = time.perf_counter()
+    output_file = _record_video(event_id, settings, session, camera, id_evenement)
+    RECORD_METRIC.inc(result='ok' if output_file else 'failed')
+    RECORD_SECONDS_METRIC.observe(time.perf_counter() - started)
+    return output_file
+
+
+def _record_video(event_id, settings=None, session=None, camera=None, id_evenement=None):
+    """
+    Enregistre une vidéo avec le backend de capture mémorisé
+    (libcamera-vid, ffmpeg ou raspivid, sondés une seule fois), ou l'extrait
+    du ring buffer en mode 'ring'
+
+    Args:
+        session: Session de capture (rafale); le clip est prolongé tant que
+                 des détections arrivent, dans la limite de duree_max_clip
+        camera: caméra à enregistrer (première caméra par défaut)
+        id_evenement: événement déclencheur; le clip est alors inscrit au
+                      journal des captures avant sa création
+
+    Returns:
+        str: Chemin du fichier vidéo (à supprimer après stockage), None en cas d'échec
+    """
+    settings = settings or get_video_settings()
+    camera = camera or cameras[0]
+    output_file = f"{TEMP_VIDEO_DIR}/recording_{event_id}_cam{camera['numero']}_{int(time.time())}.h264"
+    until = (lambda: capture_session_end(session)) if session else None
+
+    # Mode ring: le clip est extrait de l'encodeur continu (repli sur une
+    # capture directe si l'encodeur est arrêté)
+    ring = camera['ring']
+    use_ring = ring is not None and ring.is_running()
+
+    print(f"📹 Démarrage enregistrement vidéo (caméra {camera['numero']})...")
+    print(f"   Fichier: {output_file}")
+    if use_ring:
+        print(f"   Ring buffer ({ring.encoder_name}): "
+              f"{ring.pre_seconds:.0f}s avant + {settings['duration']}s après")
+    else:
+        print(f"   Durée: {settings['duration']}s")
+
+    if id_evenement is not None:
+        start_entry(db_writer, output_file, event_id, id_evenement, camera['numero'],
+                    f"{settings['width']}x{settings['height']}").result()
+
+    recorded = 0.0
+    segment = settings['duration']
+    last_gop = None
+
+    while True:
+        if use_ring:
+            clip = ring.record(
+                output_file, segment,
+                pre_seconds=None if recorded == 0 else 0,
+                until=until,
+                append=recorded > 0,
+                after=last_gop
+            )
+            seconds, last_gop = clip or (None, last_gop)
+        else:
+            seconds = record_segment(output_file, dict(settings, duration=segment),
+                                     append=recorded > 0, camera=camera)
+
+        if seconds is None:
+            break
+        recorded += seconds
+
+        if session is None or close_capture_session(session):
+            break
+
+        # Prolongation bornée par la durée maximale de clip
+        segment = min(
+            max(1, math.ceil(capture_session_end(session) - time.monotonic())),
+            math.floor(session['max_duration'] - recorded)
+        )
+        if segment < 1:
+            with capture_session_lock:
+                session['open'] = False
+            break
+        print(f"   ➕ Clip prolongé de {segment}s (rafale de détections)")
+
+    if recorded == 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        print(f"❌ Échec de l'enregistrement")
         if os.path.exists(output_file):
             os.remove(output_file)
+        if id_evenement is not None:
+            discard_entry(db_writer, output_file)
         return None
 
     print(f"✅ Enregistrement terminé")
 
-    # Lire le fichier
-    with open(output_file, 'rb') as f:
-        video_data = f.read()
+    # Durée réelle du clip (pré-déclenchement et prolongations inclus),
+    # reprise par save_media
+    settings['duration'] = int(round(recorded))
+
+    print(f"💾 Vidéo capturée: {os.path.getsize(output_file)} bytes ({recorded:.1f}s)")
+
+    return output_file
+
+
+def package_clip(video_file, settings):
+    """
+    Remultiplexe un clip brut en MP4 fast start, sans ré-encodage
+    (transmux.py); la durée lue dans le MP4 remplace settings['duration']
+
+    Returns:
+        tuple: (fichier à stocker, conteneur, codecs), le flux brut tel quel
+               (conteneur None) si le remultiplexage échoue
+    """
+    mp4_file = f"{os.path.splitext(video_file)[0]}.mp4"
+    try:
+        info = transmux_to_mp4(video_file, mp4_file, settings['fps'])
+    except TransmuxError as e:
+        print(f"⚠️  Remultiplexage MP4 impossible, flux brut conservé: {e}")
+        return video_file, None, None
+
+    if info['duration']:
+        settings['duration'] = max(1, int(round(info['duration'])))
+    print(f"🎞️  MP4 fast start: {info['codecs']}, {info['duration']:.2f}s")
+    return mp4_file, 'mp4', info['codecs']
+
+
+def remove_temp_files(*paths):
+    for path in set(paths):
+        if os.path.exists(path):
+            os.remove(path)
 
-    # Supprimer le fichier temporaire
-    os.remove(output_file)
 
-    print(f"💾 Vidéo capturée: {len(video_data)} bytes")
+# ============================================
+# File de capture
+# ============================================
+
+# Les captures sont exécutées par un pool de workers pour que le callback
+# MQTT (thread de loop_forever) rende la main immédiatement: keepalives,
+# acquittements QoS1 et événements bouton/pression ne sont plus bloqués
+# pendant toute la durée de l'enregistrement.
+capture_queue = queue.Queue()
+capture_workers = []
+
+capture_stats_lock = threading.Lock()
+capture_stats = {
+    'enqueued': 0,          # Jobs ajoutés à la file
+    'completed': 0,         # Captures stockées avec succès
+    'failed': 0,            # Captures en échec
+    'max_queue_depth': 0,   # Profondeur maximale observée
+    'total_wait_s': 0.0,    # Somme des temps d'attente dans la file
+    'max_wait_s': 0.0,      # Temps d'attente maximal
+    'busy_workers': 0,      # Workers en cours de capture
+    'coalesced': 0,         # Détections fusionnées dans un clip en cours
+    'shed': 0,              # Captures délestées (file pleine)
+}
+
+# Prolongation ignorée en dessous de ce reliquat (secondes)
+CLIP_EXTENSION_MIN = 0.1
+
+# Session de capture courante: les détections qui arrivent pendant qu'une
+# capture est en file ou en cours prolongent ce clip au lieu d'en lancer un
+# nouveau (un clip à la fois, enregistré par toutes les caméras)
+capture_session_lock = threading.Lock()
+capture_session = None
+
+
+def get_max_clip_duration():
+    """Durée maximale d'un clip prolongé (configuration duree_max_clip)"""
+    return config_cache.get_int('duree_max_clip', MAX_CLIP_DURATION)
+
+
+def get_capture_queue_max():
+    """Captures en attente au-delà desquelles on déleste (file_capture_max)"""
+    return max(1, config_cache.get_int('file_capture_max', CAPTURE_QUEUE_MAX))
+
+
+def get_shed_policy():
+    """Politique de délestage (politique_delestage), fusion si inconnue"""
+    policy = config_cache.get('politique_delestage', CAPTURE_SHED_POLICY)
+    return policy if policy in SHED_POLICIES else 'fusion'
+
+
+def record_capture_shed(evenement_future, policy, **details):
+    """
+    Inscrit une décision de délestage dans evenement.metadata
+    ($.delestage_capture), une fois l'événement validé
+    """
+    SHED_METRIC.inc(policy=policy)
+    with capture_stats_lock:
+        capture_stats['shed'] += 1
+
+    decision = json.dumps(dict(details, politique=policy, timestamp=time.time()))
+
+    def write(future):
+        if future.exception():
+            return
+        db_writer.submit("""
+            UPDATE evenement
+            SET metadata = json_set(COALESCE(metadata, '{}'), '$.delestage_capture', json(?))
+            WHERE id_evenement = ?
+        """, (decision, future.result()))
+
+    evenement_future.add_done_callback(write)
+
+
+def capture_session_end(session):
+    """Instant (monotonic) jusqu'auquel la session doit enregistrer"""
+    with capture_session_lock:
+        return min(session['extend_until'], session['max_end'])
+
+
+def close_capture_session(session):
+    """
+    Ferme la session si aucune détection ne demande de prolongation
+
+    La vérification et la fermeture sont atomiques: une détection arrivée
+    juste avant est prise en compte, une détection arrivée après ouvre une
+    nouvelle session.
+
+    Returns:
+        bool: True si la session est fermée
+    """
+    with capture_session_lock:
+        end = min(session['extend_until'], session['max_end'])
+        if end - time.monotonic() > CLIP_EXTENSION_MIN:
+            return False
+        session['open'] = False
+        return True
+
+
+def submit_motion_capture(event_id, evenement_future, received=None):
+    """
+    Rattache une détection à la capture en cours ou en crée une nouvelle
+
+    Si la file de capture est pleine (file_capture_max), la détection est
+    délestée selon politique_delestage et la décision inscrite dans
+    evenement.metadata.
+
+    Args:
+        received: réception MQTT (time.monotonic()), pour la latence de la voie capture
+
+    Returns:
+        bool: True si la détection a été rattachée à un clip existant
+    """
+    global capture_session
+
+    now = time.monotonic()
+    duration = get_video_settings()['duration']
+    queue_max = get_capture_queue_max()
+    policy = get_shed_policy()
+    shed = None
+    dropped = None
+
+    with capture_session_lock:
+        session = capture_session
+        depth = capture_queue.qsize()
+        if session and session['open'] and now + duration <= session['max_end']:
+            session['extend_until'] = max(session['extend_until'], now + duration)
+            session['evenement_futures'].append(evenement_future)
+            coalesced = len(session['evenement_futures'])
+        elif depth >= queue_max and policy != 'abandon_ancien':
+            # File pleine: pas de nouveau clip
+            if policy == 'fusion' and session:
+                # Rattachée au dernier clip en file, sans le prolonger
+                session['evenement_futures'].append(evenement_future)
+                shed = ('fusion', {'fusion_avec': session['event_id']})
+            else:
+                shed = (policy if policy == 'photo' else 'abandon_recent', {})
+            coalesced = 0
+        else:
+            if depth >= queue_max:
+                # abandon_ancien: le plus ancien clip en attente laisse sa place
+                dropped = drop_oldest_capture()
+            session = {
+                'event_id': event_id,
+                'open': True,
+                'extend_until': now + duration,
+                # Recalculé au démarrage effectif de l'enregistrement
+                'max_end': now + get_max_clip_duration(),
+                'evenement_futures': [evenement_future],
+            }
+            if capture_session:
+                # Clip précédent plein: il n'accepte plus de détections
+                capture_session['open'] = False
+            capture_session = session
+            coalesced = 0
+
+    if shed:
+        policy, details = shed
+        record_capture_shed(evenement_future, policy, profondeur_file=depth, **details)
+        print(f"🪫 File de capture pleine ({depth}/{queue_max}), délestage: {policy}")
+        if policy == 'photo':
+            snapshot_lane.submit(take_snapshot, event_id, evenement_future, received=received)
+        return policy == 'fusion'
+
+    if dropped:
+        session_dropped = dropped['session']
+        futures = session_dropped['evenement_futures'] if session_dropped else [dropped['evenement_future']]
+        for future in futures:
+            record_capture_shed(future, 'abandon_ancien', profondeur_file=depth, remplace_par=event_id)
+        print(f"🪫 File de capture pleine ({depth}/{queue_max}), "
+              f"capture {dropped['event_id']} abandonnée au profit de {event_id}")
+
+    if coalesced:
+        with capture_stats_lock:
+            capture_stats['coalesced'] += 1
+        print(f"🔗 Détection fusionnée avec la capture en cours ({coalesced} événements)")
+        return True
+
+    enqueue_capture(event_id, evenement_future, session, received)
+    return False
+
+
+def drop_oldest_capture():
+    """
+    Retire de la file le plus ancien job pas encore démarré
+
+    Returns:
+        dict | None: job retiré (sa session est fermée)
+    """
+    try:
+        job = capture_queue.get_nowait()
+    except queue.Empty:
+        return None
+
+    capture_queue.task_done()
+    if job is None:
+        # Signal d'arrêt: remis en file
+        capture_queue.put(None)
+        return None
+
+    if job['session']:
+        job['session']['open'] = False
+    return job
+
+
+def take_snapshot(event_id, evenement_future):
+    """
+    Photo de délestage (caméra 1): dernière image IDR du ring buffer si
+    l'encodeur continu tourne, sinon photo par le backend de capture
+
+    Returns:
+        int | None: id_media de la photo
+    """
+    id_evenement = evenement_future.result()
+    camera = cameras[0]
+    settings = dict(get_video_settings(), duration=None)
+    output_file = f"{TEMP_VIDEO_DIR}/snapshot_{event_id}_{int(time.time())}"
+    ring = camera['ring']
+
+    if ring is not None and ring.is_running() and ring.snapshot(output_file):
+        codec = 'h264'
+    else:
+        backend = camera['backends'].snapshot(output_file, settings)
+        if backend is None:
+            print(f"❌ Photo de délestage impossible ({event_id})")
+            return None
+        codec = backend.snapshot_codec
+
+    try:
+        id_capteur = get_camera_capteur_id(camera['numero'])
+        if not id_capteur or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            print(f"❌ Photo de délestage invalide ({event_id})")
+            return None
+
+        id_media = save_media(
+            video_file=output_file,
+            id_evenement=id_evenement,
+            id_capteur=id_capteur,
+            numero_camera=camera['numero'],
+            settings=settings,
+            type_media='photo',
+            codec=codec
+        )
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    print(f"📸 Photo de délestage enregistrée (ID: {id_media})")
+    return id_media
+
+
+def enqueue_capture(event_id, evenement_future, session=None, received=None):
+    """
+    Ajoute une capture vidéo à la file des workers
+
+    Args:
+        event_id: ID MQTT de l'événement
+        evenement_future: Future de l'insertion de l'événement (id_evenement)
+        session: Session de capture pouvant être prolongée par d'autres détections
+        received: réception MQTT (time.monotonic()), défaut: maintenant
+    """
+    now = time.monotonic()
+    job = {
+        'event_id': event_id,
+        'evenement_future': evenement_future,
+        'session': session,
+        'enqueued_at': now,
+        'received': received if received is not None else now,
+    }
+    capture_queue.put(job)
+
+    depth = capture_queue.qsize()
+    with capture_stats_lock:
+        capture_stats['enqueued'] += 1
+        capture_stats['max_queue_depth'] = max(capture_stats['max_queue_depth'], depth)
+
+    print(f"📥 Capture en file (profondeur: {depth})")
+
+
+def get_capture_stats():
+    """
+    Retourne un instantané des compteurs de la file de capture
+
+    Returns:
+        dict: compteurs + profondeur courante et attente moyenne
+    """
+    with capture_stats_lock:
+        stats = dict(capture_stats)
+
+    started = stats['completed'] + stats['failed']
+    stats['queue_depth'] = capture_queue.qsize()
+    stats['avg_wait_s'] = stats['total_wait_s'] / started if started else 0.0
+    stats['workers'] = len(capture_workers)
+    return stats
+
+
+def resolve_evenements(futures):
+    """id_evenement des insertions réussies (les doublons sont ignorés)"""
+    ids = []
+    for future in futures:
+        try:
+            ids.append(future.result())
+        except Exception:
+            pass
+    return ids
+
+
+def record_cameras(event_id, settings, session=None, id_evenement=None):
+    """
+    Enregistre toutes les caméras en parallèle, chacune avec son propre
+    processus de capture: la durée totale reste celle d'une seule caméra
+
+    Returns:
+        list: (caméra, fichier vidéo, paramètres) des captures réussies
+    """
+    results = [None] * len(cameras)
+
+    def run(index, camera):
+        # Copie par caméra: record_video y inscrit la durée réelle du clip
+        camera_settings = dict(settings)
+        try:
+            video_file = record_video(event_id, camera_settings, session, camera, id_evenement)
+        except Exception as e:
+            print(f"❌ Caméra {camera['numero']}: {e}")
+            video_file = None
+        results[index] = (camera, video_file, camera_settings)
+
+    threads = [
+        threading.Thread(target=run, args=(index, camera), name=f"camera-{camera['numero']}", daemon=True)
+        for index, camera in enumerate(cameras) if index > 0
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        run(0, cameras[0])
+    finally:
+        for thread in threads:
+            thread.join()
+
+    return [result for result in results if result and result[1]]
+
+
+def process_capture(job):
+    """Enregistre la vidéo de chaque caméra pour un job et la stocke en base"""
+    event_id = job['event_id']
+    session = job['session']
+
+    # L'événement doit être validé en base avant de lui rattacher un média
+    try:
+        id_evenement = job['evenement_future'].result()
+    except Exception as e:
+        print(f"❌ Événement {event_id} non enregistré, capture annulée: {e}")
+        if session:
+            with capture_session_lock:
+                session['open'] = False
+        return False
+
+    # Paramètres figés pour toute la capture (appliqués à chaud entre deux captures)
+    settings = get_video_settings()
+
+    if session:
+        with capture_session_lock:
+            session['max_duration'] = get_max_clip_duration()
+            session['max_end'] = time.monotonic() + session['max_duration']
+
+    try:
+        captures = record_cameras(event_id, settings, session, id_evenement)
+    finally:
+        if session:
+            with capture_session_lock:
+                session['open'] = False
+
+    if not captures:
+        print(f"❌ Échec capture vidéo")
+        return False
+
+    # Événements de la rafale fusionnés dans ces clips
+    linked = resolve_evenements(session['evenement_futures']) if session else []
+    stored = 0
+
+    # MP4 fast start, durée mesurée dans le conteneur; le flux brut reste
+    # la référence du journal jusqu'au stockage
+    packaged = []
+    for camera, video_file, camera_settings in captures:
+        packaged.append(package_clip(video_file, camera_settings))
+        complete_entry(db_writer, video_file, camera_settings['duration'], linked)
+
+    for (camera, video_file, camera_settings), (clip, conteneur, codecs) in zip(captures, packaged):
+        id_capteur = get_camera_capteur_id(camera['numero'])
+        if not id_capteur:
+            print(f"⚠️  Capteur 'camera' n°{camera['numero']} non trouvé dans la base")
+            discard_entry(db_writer, video_file)
+            remove_temp_files(video_file, clip)
+            continue
+
+        size = os.path.getsize(clip)
+        try:
+            id_media = save_media(
+                video_file=clip,
+                id_evenement=id_evenement,
+                id_capteur=id_capteur,
+                numero_camera=camera['numero'],
+                settings=camera_settings,
+                linked_evenements=linked,
+                conteneur=conteneur,
+                codecs=codecs,
+                journal_file=video_file
+            )
+        except Exception as e:
+            # Flux brut conservé: le journal le fera ré-ingérer au démarrage
+            print(f"❌ Vidéo caméra {camera['numero']} non stockée, reprise au démarrage: {e}")
+            if clip != video_file:
+                remove_temp_files(clip)
+            continue
+
+        remove_temp_files(video_file, clip)
+        stored += 1
+
+        print(f"✅ Vidéo caméra {camera['numero']} enregistrée (ID: {id_media})")
+        print(f"   Taille: {size / 1024:.2f} KB")
+
+    if len(linked) > 1:
+        print(f"   Événements couverts: {len(linked)}")
+    return stored > 0
+
+
+def capture_worker():
+    """Boucle d'un worker: dépile les jobs de capture jusqu'au signal d'arrêt"""
+    while True:
+        job = capture_queue.get()
+
+        if job is None:
+            capture_queue.task_done()
+            break
+
+        wait_s = time.monotonic() - job['enqueued_at']
+        capture_lane.observe(job['received'])
+        with capture_stats_lock:
+            capture_stats['total_wait_s'] += wait_s
+            capture_stats['max_wait_s'] = max(capture_stats['max_wait_s'], wait_s)
+            capture_stats['busy_workers'] += 1
+
+        print(f"\n🎬 Capture {job['event_id']} (attente en file: {wait_s:.2f}s)")
+
+        ok = False
+        try:
+            ok = process_capture(job)
+        except Exception as e:
+            print(f"❌ Erreur capture: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            with capture_stats_lock:
+                capture_stats['busy_workers'] -= 1
+                capture_stats['completed' if ok else 'failed'] += 1
+            capture_queue.task_done()
+
+        # Après le finally pour compter ce job; une erreur de journalisation
+        # ne doit pas arrêter le worker
+        try:
+            stats = get_capture_stats()
+            print(f"📊 File de capture: profondeur={stats['queue_depth']} "
+                  f"(max {stats['max_queue_depth']}), "
+                  f"attente moy={stats['avg_wait_s']:.2f}s (max {stats['max_wait_s']:.2f}s), "
+                  f"ok={stats['completed']}, échecs={stats['failed']}, "
+                  f"fusionnées={stats['coalesced']}")
+            print_backend_stats()
+        except Exception as e:
+            print(f"⚠️  Statistiques de capture indisponibles: {e}")
+
+
+def format_duration(seconds):
+    """Durée moyenne d'un backend (None tant qu'aucune capture n'a réussi)"""
+    return 'n/a' if seconds is None else f"{seconds:.1f}s"
+
+
+def print_backend_stats():
+    """Journalise, par caméra, le backend actif et la durée moyenne de capture"""
+    for camera in cameras:
+        stats = camera['backends'].get_stats()
+        durations = ", ".join(
+            f"{name}={format_duration(backend['avg_s'])} "
+            f"({backend['captures']} ok/{backend['failures']} échecs)"
+            for name, backend in stats['backends'].items()
+            if backend['captures'] or backend['failures']
+        )
+        print(f"🎥 Caméra {camera['numero']} - backend actif: {stats['active']} | "
+              f"{durations or 'aucune capture'}")
+
+
+def start_capture_workers(count=CAPTURE_WORKERS):
+    """Démarre le pool de workers de capture"""
+    for i in range(max(1, count)):
+        worker = threading.Thread(target=capture_worker, name=f"capture-{i + 1}", daemon=True)
+        worker.start()
+        capture_workers.append(worker)
+
+    print(f"🎬 {len(capture_workers)} worker(s) de capture démarré(s)")
 
-    return video_data
+
+def stop_capture_workers(timeout=None):
+    """Arrête les workers après la fin des captures déjà en file"""
+    for _ in capture_workers:
+        capture_queue.put(None)
+
+    for worker in capture_workers:
+        worker.join(timeout)
+
+    capture_workers.clear()
+
+
+def start_metrics():
+    """Jauges lues à chaque scrape puis serveur /metrics (METRICS_PORT)"""
+    REGISTRY.gauge('capture_queue_depth', "Captures en file").set_function(capture_queue.qsize)
+    REGISTRY.gauge('capture_workers', "Workers de capture démarrés").set_function(lambda: len(capture_workers))
+    REGISTRY.gauge('db_writer_pending', "Écritures en attente de l'écrivain").set_function(
+        lambda: db_writer.get_stats()['pending']
+    )
+    start_metrics_server()
+
+
+# ============================================
+# Voies de traitement
+# ============================================
+
+# Boutons (signal de contrôle, ex: 'Bouton Arrêt'): file et workers dédiés,
+# COMMIT sans attendre le délai de regroupement
+control_lane = Lane('control', LANE_CONTROL_WORKERS, LANE_CONTROL_SLO_MS)
+# Persistance des événements mouvement / pression
+sensor_lane = Lane('sensor', LANE_SENSOR_WORKERS, LANE_SENSOR_SLO_MS)
+# Capture vidéo: exécutée par le pool de capture, mesurée jusqu'au début
+# de l'enregistrement
+capture_lane = Lane('capture', 0, LANE_CAPTURE_SLO_MS)
+# Photos de délestage (file de capture pleine, politique_delestage = photo)
+snapshot_lane = Lane('snapshot', 1, LANE_CAPTURE_SLO_MS)
+
+LANES = (control_lane, sensor_lane, capture_lane, snapshot_lane)
+
+
+def start_lanes():
+    for lane in LANES:
+        lane.start()
+    print("🚦 Voies: " + ", ".join(
+        f"{lane.name} ({lane.workers or 'pool'} workers, SLO {lane.slo_ms:.0f} ms)" for lane in LANES
+    ))
+
+
+def stop_lanes(timeout=None):
+    """Traite les événements déjà en file (avant l'arrêt des captures)"""
+    for lane in LANES:
+        lane.stop(timeout)
+
+
+def get_lane_stats():
+    return {lane.name: lane.get_stats() for lane in LANES}
+
+
+def persist_evenement(event_id, capteur_type, etat, payload, urgent=False, received=None):
+    """
+    Enregistre un événement puis, pour un mouvement, délègue la capture
+
+    Returns:
+        Future | None: insertion de l'événement (résolue après COMMIT)
+    """
+    # Enregistrer l'événement (validé par lot, sans attendre le COMMIT)
+    evenement_future = save_evenement_async(
+        event_id=event_id,
+        capteur_type=capteur_type,
+        etat=etat,
+        metadata=payload,
+        urgent=urgent
+    )
+
+    if not evenement_future:
+        print(f"❌ Impossible d'enregistrer l'événement")
+        return None
+
+    evenement_future.add_done_callback(
+        lambda future, event_id=event_id: report_evenement_saved(event_id, future)
+    )
+
+    # Si c'est un mouvement, déléguer la capture aux workers
+    # (ne jamais bloquer une voie pendant l'enregistrement)
+    if capteur_type == 'motion':
+        submit_motion_capture(event_id, evenement_future, received)
+
+    return evenement_future
 
 
 # ============================================
@@ -361,16 +1474,44 @@ def on_connect(client, userdata, flags, rc):
         client.subscribe(MQTT_TOPIC_MOTION, qos=1)
         client.subscribe(MQTT_TOPIC_BUTTON, qos=1)
         client.subscribe(MQTT_TOPIC_PRESSURE, qos=1)
+        client.subscribe(MQTT_TOPIC_RELOAD, qos=1)
         print(f"📥 Abonné aux topics")
     else:
         print(f"❌ Échec connexion MQTT: {rc}")
 
 
+def report_evenement_saved(event_id, future):
+    """Journalise le résultat de l'insertion groupée d'un événement"""
+    error = future.exception()
+    if error:
+        print(f"❌ Impossible d'enregistrer l'événement {event_id}: {error}")
+    else:
+        print(f"✅ Événement enregistré (ID: {future.result()})")
+
+
 def on_message(client, userdata, message):
-    """Callback MQTT - Traite les événements"""
+    """Callback MQTT - Traite les événements (mesuré par topic)"""
+    received = time.monotonic()
+    MESSAGES_METRIC.inc(topic=message.topic)
+    with ON_MESSAGE_METRIC.time(topic=message.topic):
+        handle_message(message, received)
+
+
+def handle_message(message, received=None):
+    """Parse un message MQTT et le confie à sa voie de traitement"""
+    if message.topic == MQTT_TOPIC_RELOAD:
+        reload_caches()
+        return
+
     try:
         payload = json.loads(message.payload.decode())
 
+        # Redistribution QoS 1 d'un événement déjà reçu: ni écriture ni capture
+        if 'event_id' in payload and event_dedup.is_duplicate(payload['event_id']):
+            DUPLICATES_METRIC.inc(topic=message.topic)
+            print(f"♻️  Doublon ignoré: {payload['event_id']} ({message.topic})")
+            return
+
         event_type = payload.get('type', '')
         event_id = payload.get('event_id', f'event_{int(time.time())}')
         device_id = payload.get('device_id', 'unknown')
@@ -378,6 +1519,7 @@ def on_message(client, userdata, message):
         print(f"\n🚨 Événement reçu: {event_type}")
         print(f"   Event ID: {event_id}")
         print(f"   Topic: {message.topic}")
+        print(f"   Mode: {get_config('mode_systeme', 'inconnu')}")
 
         # Déterminer le type de capteur et l'état
         capteur_type = None
@@ -394,38 +1536,12 @@ def on_message(client, userdata, message):
             print(f"⚠️  Type d'événement non reconnu: {event_type}")
             return
 
-        # Enregistrer l'événement
-        id_evenement = save_evenement(
-            event_id=event_id,
-            capteur_type=capteur_type,
-            etat=etat,
-            metadata=payload
-        )
-
-        if not id_evenement:
-            print(f"❌ Impossible d'enregistrer l'événement")
-            return
-
-        print(f"✅ Événement enregistré (ID: {id_evenement})")
-
-        # Si c'est un mouvement, capturer la vidéo
-        if capteur_type == 'motion':
-            video_data = record_video(event_id)
-
-            if video_data:
-                id_capteur = get_capteur_id_by_type('camera')
-                if id_capteur:
-                    id_media = save_media(
-                        video_data=video_data,
-                        id_evenement=id_evenement,
-                        id_capteur=id_capteur,
-                        numero_camera=1
-                    )
-
-                    print(f"✅ Vidéo enregistrée (ID: {id_media})")
-                    print(f"   Taille: {len(video_data) / 1024:.2f} KB")
-            else:
-                print(f"❌ Échec capture vidéo")
+        # Les boutons ne partagent ni file ni workers avec les capteurs,
+        # et leur COMMIT n'attend pas le délai de regroupement
+        urgent = capteur_type == 'button'
+        lane = control_lane if urgent else sensor_lane
+        lane.submit(persist_evenement, event_id, capteur_type, etat, payload, urgent, received,
+                    received=received)
 
     except json.JSONDecodeError:
         print(f"⚠️  Message MQTT non-JSON: {message.payload}")
@@ -444,6 +1560,21 @@ def main():
 
     # Initialiser la base de données
     init_database()
+    seed_event_dedup()
+
+    # Démarrer l'écrivain SQLite, les caches puis les workers de capture
+    start_db_writer()
+    start_caches()
+    start_retention()
+    recover_captures()
+    start_thumbnails()
+
+    # Sonder les backends de capture une seule fois
+    probe_cameras()
+    start_ring_recorder()
+    start_capture_workers()
+    start_lanes()
+    start_metrics()
 
     # Créer le client MQTT
     client = mqtt.Client(client_id=f"surveillance-{DEVICE_ID}")
@@ -478,6 +1609,13 @@ def main():
     except KeyboardInterrupt:
         print("\n⛔ Arrêt du service...")
         client.disconnect()
+        stop_lanes()
+        stop_capture_workers(timeout=get_video_settings()['duration'] + 5)
+        stop_ring_recorder()
+        stop_retention()
+        stop_thumbnails()
+        stop_db_writer()
+        stop_caches()
     except Exception as e:
         print(f"❌ Erreur: {e}")
         return 1
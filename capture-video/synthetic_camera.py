@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Caméra synthétique: flux H.264 Annex B valides, sans matériel
+
+- Mire générée: IDR en macroblocs Intra 16x16 (DC, sans résidu) avec un
+  carré I_PCM qui se déplace d'un GOP à l'autre, puis images P entièrement
+  en P_Skip (profil Baseline, CAVLC)
+- Débit réglable: chaque image est complétée par une NAL de bourrage
+  (filler data, type 12) jusqu'à bitrate / fps octets
+- Ou relecture en boucle de fichiers .h264 existants (SYNTHETIC_SOURCE_DIR)
+
+Utilisé par SyntheticBackend (capture_backends.py) pour la capture directe
+et, en mode ring, comme encodeur continu:
+
+    python3 synthetic_camera.py stream --width 1280 --height 720 --fps 30
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from ring_capture import NAL_IDR, NAL_SLICE, NalSplitter, is_first_slice, nal_type
+
+SYNTHETIC_BITRATE_KBPS = int(os.getenv("SYNTHETIC_BITRATE_KBPS", 2000))
+SYNTHETIC_SOURCE_DIR = os.getenv("SYNTHETIC_SOURCE_DIR", "")
+
+START_CODE = b'\x00\x00\x00\x01'
+
+# Types de NAL units produites
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_FILLER = 12
+
+# mb_type (slice I)
+MB_I16X16_DC = 3      # I_16x16_2_0_0: prédiction DC, aucun coefficient
+MB_I_PCM = 25
+
+LOG2_MAX_FRAME_NUM = 8
+SQUARE_MBS = 2        # Côté du carré de la mire, en macroblocs
+
+
+# ============================================
+# Écriture de bits
+# ============================================
+
+class BitWriter:
+    """Écriture MSB en premier, codes Exp-Golomb (ue/se)"""
+
+    def __init__(self):
+        self._bytes = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def u(self, bits, value):
+        for shift in range(bits - 1, -1, -1):
+            self._acc = (self._acc << 1) | ((value >> shift) & 1)
+            self._bits += 1
+            if self._bits == 8:
+                self._bytes.append(self._acc)
+                self._acc = 0
+                self._bits = 0
+
+    def ue(self, value):
+        value += 1
+        length = value.bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def align_zero(self):
+        while self._bits:
+            self.u(1, 0)
+
+    def raw(self, data):
+        """Octets bruts (flux aligné)"""
+        self._bytes += data
+
+    def trailing(self):
+        """rbsp_trailing_bits"""
+        self.u(1, 1)
+        self.align_zero()
+        return bytes(self._bytes)
+
+
+def nal_unit(ref_idc, kind, rbsp):
+    """NAL Annex B avec octets anti-émulation"""
+    escaped = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros >= 2 and byte <= 3:
+            escaped.append(3)
+            zeros = 0
+        escaped.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return START_CODE + bytes([(ref_idc << 5) | kind]) + bytes(escaped)
+
+
+# ============================================
+# Mire H.264
+# ============================================
+
+class TestPatternEncoder:
+    """
+    Génère des unités d'accès H.264 (une image par appel à next_frame())
+
+    Un GOP dure `gop` images (une seconde par défaut): IDR puis images P.
+    """
+
+    def __init__(self, width, height, fps, bitrate_kbps=SYNTHETIC_BITRATE_KBPS, gop=None):
+        self.width = width - width % 2
+        self.height = height - height % 2
+        self.fps = max(1, int(fps))
+        self.gop = gop or self.fps
+        self.frame_bytes = int(bitrate_kbps * 1000 / 8 / self.fps) if bitrate_kbps else 0
+
+        self.mb_width = (self.width + 15) // 16
+        self.mb_height = (self.height + 15) // 16
+
+        self._index = 0
+        self._idr_count = 0
+        self._params = self._sps() + self._pps()
+
+    # --------------------------------------------
+    # Jeux de paramètres
+    # --------------------------------------------
+
+    def _sps(self):
+        w = BitWriter()
+        w.u(8, 66)                      # profile_idc: Baseline
+        w.u(8, 0xC0)                    # constraint_set0/1: Constrained Baseline
+        w.u(8, 40)                      # level_idc 4.0
+        w.ue(0)                         # seq_parameter_set_id
+        w.ue(LOG2_MAX_FRAME_NUM - 4)
+        w.ue(2)                         # pic_order_cnt_type: ordre de décodage
+        w.ue(1)                         # max_num_ref_frames
+        w.u(1, 0)                       # gaps_in_frame_num_value_allowed_flag
+        w.ue(self.mb_width - 1)
+        w.ue(self.mb_height - 1)
+        w.u(1, 1)                       # frame_mbs_only_flag
+        w.u(1, 1)                       # direct_8x8_inference_flag
+
+        crop_right = (self.mb_width * 16 - self.width) // 2
+        crop_bottom = (self.mb_height * 16 - self.height) // 2
+        w.u(1, 1 if crop_right or crop_bottom else 0)
+        if crop_right or crop_bottom:
+            w.ue(0)
+            w.ue(crop_right)
+            w.ue(0)
+            w.ue(crop_bottom)
+
+        # VUI: cadence seulement
+        w.u(1, 1)                       # vui_parameters_present_flag
+        w.u(1, 0)                       # aspect_ratio_info_present_flag
+        w.u(1, 0)                       # overscan_info_present_flag
+        w.u(1, 0)                       # video_signal_type_present_flag
+        w.u(1, 0)                       # chroma_loc_info_present_flag
+        w.u(1, 1)                       # timing_info_present_flag
+        w.u(32, 1)                      # num_units_in_tick
+        w.u(32, 2 * self.fps)           # time_scale
+        w.u(1, 1)                       # fixed_frame_rate_flag
+        w.u(1, 0)                       # nal_hrd_parameters_present_flag
+        w.u(1, 0)                       # vcl_hrd_parameters_present_flag
+        w.u(1, 0)                       # pic_struct_present_flag
+        w.u(1, 0)                       # bitstream_restriction_flag
+        return nal_unit(3, NAL_SPS, w.trailing())
+
+    def _pps(self):
+        w = BitWriter()
+        w.ue(0)                         # pic_parameter_set_id
+        w.ue(0)                         # seq_parameter_set_id
+        w.u(1, 0)                       # entropy_coding_mode_flag: CAVLC
+        w.u(1, 0)                       # bottom_field_pic_order_in_frame_present_flag
+        w.ue(0)                         # num_slice_groups_minus1
+        w.ue(0)                         # num_ref_idx_l0_default_active_minus1
+        w.ue(0)                         # num_ref_idx_l1_default_active_minus1
+        w.u(1, 0)                       # weighted_pred_flag
+        w.u(2, 0)                       # weighted_bipred_idc
+        w.se(0)                         # pic_init_qp_minus26
+        w.se(0)                         # pic_init_qs_minus26
+        w.se(0)                         # chroma_qp_index_offset
+        w.u(1, 1)                       # deblocking_filter_control_present_flag
+        w.u(1, 0)                       # constrained_intra_pred_flag
+        w.u(1, 0)                       # redundant_pic_cnt_present_flag
+        return nal_unit(3, NAL_PPS, w.trailing())
+
+    # --------------------------------------------
+    # Images
+    # --------------------------------------------
+
+    def _square_origin(self):
+        """Position (en macroblocs) du carré pour le GOP courant"""
+        span_x = max(1, self.mb_width - SQUARE_MBS + 1)
+        span_y = max(1, self.mb_height - SQUARE_MBS + 1)
+        step = self._idr_count
+        return step % span_x, (step // span_x) % span_y
+
+    def _idr(self):
+        w = BitWriter()
+        w.ue(0)                         # first_mb_in_slice
+        w.ue(7)                         # slice_type: I
+        w.ue(0)                         # pic_parameter_set_id
+        w.u(LOG2_MAX_FRAME_NUM, 0)      # frame_num
+        w.ue(self._idr_count % 2)       # idr_pic_id (différent entre IDR consécutives)
+        w.u(1, 0)                       # no_output_of_prior_pics_flag
+        w.u(1, 0)                       # long_term_reference_flag
+        w.se(0)                         # slice_qp_delta
+        w.ue(1)                         # disable_deblocking_filter_idc
+
+        x0, y0 = self._square_origin()
+        shade = 16 + (self._idr_count * 37) % 220
+
+        def is_pcm(x, y):
+            return x0 <= x < x0 + SQUARE_MBS and y0 <= y < y0 + SQUARE_MBS
+
+        for y in range(self.mb_height):
+            for x in range(self.mb_width):
+                if is_pcm(x, y):
+                    w.ue(MB_I_PCM)
+                    w.align_zero()
+                    w.raw(bytes([235]) * 256)   # luma
+                    w.raw(bytes([shade]) * 128)  # Cb + Cr
+                    continue
+
+                w.ue(MB_I16X16_DC)
+                w.ue(0)                 # intra_chroma_pred_mode: DC
+                w.se(0)                 # mb_qp_delta
+
+                # coeff_token (TotalCoeff 0) de Intra16x16DCLevel: la table
+                # dépend de nC, qui vaut 16 pour un voisin I_PCM et 0 sinon
+                left = is_pcm(x - 1, y) * 16 if x > 0 else None
+                top = is_pcm(x, y - 1) * 16 if y > 0 else None
+                if left is not None and top is not None:
+                    nc = (left + top + 1) >> 1
+                else:
+                    nc = left if left is not None else (top or 0)
+                if nc >= 8:
+                    w.u(6, 0b000011)
+                else:
+                    w.u(1, 1)
+
+        self._idr_count += 1
+        return nal_unit(3, NAL_IDR, w.trailing())
+
+    def _p_skip(self, frame_num):
+        w = BitWriter()
+        w.ue(0)                         # first_mb_in_slice
+        w.ue(5)                         # slice_type: P
+        w.ue(0)                         # pic_parameter_set_id
+        w.u(LOG2_MAX_FRAME_NUM, frame_num % (1 << LOG2_MAX_FRAME_NUM))
+        w.u(1, 0)                       # num_ref_idx_active_override_flag
+        w.u(1, 0)                       # ref_pic_list_modification_flag_l0
+        w.u(1, 0)                       # adaptive_ref_pic_marking_mode_flag
+        w.se(0)                         # slice_qp_delta
+        w.ue(1)                         # disable_deblocking_filter_idc
+        w.ue(self.mb_width * self.mb_height)  # mb_skip_run: toute l'image
+        return nal_unit(2, NAL_SLICE, w.trailing())
+
+    def _filler(self, size):
+        # En-tête (1) + start code (4) + bits de fin (1)
+        payload = max(0, size - len(START_CODE) - 2)
+        return nal_unit(0, NAL_FILLER, b'\xff' * payload + b'\x80')
+
+    def next_frame(self):
+        """
+        Returns:
+            bytes: unité d'accès suivante (SPS/PPS répétés à chaque IDR)
+        """
+        position = self._index % self.gop
+        if position == 0:
+            frame = self._params + self._idr()
+        else:
+            frame = self._p_skip(position)
+        self._index += 1
+
+        missing = self.frame_bytes - len(frame)
+        if missing > len(START_CODE) + 2:
+            frame += self._filler(missing)
+        return frame
+
+
+# ============================================
+# Relecture de fichiers
+# ============================================
+
+def split_access_units(data):
+    """Découpe un flux Annex B en images (NAL non-VCL rattachées à l'image suivante)"""
+    # Start code final: termine la dernière NAL du fichier
+    nals = NalSplitter().feed(data + b'\x00\x00\x01')
+
+    frames = []
+    current = []
+    prefix = []
+    for nal in nals:
+        if nal_type(nal) not in (NAL_SLICE, NAL_IDR):
+            prefix.append(nal)
+            continue
+        if is_first_slice(nal) and current:
+            frames.append(b''.join(current))
+            current = []
+        current.extend(prefix)
+        current.append(nal)
+        prefix = []
+
+    if current:
+        frames.append(b''.join(current + prefix))
+    return frames
+
+
+class CannedSource:
+    """Images des fichiers .h264 d'un dossier, relues en boucle"""
+
+    def __init__(self, source_dir=SYNTHETIC_SOURCE_DIR):
+        self.files = sorted(
+            os.path.join(source_dir, name)
+            for name in os.listdir(source_dir)
+            if name.endswith('.h264')
+        )
+        if not self.files:
+            raise FileNotFoundError(f"aucun fichier .h264 dans {source_dir}")
+
+        self._file_index = 0
+        self._frames = []
+        self._frame_index = 0
+
+    def next_frame(self):
+        if self._frame_index >= len(self._frames):
+            path = self.files[self._file_index % len(self.files)]
+            self._file_index += 1
+            with open(path, 'rb') as f:
+                self._frames = split_access_units(f.read())
+            self._frame_index = 0
+            if not self._frames:
+                raise ValueError(f"{path}: aucune image H.264")
+
+        frame = self._frames[self._frame_index]
+        self._frame_index += 1
+        return frame
+
+
+def make_source(width, height, fps, bitrate_kbps=SYNTHETIC_BITRATE_KBPS, source_dir=SYNTHETIC_SOURCE_DIR):
+    """Fichiers de SYNTHETIC_SOURCE_DIR si défini, sinon mire générée"""
+    if source_dir:
+        return CannedSource(source_dir)
+    return TestPatternEncoder(width, height, fps, bitrate_kbps)
+
+
+def write_frames(output, source, frames, fps, time_scale=1.0):
+    """
+    Écrit `frames` images dans `output`, cadencées à fps * time_scale
+    (time_scale = 0: aussi vite que possible)
+
+    Returns:
+        int: octets écrits
+    """
+    written = 0
+    started = time.monotonic()
+
+    for index in range(frames):
+        if time_scale > 0:
+            delay = started + index * time_scale / fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame = source.next_frame()
+        output.write(frame)
+        written += len(frame)
+
+    return written
+
+
+# ============================================
+# Ligne de commande (encodeur continu du mode ring)
+# ============================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caméra H.264 synthétique")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('stream', "Flux continu sur stdout"), ('record', "Clip dans un fichier")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument('--width', type=int, default=1280)
+        command.add_argument('--height', type=int, default=720)
+        command.add_argument('--fps', type=int, default=30)
+        command.add_argument('--bitrate-kbps', type=int, default=SYNTHETIC_BITRATE_KBPS)
+        command.add_argument('--source-dir', default=SYNTHETIC_SOURCE_DIR)
+        command.add_argument('--failure-rate', type=float, default=0.0,
+                             help="Probabilité d'arrêt en erreur par seconde de flux")
+
+    sub.choices['record'].add_argument('--duration', type=float, default=10)
+    sub.choices['record'].add_argument('-o', '--output', required=True)
+
+    args = parser.parse_args(argv)
+    source = make_source(args.width, args.height, args.fps, args.bitrate_kbps, args.source_dir)
+
+    if args.command == 'record':
+        with open(args.output, 'wb') as f:
+            write_frames(f, source, int(args.duration * args.fps), args.fps)
+        return 0
+
+    output = sys.stdout.buffer
+    try:
+        while True:
+            if args.failure_rate and random.random() < args.failure_rate:
+                print("synthetic_camera: panne simulée", file=sys.stderr)
+                return 1
+            write_frames(output, source, args.fps, args.fps)
+            output.flush()
+    except (BrokenPipeError, KeyboardInterrupt):
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
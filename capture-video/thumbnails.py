@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Miniatures des médias (aperçu + bande d'images clés)
+
+- Étape après capture: un thread extrait avec ffmpeg, depuis le média
+  stocké (fichier de MEDIA_DIR ou BLOB lu par blocs), seules les images
+  clés sont décodées (-skip_frame nokey)
+  - aperçu: image clé du milieu du clip, THUMB_WIDTH px de large
+  - bande: THUMB_STRIP_FRAMES images clés réparties sur le clip, côte à
+    côte dans un seul JPEG de THUMB_STRIP_WIDTH px par image
+- Rangées dans la table miniature (quelques Ko par média), via l'écrivain
+  partagé; un échec d'extraction est inscrit aussi (apercu NULL) pour ne
+  pas être retenté à chaque passe
+- Les médias sans miniature (bases existantes, arrêt du service) sont
+  rattrapés par le même thread, les plus récents d'abord
+- Partitions mensuelles: la miniature est rangée dans la base du média,
+  et disparaît avec elle
+- Servies par GET /api/recordings/<id>/thumbnail (?strip=1 pour la bande)
+
+Rattrapage manuel (service arrêté ou non):
+
+    python3 thumbnails.py run
+"""
+
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from media_partitions import MediaPartitions, make_media_id, split_media_id
+from media_store import MEDIA_DIR, iter_blob_chunks, media_file_path, payload_table
+from metrics import REGISTRY
+
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", 320))
+THUMB_STRIP_FRAMES = int(os.getenv("THUMB_STRIP_FRAMES", 6))
+THUMB_STRIP_WIDTH = int(os.getenv("THUMB_STRIP_WIDTH", 160))
+# Qualité JPEG ffmpeg (-q:v, 2 = meilleure, 31 = pire)
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", 6))
+THUMB_BATCH_SIZE = int(os.getenv("THUMB_BATCH_SIZE", 20))
+THUMB_INTERVAL = int(os.getenv("THUMB_INTERVAL", 300))
+THUMB_TIMEOUT = int(os.getenv("THUMB_TIMEOUT", 30))
+DB_PATH = os.getenv("DB_PATH", "/data/surveillance.db")
+
+# Début de chaque image d'un flux MJPEG (marqueur SOI suivi d'un marqueur)
+JPEG_START = b'\xff\xd8\xff'
+
+THUMBNAIL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS miniature (
+    id_media INTEGER PRIMARY KEY,
+    apercu BLOB,                       -- JPEG (NULL: extraction impossible)
+    bande BLOB,                        -- Images clés côte à côte (JPEG)
+    nb_images INTEGER NOT NULL DEFAULT 0,
+    date_creation TEXT NOT NULL DEFAULT (datetime('now')),
+    FOREIGN KEY (id_media) REFERENCES media(id_media) ON DELETE CASCADE
+);
+
+-- Suppression avec le média (foreign_keys n'est pas activé par les services)
+CREATE TRIGGER IF NOT EXISTS trigger_miniature_delete
+AFTER DELETE ON media
+BEGIN
+    DELETE FROM miniature WHERE id_media = OLD.id_media;
+END;
+"""
+
+THUMBNAILS_METRIC = REGISTRY.counter(
+    'thumbnails_total', "Miniatures générées, par résultat", ('result',)
+)
+THUMBNAIL_SECONDS_METRIC = REGISTRY.histogram(
+    'thumbnail_seconds', "Extraction aperçu + bande d'un média (ffmpeg)"
+)
+
+
+class ThumbnailError(Exception):
+    """Extraction impossible (ffmpeg en échec, aucune image clé)"""
+
+
+def ensure_thumbnail_schema(conn):
+    """Crée miniature (bases créées avant son introduction)"""
+    conn.executescript(THUMBNAIL_SCHEMA)
+
+
+# ============================================
+# Extraction (ffmpeg)
+# ============================================
+
+def _lower_priority():
+    # Les captures passent avant les miniatures
+    os.nice(10)
+
+
+def _feed(stdin, chunks):
+    try:
+        for chunk in chunks:
+            stdin.write(chunk)
+    except (BrokenPipeError, OSError):
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def run_ffmpeg(args, chunks=None, timeout=THUMB_TIMEOUT):
+    """
+    Lance ffmpeg et renvoie sa sortie standard
+
+    Args:
+        chunks: blocs écrits sur l'entrée standard (entrée pipe:0), depuis un
+                thread dédié: la lecture d'un BLOB se fait par blocs
+
+    Returns:
+        bytes
+    """
+    # ffmpeg absent: FileNotFoundError, le média n'est pas marqué en échec
+    proc = subprocess.Popen(
+        ['ffmpeg', '-hide_banner', '-v', 'error', '-threads', '1', *args],
+        stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=_lower_priority
+    )
+
+    killer = threading.Timer(timeout, proc.kill)
+    killer.start()
+    if chunks is not None:
+        threading.Thread(target=_feed, args=(proc.stdin, chunks), daemon=True).start()
+
+    try:
+        output = proc.stdout.read()
+        errors = proc.stderr.read()
+        returncode = proc.wait()
+    finally:
+        killer.cancel()
+
+    if returncode != 0:
+        raise ThumbnailError(f"ffmpeg: {errors.decode('utf-8', 'replace').strip()[-200:] or returncode}")
+    return output
+
+
+def split_jpegs(data):
+    """Découpe un flux MJPEG (image2pipe) en images JPEG"""
+    starts = []
+    index = data.find(JPEG_START)
+    while index != -1:
+        starts.append(index)
+        index = data.find(JPEG_START, index + 1)
+    return [data[start:end] for start, end in zip(starts, starts[1:] + [len(data)])]
+
+
+def pick_evenly(items, count):
+    """`count` éléments répartis du premier au dernier"""
+    if len(items) <= count:
+        return list(items)
+    if count == 1:
+        return [items[len(items) // 2]]
+    return [items[round(i * (len(items) - 1) / (count - 1))] for i in range(count)]
+
+
+def extract_thumbnails(source, codec='h264', conteneur=None, width=THUMB_WIDTH,
+                       strip_frames=THUMB_STRIP_FRAMES, strip_width=THUMB_STRIP_WIDTH):
+    """
+    Aperçu et bande d'images clés d'un média
+
+    Args:
+        source: chemin du fichier, ou itérable de blocs (BLOB)
+        codec: 'h264' ou 'jpeg' (photo de délestage)
+        conteneur: 'mp4', None pour un flux H.264 Annex B brut
+
+    Returns:
+        tuple: (aperçu JPEG, bande JPEG, nombre d'images de la bande)
+    """
+    input_args = ['-f', 'h264'] if codec == 'h264' and not conteneur else []
+    if isinstance(source, str):
+        input_args += ['-i', source]
+        chunks = None
+    else:
+        input_args += ['-i', 'pipe:0']
+        chunks = source
+
+    # Un seul décodage, limité aux images clés, réduites dès la sortie du décodeur
+    keyframes = split_jpegs(run_ffmpeg([
+        '-skip_frame', 'nokey', *input_args,
+        '-vf', f'scale={width}:-2', '-q:v', str(THUMB_QUALITY),
+        '-f', 'image2pipe', '-c:v', 'mjpeg', 'pipe:1'
+    ], chunks))
+    if not keyframes:
+        raise ThumbnailError("aucune image clé")
+
+    poster = keyframes[len(keyframes) // 2]
+    frames = pick_evenly(keyframes, max(1, strip_frames))
+
+    strip = run_ffmpeg([
+        '-f', 'image2pipe', '-c:v', 'mjpeg', '-i', 'pipe:0',
+        '-vf', f'scale={strip_width}:-2,tile={len(frames)}x1', '-frames:v', '1',
+        '-q:v', str(THUMB_QUALITY), '-f', 'mjpeg', 'pipe:1'
+    ], frames)
+    if not strip:
+        raise ThumbnailError("bande vide")
+
+    return poster, strip, len(frames)
+
+
+def blob_chunks(db_path, id_media):
+    """
+    Blocs du BLOB d'un média (connexion ouverte dans le thread qui itère)
+
+    Args:
+        db_path: base du média (surveillance.db ou sa partition)
+        id_media: id local à cette base
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        yield from iter_blob_chunks(conn, payload_table(conn, id_media), 'video', id_media)
+    finally:
+        conn.close()
+
+
+# ============================================
+# Worker
+# ============================================
+
+class ThumbnailWorker:
+    """
+    Thread de génération des miniatures manquantes
+
+    Réveillé par notify() après chaque insertion de média, et toutes les
+    `interval` secondes pour le rattrapage. Écritures via `writer`
+    (EventWriter), une courte transaction par média.
+    """
+
+    def __init__(self, writer, db_path=DB_PATH, media_dir=MEDIA_DIR,
+                 interval=THUMB_INTERVAL, batch_size=THUMB_BATCH_SIZE, partitions=None):
+        self.writer = writer
+        self.db_path = db_path
+        self.media_dir = media_dir
+        self.partitions = partitions or MediaPartitions(db_path)
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'generated': 0,   # Miniatures rangées
+            'failed': 0,      # Extractions impossibles (inscrites sans image)
+            'bytes': 0,       # Taille cumulée aperçus + bandes
+        }
+
+    # --------------------------------------------
+    # Cycle de vie
+    # --------------------------------------------
+
+    def start(self):
+        if self._thread:
+            return
+
+        self._stop.clear()
+        self._wake.set()
+        self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """S'arrête après le média en cours"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """Un média vient d'être inséré"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while not self._stop.is_set() and self.run_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"⚠️  Miniatures en erreur: {e}")
+
+    # --------------------------------------------
+    # Génération
+    # --------------------------------------------
+
+    def get_pending(self):
+        """
+        Médias sans miniature, les plus récents d'abord (partition la plus
+        récente en premier, chacune lue directement)
+
+        Returns:
+            list: (id_media global, codec, conteneur, chemin)
+        """
+        pending = []
+
+        for key in self.partitions.keys():
+            conn = self.partitions.connect(key)
+            if conn is None:
+                continue
+            try:
+                rows = conn.execute("""
+                    SELECT m.id_media, m.codec, m.conteneur, m.chemin
+                    FROM media m
+                    LEFT JOIN miniature t ON t.id_media = m.id_media
+                    WHERE t.id_media IS NULL
+                    ORDER BY m.id_media DESC
+                    LIMIT ?
+                """, (self.batch_size - len(pending),)).fetchall()
+            finally:
+                conn.close()
+
+            pending.extend((make_media_id(key, id_media), *rest) for id_media, *rest in rows)
+            if len(pending) >= self.batch_size:
+                break
+
+        return pending
+
+    def run_once(self):
+        """
+        Traite un lot de médias sans miniature
+
+        Returns:
+            int: médias traités
+        """
+        pending = self.get_pending()
+        for id_media, codec, conteneur, chemin in pending:
+            if self._stop.is_set():
+                break
+            self.generate(id_media, codec, conteneur, chemin)
+        return len(pending)
+
+    def generate(self, id_media, codec='h264', conteneur=None, chemin=None):
+        """
+        Extrait et range la miniature d'un média
+
+        Returns:
+            bool: True si l'aperçu a été extrait
+        """
+        key, local_id = split_media_id(id_media)
+        if chemin:
+            source = media_file_path(chemin, self.media_dir)
+        else:
+            source = blob_chunks(self.partitions.path(key), local_id)
+
+        started = time.perf_counter()
+        try:
+            poster, strip, count = extract_thumbnails(source, codec or 'h264', conteneur)
+        except ThumbnailError as e:
+            print(f"⚠️  Miniature du média {id_media} impossible: {e}")
+            poster, strip, count = None, None, 0
+
+        # Média supprimé pendant l'extraction: rien à ranger
+        schema = self.partitions.schema(key)
+        self.writer.submit(f"""
+            INSERT OR REPLACE INTO {schema}.miniature (id_media, apercu, bande, nb_images)
+            SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM {schema}.media WHERE id_media = ?)
+        """, (local_id, poster, strip, count, local_id), attach=self.partitions.attachments(key)).result()
+
+        ok = poster is not None
+        THUMBNAILS_METRIC.inc(result='ok' if ok else 'failed')
+        if ok:
+            THUMBNAIL_SECONDS_METRIC.observe(time.perf_counter() - started)
+        with self._stats_lock:
+            self._stats['generated' if ok else 'failed'] += 1
+            self._stats['bytes'] += len(poster or b'') + len(strip or b'')
+        return ok
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+def main(argv=None):
+    from db_writer import EventWriter
+
+    parser = argparse.ArgumentParser(description="Miniatures des médias")
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help="Générer toutes les miniatures manquantes")
+
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    ensure_thumbnail_schema(conn)
+    conn.close()
+
+    writer = EventWriter(args.db)
+    writer.start()
+    worker = ThumbnailWorker(writer, args.db)
+    try:
+        while worker.run_once() == worker.batch_size:
+            pass
+    finally:
+        writer.stop()
+
+    stats = worker.get_stats()
+    print(f"✅ {stats['generated']} miniature(s) générée(s), {stats['failed']} échec(s), "
+          f"{stats['bytes'] / 1024:.1f} KB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Remultiplexage des clips H.264 bruts en MP4 « fast start »
+
+- Les backends de capture produisent un flux H.264 Annex B sans conteneur:
+  pas d'horodatage, pas de durée, lecture impossible avant téléchargement
+  complet
+- Avant stockage, le flux est copié tel quel (ffmpeg -c copy, sans
+  ré-encodage) dans un MP4 dont l'atome moov est en tête
+  (-movflags +faststart): le navigateur peut commencer la lecture et
+  naviguer dans le clip dès les premiers Ko (requêtes Range)
+- Durée exacte (mvhd) et chaîne de codec RFC 6381 (avcC, ex: avc1.64001f)
+  relues dans le MP4 produit, enregistrées dans media.duree / media.codecs
+- En cas d'échec (ffmpeg absent, flux illisible), le flux brut est stocké
+  comme avant: aucun clip n'est perdu
+"""
+
+import os
+import struct
+import subprocess
+
+TRANSMUX_TIMEOUT = int(os.getenv("TRANSMUX_TIMEOUT", 60))
+
+# En-tête fixe d'une VisualSampleEntry (avc1) avant ses boîtes filles
+VISUAL_SAMPLE_ENTRY_SIZE = 78
+
+
+class TransmuxError(Exception):
+    """Remultiplexage impossible (ffmpeg en échec ou MP4 illisible)"""
+
+
+# ============================================
+# Lecture des boîtes MP4
+# ============================================
+
+def iter_boxes(f, start, end):
+    """
+    Boîtes ISO BMFF entre start et end
+
+    Yields:
+        tuple: (type, début du contenu, fin de la boîte)
+    """
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield kind.decode('latin-1'), position + header, position + size
+        position += size
+
+
+def find_box(f, start, end, *path):
+    """Première boîte suivant le chemin de types (ex: 'trak', 'mdia')"""
+    for kind, content, box_end in iter_boxes(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return content, box_end
+            found = find_box(f, content, box_end, *path[1:])
+            if found:
+                return found
+    return None
+
+
+def read_mvhd_duration(f, start):
+    """Durée du film (secondes) lue dans mvhd"""
+    f.seek(start)
+    version = f.read(4)[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', f.read(28)[16:])
+    else:
+        timescale, duration = struct.unpack('>II', f.read(16)[8:])
+    return duration / timescale if timescale else None
+
+
+def read_avc_codecs(f, moov_start, moov_end):
+    """Chaîne de codec RFC 6381 de la piste vidéo (avc1.PPCCLL)"""
+    for kind, content, end in iter_boxes(f, moov_start, moov_end):
+        if kind != 'trak':
+            continue
+        stsd = find_box(f, content, end, 'mdia', 'minf', 'stbl', 'stsd')
+        if not stsd:
+            continue
+        # stsd: version/flags + nombre d'entrées, puis les entrées
+        for entry, entry_start, entry_end in iter_boxes(f, stsd[0] + 8, stsd[1]):
+            if entry not in ('avc1', 'avc3'):
+                continue
+            avcc = find_box(f, entry_start + VISUAL_SAMPLE_ENTRY_SIZE, entry_end, 'avcC')
+            if avcc:
+                f.seek(avcc[0])
+                _, profile, compatibility, level = f.read(4)
+                return f"{entry}.{profile:02x}{compatibility:02x}{level:02x}"
+    return None
+
+
+def read_mp4_info(path):
+    """
+    Returns:
+        dict: duration (s), codecs (RFC 6381), faststart (moov avant mdat)
+    """
+    size = os.path.getsize(path)
+    offsets = {}
+
+    with open(path, 'rb') as f:
+        for kind, content, end in iter_boxes(f, 0, size):
+            if kind in ('moov', 'mdat') and kind not in offsets:
+                offsets[kind] = (content, end)
+
+        if 'moov' not in offsets:
+            raise TransmuxError(f"{path}: pas d'atome moov")
+
+        moov_start, moov_end = offsets['moov']
+        mvhd = find_box(f, moov_start, moov_end, 'mvhd')
+        return {
+            'duration': read_mvhd_duration(f, mvhd[0]) if mvhd else None,
+            'codecs': read_avc_codecs(f, moov_start, moov_end),
+            'faststart': 'mdat' not in offsets or moov_start < offsets['mdat'][0],
+        }
+
+
+# ============================================
+# Remultiplexage
+# ============================================
+
+def transmux_to_mp4(input_file, output_file, fps, timeout=TRANSMUX_TIMEOUT):
+    """
+    Copie un flux H.264 brut dans un MP4 fast start (sans ré-encodage)
+
+    Args:
+        fps: cadence de capture (le flux brut n'a pas d'horodatage)
+
+    Returns:
+        dict: read_mp4_info() du fichier produit
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-v', 'error', '-y',
+        '-f', 'h264', '-framerate', str(fps), '-i', input_file,
+        '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', output_file
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        raise TransmuxError(str(e))
+
+    if result.returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise TransmuxError(f"ffmpeg: {result.stderr.strip()[-200:] or result.returncode}")
+
+    return read_mp4_info(output_file)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Enregistreur / rejoueur de trafic MQTT
+
+- record: s'abonne aux topics capteurs (sensor/#, sensors/# par défaut) et
+  écrit chaque message dans un fichier JSON Lines gzip: instant relatif,
+  topic, QoS, retain et payload tel quel (texte, ou base64 si binaire)
+- replay: republie le fichier sur un broker en respectant les intervalles
+  d'arrivée, à vitesse réelle (--speed 1), accélérée (--speed 10) ou au
+  plus vite (--speed 0)
+- info: résumé d'un enregistrement (durée, débit, messages par topic)
+
+Les payloads sont rejoués octet pour octet: surveillance_service,
+capture_service et mqtt-bridge les reçoivent au format de production.
+Un broker local fait office de banc (ex: docker compose up mqtt-broker,
+ou mosquitto -p 1884) pour les tests de capacité.
+
+    python3 tools/mqtt_replay.py record -o incident.jsonl.gz --duration 600
+    python3 tools/mqtt_replay.py replay incident.jsonl.gz --speed 10 --fresh-ids
+    python3 tools/mqtt_replay.py info incident.jsonl.gz
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+DEFAULT_TOPICS = ("sensor/#", "sensors/#")
+FORMAT = "mqtt-replay"
+FORMAT_VERSION = 1
+
+
+# ============================================
+# Format du fichier
+# ============================================
+
+def encode_record(offset, topic, payload, qos=0, retain=False):
+    """Une ligne du fichier: payload texte si UTF-8, sinon base64"""
+    record = {'t': round(offset, 6), 'topic': topic, 'qos': qos}
+    if retain:
+        record['retain'] = True
+    try:
+        record['payload'] = payload.decode('utf-8')
+    except UnicodeDecodeError:
+        record['payload_b64'] = base64.b64encode(payload).decode('ascii')
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_payload(record):
+    if 'payload_b64' in record:
+        return base64.b64decode(record['payload_b64'])
+    return record['payload'].encode('utf-8')
+
+
+def read_recording(path):
+    """
+    Returns:
+        tuple: (en-tête, liste des messages triés par instant)
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != FORMAT:
+            raise ValueError(f"{path}: pas un enregistrement {FORMAT}")
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['t'])
+    return header, records
+
+
+def refresh_ids(payload):
+    """Nouvel event_id et timestamp (les services écartent les event_id déjà reçus)"""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return payload
+    if not isinstance(data, dict):
+        return payload
+    if 'event_id' in data:
+        data['event_id'] = str(uuid.uuid4())
+    if 'timestamp' in data:
+        data['timestamp'] = time.time()
+    return json.dumps(data).encode('utf-8')
+
+
+def parse_topic_map(values):
+    """['sensor/=test/sensor/'] → [('sensor/', 'test/sensor/')] (remplacement de préfixe)"""
+    mapping = []
+    for value in values or ():
+        old, sep, new = value.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"--map attend ancien=nouveau: {value}")
+        mapping.append((old, new))
+    return mapping
+
+
+def map_topic(topic, mapping):
+    for old, new in mapping:
+        if topic.startswith(old):
+            return new + topic[len(old):]
+    return topic
+
+
+# ============================================
+# Client MQTT
+# ============================================
+
+def connect(broker, port, client_id):
+    client = mqtt.Client(client_id=client_id)
+    client.max_inflight_messages_set(1000)
+    connected = threading.Event()
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            connected.set()
+        else:
+            print(f"❌ Échec connexion MQTT: {rc}", file=sys.stderr)
+
+    client.on_connect = on_connect
+    client.connect(broker, port, keepalive=60)
+    client.loop_start()
+    if not connected.wait(10):
+        client.loop_stop()
+        raise ConnectionError(f"broker {broker}:{port} injoignable")
+    return client
+
+
+# ============================================
+# Enregistrement
+# ============================================
+
+class Recorder:
+    """Écrit les messages reçus dans le fichier (appelé depuis la boucle paho)"""
+
+    def __init__(self, output, topics):
+        self.topics = topics
+        self.count = 0
+        self._file = gzip.open(output, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+        self._file.write(json.dumps({
+            'format': FORMAT,
+            'version': FORMAT_VERSION,
+            'recorded_at': time.time(),
+            'topics': list(topics),
+        }) + '\n')
+
+    def on_message(self, client, userdata, message):
+        line = encode_record(
+            time.monotonic() - self._started,
+            message.topic, message.payload, message.qos, message.retain
+        )
+        with self._lock:
+            self._file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def record(args):
+    recorder = Recorder(args.output, args.topic or DEFAULT_TOPICS)
+    client = mqtt.Client(client_id=f"mqtt-recorder-{os.getpid()}")
+    client.on_message = recorder.on_message
+
+    def on_connect(client, userdata, flags, rc):
+        # Réabonnement après chaque reconnexion
+        if rc == 0:
+            client.subscribe([(topic, args.qos) for topic in recorder.topics])
+
+    client.on_connect = on_connect
+    client.connect(args.broker, args.port, keepalive=60)
+    client.loop_start()
+
+    print(f"⏺️  Enregistrement de {', '.join(recorder.topics)} depuis {args.broker}:{args.port} "
+          f"→ {args.output} (Ctrl+C pour arrêter)")
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            if args.count and recorder.count >= args.count:
+                break
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        recorder.close()
+
+    print(f"✅ {recorder.count} messages enregistrés")
+    return 0
+
+
+# ============================================
+# Rejeu
+# ============================================
+
+def replay_records(records, publish, speed=1.0, loops=1, fresh_ids=False, mapping=()):
+    """
+    Rejoue les messages via publish(topic, payload, qos, retain)
+
+    Args:
+        speed: facteur d'accélération (0 = au plus vite)
+        loops: nombre de passes (la suivante commence après la dernière)
+
+    Returns:
+        dict: messages envoyés, durée et retard maximal sur le planning
+    """
+    base = records[0]['t'] if records else 0.0
+    span = records[-1]['t'] - base if records else 0.0
+    started = time.monotonic()
+    max_lag = 0.0
+    sent = 0
+
+    for loop in range(loops):
+        for record in records:
+            if speed > 0:
+                due = started + (loop * span + record['t'] - base) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+
+            payload = decode_payload(record)
+            if fresh_ids:
+                payload = refresh_ids(payload)
+            publish(map_topic(record['topic'], mapping), payload,
+                    record.get('qos', 0), record.get('retain', False))
+            sent += 1
+
+    elapsed = time.monotonic() - started
+    return {
+        'sent': sent,
+        'elapsed_s': round(elapsed, 3),
+        'rate': round(sent / elapsed, 1) if elapsed else None,
+        'max_lag_ms': round(max_lag * 1000, 2),
+    }
+
+
+def replay(args):
+    header, records = read_recording(args.file)
+    if args.topic:
+        records = [r for r in records if any(mqtt.topic_matches_sub(t, r['topic']) for t in args.topic)]
+    if not records:
+        print("⚠️  Aucun message à rejouer")
+        return 1
+
+    mapping = parse_topic_map(args.map)
+    speed = 'max' if args.speed == 0 else f"x{args.speed:g}"
+
+    if args.print:
+        def publish(topic, payload, qos, retain):
+            print(f"{topic} {payload.decode('utf-8', 'replace')}")
+        client = None
+    else:
+        client = connect(args.broker, args.port, f"mqtt-replayer-{os.getpid()}")
+
+        def publish(topic, payload, qos, retain):
+            client.publish(topic, payload, qos=qos if args.qos is None else args.qos, retain=retain)
+
+        print(f"▶️  Rejeu de {len(records)} messages ({speed}, {args.loop} passe(s)) "
+              f"vers {args.broker}:{args.port}")
+
+    try:
+        result = replay_records(records, publish, args.speed, args.loop, args.fresh_ids, mapping)
+    except KeyboardInterrupt:
+        print("\n⛔ Rejeu interrompu")
+        return 1
+    finally:
+        if client:
+            client.loop_stop()
+            client.disconnect()
+
+    if not args.print:
+        print(f"✅ {result['sent']} messages en {result['elapsed_s']}s ({result['rate']} msg/s, "
+              f"retard max {result['max_lag_ms']} ms)")
+    return 0
+
+
+def info(args):
+    header, records = read_recording(args.file)
+    span = records[-1]['t'] - records[0]['t'] if len(records) > 1 else 0.0
+    topics = Counter(record['topic'] for record in records)
+
+    print(f"📼 {args.file}")
+    print(f"   Enregistré le: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['recorded_at']))}")
+    print(f"   Abonnements: {', '.join(header.get('topics', []))}")
+    print(f"   Messages: {len(records)} en {span:.1f}s"
+          + (f" ({len(records) / span:.1f} msg/s)" if span else ""))
+    for topic, count in topics.most_common():
+        print(f"   {count:>8}  {topic}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enregistrement et rejeu de trafic MQTT")
+    parser.add_argument('--broker', default=MQTT_BROKER, help="Broker MQTT (MQTT_BROKER)")
+    parser.add_argument('--port', type=int, default=MQTT_PORT, help="Port MQTT (MQTT_PORT)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    rec = sub.add_parser('record', help="Enregistrer le trafic dans un fichier .jsonl.gz")
+    rec.add_argument('-o', '--output', required=True, help="Fichier de sortie (.jsonl.gz)")
+    rec.add_argument('--topic', action='append',
+                     help=f"Filtre d'abonnement, répétable (défaut: {' '.join(DEFAULT_TOPICS)})")
+    rec.add_argument('--qos', type=int, default=1, choices=(0, 1, 2), help="QoS d'abonnement")
+    rec.add_argument('--duration', type=float, default=0, help="Durée max (s, 0 = jusqu'à Ctrl+C)")
+    rec.add_argument('--count', type=int, default=0, help="Nombre max de messages")
+
+    rep = sub.add_parser('replay', help="Rejouer un enregistrement")
+    rep.add_argument('file')
+    rep.add_argument('--speed', type=float, default=1.0, help="Facteur de vitesse (1, 10..., 0 = au plus vite)")
+    rep.add_argument('--loop', type=int, default=1, help="Nombre de passes")
+    rep.add_argument('--topic', action='append', help="Ne rejouer que ces filtres (répétable)")
+    rep.add_argument('--map', action='append', help="Remplacement de préfixe de topic ancien=nouveau")
+    rep.add_argument('--qos', type=int, choices=(0, 1, 2), help="Forcer la QoS de publication")
+    rep.add_argument('--fresh-ids', action='store_true',
+                     help="Nouveaux event_id/timestamp (sinon écartés comme doublons)")
+    rep.add_argument('--print', action='store_true', help="Afficher au lieu de publier")
+
+    inf = sub.add_parser('info', help="Résumé d'un enregistrement")
+    inf.add_argument('file')
+
+    args = parser.parse_args(argv)
+    return {'record': record, 'replay': replay, 'info': info}[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())